@@ -0,0 +1,68 @@
+"""
+Admission control: limit number of concurrently running requests
+of heavy routes, so they don't slow down the light ones.
+"""
+import threading
+import time
+
+
+class AdmissionLimit:
+    """
+    At most concurrency requests run at once and at most queue_size
+    wait for their turn no longer than timeout seconds.
+    Others are rejected at once.
+    """
+    def __init__(self, concurrency, queue_size=0, timeout=1.0):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self):
+        """
+        Return True, if request may run. Then release() should be called.
+        """
+        with self.condition:
+            if self.running >= self.concurrency:
+                if self.waiting >= self.queue_size:
+                    self.rejected += 1
+                    return False
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                deadline = time.monotonic() + self.timeout
+                try:
+                    while self.running >= self.concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.timed_out += 1
+                            return False
+                        self.condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.running += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                'concurrency': self.concurrency,
+                'queue_size': self.queue_size,
+                'running': self.running,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
@@ -0,0 +1,167 @@
+"""
+Mergeable sketches of towns birth dates for approximate ages percentiles.
+
+Sketch counts citizens by birth date buckets of fixed width, so it
+supports removal (needed for PATCH), merges by adding counts and takes
+memory proportional to number of buckets, not citizens. Birth date
+of any rank is estimated with error less than bucket width.
+"""
+import math
+import threading
+from collections import Counter, defaultdict
+from datetime import date
+
+from api_tools.stat_tools import get_age, interpolate
+
+
+class BirthDateSketch:
+    """
+    Counts of birth dates ordinals by buckets of resolution days.
+    """
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self.buckets = Counter()
+        self.count = 0
+
+    def add(self, ordinal, number=1):
+        bucket = ordinal // self.resolution
+        self.buckets[bucket] += number
+        self.count += number
+        if self.buckets[bucket] == 0:
+            del self.buckets[bucket]
+
+    def remove(self, ordinal):
+        self.add(ordinal, -1)
+
+    def merge(self, other):
+        for bucket, number in other.buckets.items():
+            self.add(bucket * self.resolution, number)
+
+    def get_birth_dates(self, ranks):
+        """
+        Estimate birth dates at given ranks counting from the youngest.
+        Ranks should be sorted.
+        """
+        birth_dates = []
+        ranks = iter(ranks)
+        rank = next(ranks, None)
+        seen = 0
+        for bucket in sorted(self.buckets, reverse=True):
+            seen += self.buckets[bucket]
+            while rank is not None and rank < seen:
+                # Middle of bucket.
+                ordinal = bucket * self.resolution + (self.resolution - 1) // 2
+                birth_dates.append(date.fromordinal(ordinal))
+                rank = next(ranks, None)
+        return birth_dates
+
+    def percentiles(self, fractions, today):
+        """
+        Approximate percentile_cont of ages.
+        """
+        positions = [fraction * (self.count - 1) for fraction in fractions]
+        ranks = sorted({rank for position in positions
+                        for rank in (math.floor(position),
+                                     math.ceil(position))})
+        ages = {rank: float(get_age(birth_date, today))
+                for rank, birth_date
+                in zip(ranks, self.get_birth_dates(ranks))}
+        return [interpolate(ages[math.floor(position)],
+                            ages[math.ceil(position)],
+                            position)
+                for position in positions]
+
+
+class TownsAgeSketch:
+    """
+    Birth date sketches of all towns of one import.
+    """
+    def __init__(self, resolution):
+        self.towns = defaultdict(lambda: BirthDateSketch(resolution))
+
+    def add(self, town, ordinal):
+        self.towns[town].add(ordinal)
+
+    def remove(self, town, ordinal):
+        sketch = self.towns[town]
+        sketch.remove(ordinal)
+        if sketch.count == 0:
+            del self.towns[town]
+
+    def percentiles(self, fractions, today):
+        return {town: sketch.percentiles(fractions, today)
+                for town, sketch in self.towns.items()}
+
+
+class ImportsAgeSketches:
+    """
+    Sketches of imports, kept by this process. Every sketch knows
+    version of import, which it shows. Change of import, which makes
+    its next version, is applied to sketch, otherwise sketch misses
+    changes (e.g. made by other process) and is dropped.
+    Resolution 0 turns sketches off.
+    """
+    def __init__(self, resolution=0):
+        self.resolution = resolution
+        self.lock = threading.Lock()
+        self.imports = {}
+        self.versions = {}
+
+    @property
+    def enabled(self):
+        return self.resolution > 0
+
+    def has(self, import_id):
+        return import_id in self.imports
+
+    def create(self, import_id, towns_birth_dates, version):
+        """
+        towns_birth_dates is iterable of (town, birth date ordinal)
+        of import of this version.
+        """
+        if not self.enabled:
+            return
+        towns_sketch = TownsAgeSketch(self.resolution)
+        for town, ordinal in towns_birth_dates:
+            towns_sketch.add(town, ordinal)
+        with self.lock:
+            self.imports[import_id] = towns_sketch
+            self.versions[import_id] = version
+
+    def update(self, import_id, version, changes=(), added=()):
+        """
+        Apply change of import, which made this version: changes are
+        (old, new) (town, birth date ordinal) of updated citizens,
+        added -- of appended ones.
+        """
+        with self.lock:
+            towns_sketch = self.imports.get(import_id)
+            if towns_sketch is None:
+                return
+            if self.versions[import_id] != version - 1:
+                del self.imports[import_id]
+                del self.versions[import_id]
+                return
+            for old_town_birth_date, new_town_birth_date in changes:
+                towns_sketch.remove(*old_town_birth_date)
+                towns_sketch.add(*new_town_birth_date)
+            for town, ordinal in added:
+                towns_sketch.add(town, ordinal)
+            self.versions[import_id] = version
+
+    def drop(self, import_id):
+        with self.lock:
+            self.imports.pop(import_id, None)
+            self.versions.pop(import_id, None)
+
+    def percentiles(self, import_id, fractions, today, version):
+        """
+        Return {town: percentiles}, or None if there is no sketch
+        of this version of import.
+        """
+        with self.lock:
+            towns_sketch = self.imports.get(import_id)
+            if towns_sketch is None \
+                    or self.versions[import_id] != version:
+                return None
+            return towns_sketch.percentiles(fractions, today)
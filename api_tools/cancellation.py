@@ -0,0 +1,152 @@
+"""
+Statement timeouts of requests and cancellation of their queries,
+when client disconnects, so abandoned heavy queries don't keep
+PostgreSQL backends and server workers busy.
+"""
+import time
+import select
+import socket
+import threading
+from contextlib import contextmanager
+
+import psycopg2.extensions
+from flask import g, has_request_context
+
+from api_tools.query_log import execute
+from api_tools.sql_queries import SET_STATEMENT_TIMEOUT_SQL
+
+# Servers, which give client socket to application.
+CLIENT_SOCKET_KEYS = ['werkzeug.socket', 'gunicorn.socket']
+
+
+class ClientDisconnected(Exception):
+    """
+    Query is cancelled, because client of request is gone.
+    """
+
+
+def get_client_socket(environ):
+    for key in CLIENT_SOCKET_KEYS:
+        if environ.get(key) is not None:
+            return environ[key]
+    return None
+
+
+def is_disconnected(client_socket):
+    """
+    Client has closed connection: socket is readable, but it's at EOF.
+    """
+    try:
+        readable, _, _ = select.select([client_socket], [], [], 0)
+        if not readable:
+            return False
+        return client_socket.recv(1, socket.MSG_PEEK) == b''
+    except (OSError, ValueError):
+        return True
+
+
+class RequestGuard:
+    """
+    Statement timeout (ms, 0 is no timeout) and client socket
+    (None, if server doesn't give it) of request.
+    """
+    def __init__(self, statement_timeout=0, client_socket=None):
+        self.statement_timeout = statement_timeout
+        self.client_socket = client_socket
+        self.disconnected = False
+
+
+class DisconnectWatcher:
+    """
+    While request with guard uses connection, background thread checks
+    its client every interval seconds (0 turns it off) and cancels
+    query of connection, if client is gone. Cancel may reach server
+    after query is finished and hit the next one, so connection,
+    which got cancel, is closed at the end of its use.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        # Guard of request, which uses connection.
+        self.watched = {}
+        # Watched connections, which got cancel.
+        self.cancel_sent = set()
+        self.thread = None
+        self.cancelled = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run,
+                                           name='disconnect_watcher',
+                                           daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.check()
+
+    def check(self):
+        """
+        Cancel queries of disconnected clients, return their number.
+        """
+        with self.lock:
+            watched = list(self.watched.items())
+        cancelled = 0
+        for conn, guard in watched:
+            if guard.disconnected or not is_disconnected(guard.client_socket):
+                continue
+            guard.disconnected = True
+            # Under lock connection can't be given to other request.
+            with self.lock:
+                if self.watched.get(conn) is guard:
+                    conn.cancel()
+                    self.cancel_sent.add(conn)
+                    cancelled += 1
+        self.cancelled += cancelled
+        return cancelled
+
+    @contextmanager
+    def watch(self, conn, guard):
+        if guard.client_socket is None or self.interval <= 0:
+            yield
+            return
+        with self.lock:
+            self.watched[conn] = guard
+            self.start()
+        try:
+            yield
+        finally:
+            with self.lock:
+                del self.watched[conn]
+                cancel_sent = conn in self.cancel_sent
+                self.cancel_sent.discard(conn)
+            if cancel_sent:
+                conn.close()
+
+    @contextmanager
+    def guard(self, conn):
+        """
+        Apply guard of current request (if it has one) to connection:
+        set its statement timeout for transaction and watch its client.
+        Query cancelled by watcher raises ClientDisconnected, as well as
+        use of connection, which got cancel after its query.
+        """
+        guard = g.get('request_guard') if has_request_context() else None
+        if guard is None:
+            yield
+            return
+        if guard.statement_timeout > 0:
+            with conn.cursor() as cur:
+                execute(cur, 'SET_STATEMENT_TIMEOUT',
+                        SET_STATEMENT_TIMEOUT_SQL,
+                        (guard.statement_timeout,))
+        try:
+            with self.watch(conn, guard):
+                yield
+        except psycopg2.extensions.QueryCanceledError:
+            if guard.disconnected:
+                raise ClientDisconnected('Client is disconnected.')
+            raise
+        if conn.closed:
+            raise ClientDisconnected('Client is disconnected.')
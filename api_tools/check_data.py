@@ -2,11 +2,18 @@
 Check, if citizens data is correct.
 """
 import re
-from datetime import datetime, timezone
+import time
+from datetime import date, datetime, timedelta
 from collections import Counter
+from functools import lru_cache
 
 
 DATE_FORMAT = '%d.%m.%Y'
+# Birth dates repeat a lot, and there are only ~40000 days in 110 years.
+DATE_CACHE_SIZE = 65536
+ASCII_DIGITS = frozenset('0123456789')
+EPOCH_DATE = date(1970, 1, 1)
+SECONDS_PER_DAY = 24 * 60 * 60
 MAX_INTEGER = 2147483647
 FIELDS = {
     'citizen_id': {
@@ -48,15 +55,43 @@ FIELDS = {
 POSSIBLE_GENDERS = ['male', 'female']
 
 
+@lru_cache(maxsize=1)
+def get_epoch_date(days):
+    return EPOCH_DATE + timedelta(days=days)
+
+
 def get_today():
-    return datetime.now(timezone.utc).date()
+    """
+    Current UTC date, recalculated only when day changes.
+    """
+    return get_epoch_date(int(time.time() // SECONDS_PER_DAY))
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_date(date_string):
+    """
+    Parse DD.MM.YYYY date. Day and month of ASCII digits are parsed
+    by hand, everything else is left to strptime, so accepted dates
+    are the same.
+    """
+    parts = date_string.split('.')
+    if len(parts) == 3:
+        day, month, year = parts
+        if (0 < len(day) <= 2 and 0 < len(month) <= 2 and len(year) == 4
+                and ASCII_DIGITS.issuperset(day + month + year)):
+            return date(int(year), int(month), int(day))
+    return datetime.strptime(date_string, DATE_FORMAT).date()
 
 
 def str_to_date(date_string, format=DATE_FORMAT):
+    if format == DATE_FORMAT:
+        return parse_date(date_string)
     return datetime.strptime(date_string, format).date()
 
 
 def date_to_str(date, format=DATE_FORMAT):
+    if format == DATE_FORMAT:
+        return '{:02d}.{:02d}.{:04d}'.format(date.day, date.month, date.year)
     return datetime.strftime(date, format)
 
 
@@ -151,29 +186,47 @@ def check_update_citizen(citizen_data):
     # Later we should check, if relatives update is correct.
 
 
-def check_citizens_group(citizens_group):
+def check_citizens_list(citizens_group):
+    """
+    Check every citizen's data, but not relationships between them.
+    """
     if not isinstance(citizens_group, list):
         raise ValueError("Citizens data should be list, not {}"
                          .format(type(citizens_group)))
-
-    # Check every citizen's data.
     for citizen in citizens_group:
         check_init_citizen(citizen)
 
-    # Check correct relationships.
-    citizens = [citizen['citizen_id'] for citizen in citizens_group]
+
+def check_citizens_group(citizens_group):
+    check_citizens_list(citizens_group)
+    check_relationships([(citizen['citizen_id'], citizen['relatives'])
+                         for citizen in citizens_group])
+
+
+def check_relationships(citizens_relatives, existing_citizens=()):
+    """
+    citizens_relatives is list of (citizen_id, relatives ids),
+    relationships should be symmetric.
+    If group is appended to import, existing_citizens are its citizens:
+    relations with them are one-sided in group.
+    """
+    citizens = [citizen_id for citizen_id, _ in citizens_relatives]
     uniq_citizens = list(set(citizens))
 
     pairs_counter = Counter()
     if len(uniq_citizens) != len(citizens):
         raise ValueError('There are not unique citizen ids.')
-    for citizen in citizens_group:
-        relatives = citizen['relatives']
+    for citizen_id in citizens:
+        if citizen_id in existing_citizens:
+            raise ValueError('Citizen {} is already in import.'
+                             .format(citizen_id))
+    for citizen_id, relatives in citizens_relatives:
         uniq_relatives = list(set(relatives))
         if len(uniq_relatives) != len(relatives):
             raise ValueError('{} has not unique citizen ids.')
-        citizen_id = citizen['citizen_id']
         for relative_id in relatives:
+            if relative_id in existing_citizens:
+                continue
             incoming_edge = (relative_id, citizen_id)
             outgoing_edge = (citizen_id, relative_id)
             pairs_counter[outgoing_edge] += 1
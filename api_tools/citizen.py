@@ -0,0 +1,61 @@
+"""
+Compact citizen record, used from validated JSON to API answer.
+"""
+from array import array
+from collections import namedtuple
+from json.encoder import encode_basestring_ascii as encode_string
+
+from api_tools.check_data import FIELDS
+
+# Keys are sorted and separators are compact, as at Flask jsonify.
+CITIZEN_JSON_PATTERN = (
+    '{"apartment":%d,'
+    '"birth_date":%s,'
+    '"building":%s,'
+    '"citizen_id":%d,'
+    '"gender":%s,'
+    '"name":%s,'
+    '"relatives":%s,'
+    '"street":%s,'
+    '"town":%s}')
+
+
+class Citizen(namedtuple('Citizen', list(FIELDS))):
+    """
+    Citizen data as tuple without per-record dict.
+    Birth date is DD.MM.YYYY string, relatives are array of ints.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, citizen_data):
+        return cls.from_row(tuple(citizen_data[field] for field in FIELDS))
+
+    @classmethod
+    def from_row(cls, citizen_tuple):
+        """
+        Record from tuple of fields values, as they are at DB.
+        """
+        return tuple.__new__(cls, (*citizen_tuple[:-1],
+                                   array('i', citizen_tuple[-1])))
+
+    def to_dict(self):
+        citizen_data = self._asdict()
+        citizen_data['relatives'] = list(self.relatives)
+        return dict(citizen_data)
+
+    def to_json(self):
+        return CITIZEN_JSON_PATTERN % (
+            self.apartment,
+            encode_string(self.birth_date),
+            encode_string(self.building),
+            self.citizen_id,
+            encode_string(self.gender),
+            encode_string(self.name),
+            str(self.relatives.tolist()).replace(' ', ''),
+            encode_string(self.street),
+            encode_string(self.town))
+
+
+def citizens_to_json(citizens):
+    return '[' + ','.join([citizen.to_json() for citizen in citizens]) + ']'
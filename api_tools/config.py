@@ -0,0 +1,115 @@
+"""
+Service settings. Every setting can be overridden by environment variable
+with the same name.
+"""
+import os
+
+
+def get_env(name, default, cast=str):
+    value = os.environ.get(name)
+    if value is None or value == '':
+        return default
+    return cast(value)
+
+
+LOG_LEVEL = get_env('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = '%(asctime)s %(levelname)s:%(module)s %(message)s'
+# Part of requests (from 0 to 1), which are logged with DEBUG level
+# regardless of LOG_LEVEL.
+DEBUG_SAMPLE_RATE = get_env('DEBUG_SAMPLE_RATE', 0.0, float)
+
+# 'postgres' or 'memory'.
+STORAGE_ENGINE = get_env('STORAGE_ENGINE', 'postgres')
+DB_NAME = get_env('DB_NAME', 'api_db')
+DB_USER = get_env('DB_USER', 'api')
+DB_HOST = get_env('DB_HOST', 'db')
+# Hosts of PostgreSQL shards ('host' or 'host:port', separated by
+# commas) with the same DB_NAME and DB_USER. Imports are spread over them
+# by import_id. Empty is one DB at DB_HOST.
+DB_SHARDS = get_env('DB_SHARDS', '')
+# Number of idle DB connections, which are kept open. Schema migrations
+# are applied before the first one is opened.
+DB_POOL_SIZE = get_env('DB_POOL_SIZE', 4, int)
+# Requests wait for connection, when so many are in use (0 is no limit).
+DB_MAX_CONNECTIONS = get_env('DB_MAX_CONNECTIONS', 20, int)
+# Group commit of PATCHes: PATCHes of one import, which come within
+# PATCH_BATCH_DELAY_SECONDS after the first one, are applied in one
+# transaction, at most PATCH_BATCH_SIZE at once. 0 or 1 turns it off.
+PATCH_BATCH_SIZE = get_env('PATCH_BATCH_SIZE', 0, int)
+PATCH_BATCH_DELAY_SECONDS = get_env('PATCH_BATCH_DELAY_SECONDS', 0.002, float)
+# zlib level of import snapshots: 1 is the fastest, 9 is the smallest.
+SNAPSHOT_COMPRESSION_LEVEL = get_env('SNAPSHOT_COMPRESSION_LEVEL', 1, int)
+# How memory engine calculates stats: 'python' or 'numpy'.
+ANALYTICS_ENGINE = get_env('ANALYTICS_ENGINE', 'python')
+# Width (in days) of birth date buckets at age sketches: error bound
+# of approximate ages percentiles. 0 turns sketches off.
+AGE_SKETCH_RESOLUTION_DAYS = get_env('AGE_SKETCH_RESOLUTION_DAYS', 0, int)
+# Default mode of ages stat: 'exact' or 'approximate'.
+# Request can choose it with 'mode' argument.
+AGES_STAT_MODE = get_env('AGES_STAT_MODE', 'exact')
+# Who renders GET answers of PostgreSQL engine to JSON: 'python' or 'db'.
+JSON_RENDERING = get_env('JSON_RENDERING', 'python')
+# Imports retention: imports older than IMPORTS_MAX_AGE_SECONDS and
+# the oldest ones above IMPORTS_MAX_COUNT are deleted in background
+# every RETENTION_INTERVAL_SECONDS, RETENTION_BATCH_SIZE at once.
+# 0 turns limit off.
+IMPORTS_MAX_AGE_SECONDS = get_env('IMPORTS_MAX_AGE_SECONDS', 0, float)
+IMPORTS_MAX_COUNT = get_env('IMPORTS_MAX_COUNT', 0, int)
+RETENTION_INTERVAL_SECONDS = get_env('RETENTION_INTERVAL_SECONDS', 60, float)
+RETENTION_BATCH_SIZE = get_env('RETENTION_BATCH_SIZE', 10, int)
+# Admission control of analytic routes (birthdays and ages stat):
+# every route runs at most ANALYTICS_CONCURRENCY requests at once,
+# at most ANALYTICS_QUEUE_SIZE more wait up to
+# ANALYTICS_QUEUE_TIMEOUT_SECONDS, others get 503 with Retry-After.
+# 0 turns limit off.
+ANALYTICS_CONCURRENCY = get_env('ANALYTICS_CONCURRENCY', 0, int)
+ANALYTICS_QUEUE_SIZE = get_env('ANALYTICS_QUEUE_SIZE', 0, int)
+ANALYTICS_QUEUE_TIMEOUT_SECONDS = get_env('ANALYTICS_QUEUE_TIMEOUT_SECONDS',
+                                          1.0, float)
+RETRY_AFTER_SECONDS = get_env('RETRY_AFTER_SECONDS', 1, int)
+# Statement timeouts (ms, 0 is no timeout) of GET routes: citizens list
+# and analytic routes (birthdays and ages stat). Too long request gets 503
+# with Retry-After. Queries of these routes are also cancelled, when
+# client disconnects: it's checked every CANCEL_CHECK_INTERVAL_SECONDS
+# (0 turns it off), if server gives client socket (werkzeug, gunicorn).
+READ_STATEMENT_TIMEOUT_MS = get_env('READ_STATEMENT_TIMEOUT_MS', 0, int)
+ANALYTICS_STATEMENT_TIMEOUT_MS = get_env('ANALYTICS_STATEMENT_TIMEOUT_MS',
+                                         0, int)
+CANCEL_CHECK_INTERVAL_SECONDS = get_env('CANCEL_CHECK_INTERVAL_SECONDS',
+                                        0.1, float)
+# 1: concurrent identical GET requests to the same import version
+# share one calculation, 0: every request is calculated separately.
+COALESCE_READS = get_env('COALESCE_READS', 1, int)
+# Cache of GET answers of PostgreSQL engine, shared by worker processes
+# of host: answers are files at RESULT_CACHE_DIR (tmpfs is better,
+# e.g. /dev/shm/api_results), up to RESULT_CACHE_MAX_BYTES, the least
+# recently used are evicted. Empty RESULT_CACHE_DIR turns it off.
+RESULT_CACHE_DIR = get_env('RESULT_CACHE_DIR', '')
+RESULT_CACHE_MAX_BYTES = get_env('RESULT_CACHE_MAX_BYTES',
+                                 256 * 1024 * 1024, int)
+# Profiling of requests: 1 turns it on. Then request is profiled,
+# if it has PROFILE_HEADER header (with value not '0') or it's sampled
+# with PROFILE_SAMPLE_RATE probability. PROFILE_FORMAT is 'pstats'
+# (cProfile) or 'collapsed' (sampled stacks for flame graphs).
+# The latest PROFILE_MAX_FILES profiles are kept at PROFILE_DIR.
+PROFILING = get_env('PROFILING', 0, int)
+PROFILE_HEADER = get_env('PROFILE_HEADER', 'X-Profile')
+PROFILE_SAMPLE_RATE = get_env('PROFILE_SAMPLE_RATE', 0.0, float)
+PROFILE_FORMAT = get_env('PROFILE_FORMAT', 'pstats')
+PROFILE_SAMPLING_INTERVAL_SECONDS = get_env(
+    'PROFILE_SAMPLING_INTERVAL_SECONDS', 0.001, float)
+PROFILE_DIR = get_env('PROFILE_DIR', '/tmp/api_profiles')
+PROFILE_MAX_FILES = get_env('PROFILE_MAX_FILES', 50, int)
+
+# Slow queries log: DB statements longer than SLOW_QUERY_THRESHOLD_MS
+# (0 turns it off) are logged with import size, sampled ones with
+# SLOW_QUERY_EXPLAIN_SAMPLE_RATE probability also with EXPLAIN plan.
+# Records are JSON lines at rotated SLOW_QUERY_LOG_PATH file,
+# if it's set, otherwise they go to the main log.
+SLOW_QUERY_THRESHOLD_MS = get_env('SLOW_QUERY_THRESHOLD_MS', 0.0, float)
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = get_env(
+    'SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1, float)
+SLOW_QUERY_LOG_PATH = get_env('SLOW_QUERY_LOG_PATH', '')
+SLOW_QUERY_LOG_MAX_BYTES = get_env('SLOW_QUERY_LOG_MAX_BYTES',
+                                   10 * 1024 * 1024, int)
+SLOW_QUERY_LOG_BACKUP_COUNT = get_env('SLOW_QUERY_LOG_BACKUP_COUNT', 5, int)
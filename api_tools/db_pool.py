@@ -0,0 +1,123 @@
+"""
+Pool of PostgreSQL connections, so requests don't open
+and prepare connection every time.
+"""
+import queue
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+class ConnectionPool:
+    """
+    Keep up to size idle connections. If there is no idle one,
+    new connection is opened, extra ones are closed on release.
+    At most max_connections (0 is no limit) are taken at once,
+    others wait for them.
+    setup() is called once before the first connection is opened
+    (until it succeeds), prepare(conn) -- for every new connection.
+    guard(conn) is context manager around every use of connection.
+    """
+    def __init__(self, credentials, size=0, max_connections=0,
+                 setup=None, prepare=None, guard=None):
+        self.credentials = credentials
+        self.size = size
+        self.setup = setup
+        self.prepare = prepare
+        self.guard = guard
+        self.limit = None
+        if max_connections > 0:
+            self.limit = threading.BoundedSemaphore(max_connections)
+        self.setup_lock = threading.Lock()
+        self.is_set_up = setup is None
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+
+    def open(self):
+        with self.setup_lock:
+            if not self.is_set_up:
+                self.setup()
+                self.is_set_up = True
+        conn = psycopg2.connect(**self.credentials)
+        try:
+            if self.prepare is not None:
+                self.prepare(conn)
+        except Exception:
+            conn.close()
+            raise
+        self.opened += 1
+        return conn
+
+    def take(self):
+        if self.limit is not None:
+            self.limit.acquire()
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self.open()
+        except Exception:
+            if self.limit is not None:
+                self.limit.release()
+            raise
+
+    def release(self, conn):
+        try:
+            if conn.closed:
+                return
+            if self.idle.qsize() >= self.size:
+                conn.close()
+                return
+            conn.autocommit = False
+            self.idle.put(conn)
+        finally:
+            # Connection is back, so waiting request can take it.
+            if self.limit is not None:
+                self.limit.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Connection, which is committed (or rolled back) at exit
+        and returned to pool. Broken connections are dropped,
+        ones with cancelled query are kept (unless guard closes them).
+        """
+        conn = self.take()
+        try:
+            if self.guard is None:
+                yield conn
+            else:
+                with self.guard(conn):
+                    yield conn
+            conn.commit()
+        except psycopg2.extensions.QueryCanceledError:
+            # Timeout or cancel, connection itself is fine.
+            conn.rollback()
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            conn.close()
+            raise
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def warm_up(self):
+        """
+        Open idle connections up to size, return their number.
+        """
+        while self.idle.qsize() < self.size:
+            self.idle.put(self.open())
+        return self.idle.qsize()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,99 @@
+"""
+Imports are spread over several PostgreSQL databases (shards) by import_id.
+
+Shard i of n allocates ids from its own sequence: i, i + n, i + 2n...
+So ids are unique without coordination between shards, and shard
+of import is import_id % n. Number of shards can't be changed without
+moving imports, because their ids would point to other shards.
+"""
+import itertools
+
+from flask import current_app as app
+
+from api_tools.query_log import execute
+from api_tools.sql_queries import (
+    LOCK_REGISTRY_SQL,
+    GET_SEQUENCE_SQL,
+    RESTART_SEQUENCE_SQL,
+)
+
+
+def parse_hosts(hosts):
+    """
+    'host[:port],...' to list of credentials parts.
+    """
+    shards = []
+    for host in hosts.split(','):
+        host = host.strip()
+        if not host:
+            continue
+        name, _, port = host.rpartition(':')
+        if name and port.isdigit():
+            shards.append({'host': name, 'port': int(port)})
+        else:
+            shards.append({'host': host})
+    return shards
+
+
+def get_restart_id(increment, last_value, start_value, index, count):
+    """
+    Id, which sequence of shard index of count shards should restart
+    with, or None, if it already gives ids of this shard.
+    Ids, which could be given, are never reused.
+    """
+    if last_value is None:
+        next_id = start_value
+        lowest_id = start_value
+    else:
+        next_id = last_value + increment
+        lowest_id = last_value + 1
+    if increment == count and next_id % count == index:
+        return None
+    return lowest_id + (index - lowest_id) % count
+
+
+def configure_sequence(cur, index, count):
+    """
+    Make import ids sequence give ids of shard index.
+    """
+    execute(cur, 'LOCK_REGISTRY', LOCK_REGISTRY_SQL)
+    execute(cur, 'GET_SEQUENCE', GET_SEQUENCE_SQL)
+    restart_id = get_restart_id(*cur.fetchone(), index, count)
+    if restart_id is None:
+        return
+    execute(cur, 'RESTART_SEQUENCE',
+            RESTART_SEQUENCE_SQL.format(increment=count, start=restart_id))
+    app.logger.info('Shard %d of %d: import ids start from %d.',
+                    index, count, restart_id)
+
+
+class Shards:
+    """
+    Connection pools of shards. New imports are created at shards
+    in turn.
+    """
+    def __init__(self, pools):
+        self.pools = pools
+        self.turns = itertools.cycle(pools)
+
+    def __len__(self):
+        return len(self.pools)
+
+    def get(self, import_id):
+        """
+        Pool of shard, which keeps import.
+        """
+        return self.pools[import_id % len(self.pools)]
+
+    def next(self):
+        """
+        Pool of shard for new import.
+        """
+        return next(self.turns)
+
+    def warm_up(self):
+        return sum(pool.warm_up() for pool in self.pools)
+
+    def close(self):
+        for pool in self.pools:
+            pool.close()
@@ -1,55 +1,155 @@
 """
 Tools to put and get data from DB.
 """
-import re
-from collections import defaultdict
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import partial
+from itertools import groupby
+from operator import itemgetter
 
 import psycopg2
-from flask import current_app as app
+import psycopg2.errors
+import psycopg2.extensions
+from flask import current_app as app, has_app_context
 
+from api_tools import config
+from api_tools.citizen import Citizen
+from api_tools.storage import StorageEngine
+from api_tools.query_log import execute, copy
+from api_tools.snapshot import (
+    CompressingWriter,
+    DecompressingReader,
+    write_snapshot,
+    read_header,
+)
+from api_tools.db_pool import ConnectionPool
+from api_tools.cancellation import DisconnectWatcher
+from api_tools.db_shards import Shards, parse_hosts, configure_sequence
+from api_tools.write_batcher import WriteBatcher
+from api_tools.migrations import SCHEMA_VERSION, migrate
+from api_tools.relatives_graph import (
+    ImportsRelativesGraphs,
+    check_citizens_exist,
+)
+from api_tools.stat_tools import (
+    PERCENTILES,
+    percentile_cont_histogram,
+    format_ages_stat,
+)
 from api_tools.check_data import (
     DATE_FORMAT,
     str_to_date,
     date_to_str,
+    get_today,
+    check_relationships,
 )
 from api_tools.sql_queries import (
-    SET_TIMEZONE_SQL,
-    GET_TABLES_SQL,
-    CREATE_TYPE_SQL,
+    REGISTER_IMPORT_SQL,
+    GET_IMPORTS_SQL,
+    DROP_TABLE_SQL,
+    UNREGISTER_IMPORT_SQL,
     CREATE_TABLE_SQL,
     INSERT_DATA_PATTERN,
-    FIELD_NAMES,
     INSERT_INTO_SQL,
     CHECK_IF_TABLE_EXISTS_SQL,
     CHECK_IF_CITIZEN_EXISTS_SQL,
     GET_FULL_TABLE_SQL,
     UPDATE_SQL,
+    CREATE_INDEXES_SQL,
+    VACUUM_ANALYZE_SQL,
+    ADD_RELATIVE_SQL,
+    REMOVE_BACK_LINK_SQL,
+    ADD_BACK_LINKS_SQL,
+    LOCK_CITIZENS_SQL,
+    LOCK_BATCH_SQL,
+    ROLLBACK_TO_SAVEPOINT_SQL,
+    LOCK_ROWS_SQL,
+    GET_EXISTING_CITIZENS_SQL,
+    SAVEPOINT_UPDATE_SQL,
+    ROLLBACK_TO_UPDATE_SQL,
+    RELEASE_UPDATE_SQL,
     GET_RELATIVES_SQL,
+    GET_TOWNS_BIRTH_DATES_SQL,
     GET_CITIZEN_SQL,
     GET_BIRTHDAYS_SQL,
     GET_AGES_SQL,
+    GET_FULL_TABLE_JSON_SQL,
+    GET_BIRTHDAYS_JSON_SQL,
+    GET_AGES_JSON_SQL,
+    PREPARE_STATEMENTS_SQL,
+    FIELD_NAMES,
+    COPY_TO_SQL,
+    COPY_FROM_SQL,
 )
 
 DB_CREDENTIALS = {
-    'dbname': 'api_db',
-    'user': 'api',
-    'host': 'db',
+    'dbname': config.DB_NAME,
+    'user': config.DB_USER,
+    'host': config.DB_HOST,
 }
-TABLE_NAME_PATTERN = 'import_(\\d+)'
 POSTGRES_DATE_FORMAT = '%Y-%m-%d'
+# Import ids are integer column of imports registry.
+MAX_IMPORT_ID = 2 ** 31 - 1
+# PATCH is retried, if it's rolled back because of deadlock.
+PATCH_ATTEMPTS = 3
+
+
+def migrate_schema(credentials, index=0, count=1):
+    """
+    Apply schema migrations with separate connection, so pooled ones
+    are opened after them and get new role defaults. Sequence of
+    import ids is set to give ids of shard index of count.
+    """
+    conn = psycopg2.connect(**credentials)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                versions = migrate(cur)
+                configure_sequence(cur, index, count)
+        app.logger.info('Schema of shard %d is ready, %d migrations applied.',
+                        index,
+                        len(versions))
+    finally:
+        conn.close()
+
+
+def prepare_connection(conn):
+    with conn.cursor() as cur:
+        execute(cur, 'PREPARE_STATEMENTS', PREPARE_STATEMENTS_SQL)
+    conn.commit()
+
+
+SHARDS_CREDENTIALS = [dict(DB_CREDENTIALS, **host)
+                      for host in parse_hosts(config.DB_SHARDS)] \
+    or [DB_CREDENTIALS]
+
+
+disconnect_watcher = DisconnectWatcher(config.CANCEL_CHECK_INTERVAL_SECONDS)
+
+
+def create_shards(shards_credentials):
+    return Shards([
+        ConnectionPool(credentials,
+                       size=config.DB_POOL_SIZE,
+                       max_connections=config.DB_MAX_CONNECTIONS,
+                       setup=partial(migrate_schema, credentials, index,
+                                     len(shards_credentials)),
+                       prepare=prepare_connection,
+                       guard=disconnect_watcher.guard)
+        for index, credentials in enumerate(shards_credentials)])
+
+
+shards = create_shards(SHARDS_CREDENTIALS)
 
 
 def get_new_table_id(cur):
     """
     For new import create new unique import id.
     """
-    cur.execute(GET_TABLES_SQL)
-    table_ids = [int(re.match(TABLE_NAME_PATTERN, table[0])[1])
-                 for table in cur.fetchall()
-                 if re.match(TABLE_NAME_PATTERN, table[0]) is not None]
-    if len(table_ids) == 0:
-        return 0
-    return max(table_ids) + 1
+    execute(cur, 'REGISTER_IMPORT', REGISTER_IMPORT_SQL)
+    return cur.fetchone()[0]
 
 
 def accurate_rounding(number, precision):
@@ -61,15 +161,28 @@ def convert_date_string(date_string,
                         input_format=DATE_FORMAT,
                         output_format=POSTGRES_DATE_FORMAT):
     date = str_to_date(date_string, input_format)
+    if output_format == POSTGRES_DATE_FORMAT:
+        return date.isoformat()
     return date_to_str(date, output_format)
 
 
+def check_import_id(import_id):
+    """
+    Import ids are integer, bigger ids can't exist
+    (and can't be passed to prepared statements).
+    """
+    if not 0 <= import_id <= MAX_IMPORT_ID:
+        raise ValueError('There is no import {}'
+                         .format(import_id))
+
+
 def check_import_exists(import_id, cur):
     """
     Does import with this id really exist?
     """
+    check_import_id(import_id)
     sql = CHECK_IF_TABLE_EXISTS_SQL.format(import_id=import_id)
-    cur.execute(sql)
+    execute(cur, 'CHECK_IF_TABLE_EXISTS', sql, import_id=import_id)
     result = cur.fetchall()[0][0]
     app.logger.debug('to_regclass() output for import %d: %s',
                      import_id,
@@ -85,7 +198,7 @@ def check_citizen_exists(import_id, citizen_id, cur):
     """
     sql = CHECK_IF_CITIZEN_EXISTS_SQL.format(import_id=import_id,
                                              citizen_id=citizen_id)
-    cur.execute(sql)
+    execute(cur, 'CHECK_IF_CITIZEN_EXISTS', sql, import_id=import_id)
     result = cur.fetchall()[0][0]
     app.logger.debug('Is citizen %d in import %d: %s',
                      citizen_id,
@@ -105,27 +218,29 @@ def check_citizen_relatives_exist(import_id, citizen_update, cur):
             check_citizen_exists(import_id, relative_id, cur)
 
 
-def citizen_data_to_string(citizen_data, cur):
+def citizen_data_to_string(citizen, cur):
     """
-    Convert citizen data to table insert format.
+    Convert citizen record to table insert format.
     """
-    data = []
-    for field in FIELD_NAMES:
-        value = citizen_data[field]
-        if field == 'birth_date':
-            value = convert_date_string(value)
-        data.append(value)
+    data = (citizen.citizen_id,
+            citizen.town,
+            citizen.street,
+            citizen.building,
+            citizen.apartment,
+            citizen.name,
+            convert_date_string(citizen.birth_date),
+            citizen.gender,
+            citizen.relatives.tolist())
     return (cur
-            .mogrify(INSERT_DATA_PATTERN, tuple(data))
+            .mogrify(INSERT_DATA_PATTERN, data)
             .decode('utf-8'))
 
 
 def tuple_to_citizen_data(citizen_tuple):
     """
-    Convert DB answer to dict.
+    Convert DB answer to citizen record.
     """
-    return {field: value for field, value
-            in zip(FIELD_NAMES, citizen_tuple)}
+    return Citizen.from_row(citizen_tuple)
 
 
 def prepare_update_info_sql(
@@ -150,69 +265,59 @@ def prepare_update_info_sql(
                              citizen_id=citizen_id)
 
 
-def get_current_relatives(
-        import_id,
-        citizen_id,
-        cur):
-    """
-    Load list if current relatives of given citizen.
+def lock_citizens(import_id, citizen_id, relatives, cur):
     """
-    cur.execute(GET_RELATIVES_SQL.format(import_id=import_id,
-                                         citizen_id=citizen_id))
-    return cur.fetchall()[0][0]
-
-
-def remove_relative(
-        import_id,
-        citizen_id,
-        relative_id,
-        cur):
+    Lock rows of citizen, his current and new relatives in order of ids,
+    return current relatives of citizen.
+    Current relatives are read by the same statement before rows
+    are locked. If they are changed meanwhile, locks are released
+    and taken again with new ones, so they are always taken in order
+    and don't deadlock.
     """
-    Remove relative from this citizen's relatives.
-    """
-    app.logger.debug('Removing %d from %d relatives...',
-                     relative_id,
-                     citizen_id)
-    current_relatives = get_current_relatives(import_id, citizen_id, cur)
-    new_relatives = []
-    for relative in current_relatives:
-        if relative != relative_id:
-            new_relatives.append(relative)
-    app.logger.debug('%d new relatives: %s',
-                     citizen_id,
-                     new_relatives)
-    update_data = {'relatives': new_relatives}
-    sql = prepare_update_info_sql(
-        import_id,
-        citizen_id,
-        update_data,
-        cur)
-    cur.execute(sql)
+    citizen_ids = set(relatives)
+    while True:
+        execute(cur, 'LOCK_CITIZENS',
+                LOCK_CITIZENS_SQL.format(import_id=import_id,
+                                         citizen_id=citizen_id),
+                (sorted(citizen_ids),),
+                import_id)
+        rows = dict(cur.fetchall())
+        missing = sorted(set([citizen_id] + list(relatives))
+                         .difference(rows))
+        if missing:
+            raise ValueError('There is no citizen {} in import {}'
+                             .format(missing[0], import_id))
+        current_relatives = rows[citizen_id]
+        if set(rows).issuperset(current_relatives):
+            return current_relatives
+        execute(cur, 'ROLLBACK_TO_SAVEPOINT', ROLLBACK_TO_SAVEPOINT_SQL)
+        citizen_ids.update(current_relatives)
 
 
-def add_relative(
+def update_back_links(
         import_id,
         citizen_id,
-        relative_id,
+        removed,
+        added,
         cur):
     """
-    Add relative to this citizen's realtives.
+    Remove citizen from relatives of removed citizens
+    and add him to relatives of added ones.
     """
-    app.logger.debug('Adding %d to %d relatives...',
-                     relative_id,
-                     citizen_id)
-    new_relatives = get_current_relatives(import_id, citizen_id, cur)
-    new_relatives.append(relative_id)
-    app.logger.debug('%d new relatives: %s',
-                     citizen_id,
-                     new_relatives)
-    update_data = {'relatives': new_relatives}
-    sql = prepare_update_info_sql(
-        import_id,
-        citizen_id,
-        update_data,
-        cur)
-    cur.execute(sql)
+    if removed:
+        app.logger.debug('Removing %d from %s...', citizen_id, removed)
+        execute(cur, 'REMOVE_BACK_LINK',
+                REMOVE_BACK_LINK_SQL.format(import_id=import_id,
+                                            citizen_id=citizen_id),
+                (removed,),
+                import_id)
+    if added:
+        app.logger.debug('Adding %d to %s...', citizen_id, added)
+        execute(cur, 'ADD_RELATIVE',
+                ADD_RELATIVE_SQL.format(import_id=import_id,
+                                        citizen_id=citizen_id),
+                (added,),
+                import_id)
 
 
 def prepare_birthday_stat(import_id, cur):
@@ -220,7 +325,9 @@ def prepare_birthday_stat(import_id, cur):
     Load from database and convert to answer format birthdays presents stat.
     """
     data = defaultdict(list)
-    cur.execute(GET_BIRTHDAYS_SQL.format(import_id=import_id))
+    execute(cur, 'GET_BIRTHDAYS',
+            GET_BIRTHDAYS_SQL.format(import_id=import_id),
+            import_id=import_id)
     for row in cur.fetchall():
         citizen_dict = {
             'citizen_id': row[1],
@@ -232,37 +339,48 @@ def prepare_birthday_stat(import_id, cur):
 
 def prepare_ages_stat(import_id, cur):
     """
-    Load from database and convert to answer format ages stat.
+    Load from database ages histograms and convert to answer format
+    ages stat.
     """
-    data = []
-    cur.execute(GET_AGES_SQL.format(import_id=import_id))
-    for row in cur.fetchall():
-        town_dict = {
-            'town': row[0],
-            'p50': float(row[1]),
-            'p75': float(row[2]),
-            'p99': float(row[3]),
-        }
-        app.logger.debug('Town ages stat dict: {}'.format(town_dict))
-        data.append(town_dict)
-    return data
+    towns_percentiles = {}
+    execute(cur, 'GET_AGES',
+            GET_AGES_SQL.format(import_id=import_id),
+            import_id=import_id)
+    for town, rows in groupby(cur.fetchall(), key=itemgetter(0)):
+        ages_counts = [(int(age), number) for _, age, number in rows]
+        towns_percentiles[town] = [
+            percentile_cont_histogram(ages_counts, fraction)
+            for _, fraction in PERCENTILES]
+        app.logger.debug('Town %s ages percentiles: %s',
+                         town,
+                         towns_percentiles[town])
+    return format_ages_stat(towns_percentiles)
+
+
+def vacuum_table(import_id, conn):
+    """
+    Vacuum and analyze table outside of transaction.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        execute(cur, 'VACUUM_ANALYZE',
+                VACUUM_ANALYZE_SQL.format(import_id=import_id),
+                import_id=import_id)
+    app.logger.debug('Table \'import_%d\' has been vacuumed.', import_id)
 
 
 def save_new_import(citizens):
     """
     Create table, save there data, return table id.
     """
-    with psycopg2.connect(**DB_CREDENTIALS) as conn:
+    with shards.next().connection() as conn:
         with conn.cursor() as cur:
             app.logger.debug('DB cursor is ready...')
-            cur.execute(SET_TIMEZONE_SQL)
-            app.logger.debug('Set GMT as timezone.')
-            cur.execute(CREATE_TYPE_SQL)
-            app.logger.debug('Create gender type.')
 
             import_id = get_new_table_id(cur)
             app.logger.debug('New import id is %d', import_id)
-            cur.execute(CREATE_TABLE_SQL.format(import_id=import_id))
+            execute(cur, 'CREATE_TABLE',
+                    CREATE_TABLE_SQL.format(import_id=import_id))
             app.logger.debug('Table \'import_%d\' has been created.', import_id)
 
             citizens_str_data = [citizen_data_to_string(citizen_data, cur)
@@ -272,88 +390,331 @@ def save_new_import(citizens):
             data_to_insert = ','.join(citizens_str_data)
 
             app.logger.debug('Data inserting...')
-            cur.execute(INSERT_INTO_SQL.format(import_id=import_id)
-                        + data_to_insert)
+            execute(cur, 'INSERT_INTO',
+                    INSERT_INTO_SQL.format(import_id=import_id)
+                    + data_to_insert,
+                    import_id=import_id)
+            app.logger.debug('Indexes building...')
+            execute(cur, 'CREATE_INDEXES',
+                    CREATE_INDEXES_SQL.format(import_id=import_id),
+                    import_id=import_id)
             app.logger.debug('Success!')
             conn.commit()
-            return {"import_id": import_id}
+        vacuum_table(import_id, conn)
+    return {"import_id": import_id}
+
+
+def append_citizens(import_id, citizens, graph):
+    """
+    Insert new citizens to table(import) and add back-links to them
+    to relatives of its citizens. Relatives graph of import is updated
+    before commit, so caller should drop it, if commit fails.
+    Back-links are checked by table, in case graph is outdated.
+    """
+    citizens_relatives = [(citizen.citizen_id, citizen.relatives)
+                          for citizen in citizens]
+    back_links = graph.get_back_links(citizens_relatives)
+    with shards.get(import_id).connection() as conn:
+        with conn.cursor() as cur:
+            data_to_insert = ','.join(
+                citizen_data_to_string(citizen_data, cur)
+                for citizen_data in citizens)
+            app.logger.debug('Inserting %d citizens to import %d...',
+                             len(citizens),
+                             import_id)
+            try:
+                execute(cur, 'INSERT_INTO',
+                        INSERT_INTO_SQL.format(import_id=import_id)
+                        + data_to_insert,
+                        import_id=import_id)
+            except psycopg2.IntegrityError:
+                # The same citizens are appended concurrently.
+                raise ValueError('Citizens are already in import {}.'
+                                 .format(import_id))
+            except psycopg2.errors.UndefinedTable:
+                graph.outdated = True
+                raise ValueError('There is no import {}'
+                                 .format(import_id))
+            if back_links:
+                relative_ids, citizen_ids = zip(*back_links)
+                app.logger.debug('Adding %d back-links...', len(back_links))
+                execute(cur, 'LOCK_ROWS',
+                        LOCK_ROWS_SQL.format(import_id=import_id),
+                        (sorted(set(relative_ids)),),
+                        import_id)
+                if cur.rowcount != len(set(relative_ids)):
+                    graph.outdated = True
+                    raise ValueError('Relatives of citizens are changed '
+                                     'in import {}, try again.'
+                                     .format(import_id))
+                execute(cur, 'ADD_BACK_LINKS',
+                        ADD_BACK_LINKS_SQL.format(import_id=import_id),
+                        (list(relative_ids), list(citizen_ids)),
+                        import_id)
+            with graph.lock:
+                graph.append(citizens_relatives)
+
+
+def get_citizen(import_id, citizen_id, cur, for_update=False):
+    """
+    Load citizen data, with lock of row, if for_update is True.
+    """
+    citizen_sql = GET_CITIZEN_SQL.format(import_id=import_id,
+                                         citizen_id=citizen_id)
+    if for_update:
+        citizen_sql += '\nFOR UPDATE'
+    execute(cur, 'GET_CITIZEN', citizen_sql, import_id=import_id)
+    rows = cur.fetchall()
+    if not rows:
+        raise ValueError('There is no citizen {} in import {}'
+                         .format(citizen_id, import_id))
+    return tuple_to_citizen_data(rows[0])
+
+
+def apply_update(import_id,
+                 citizen_id,
+                 citizen_update,
+                 cur,
+                 load_old=False,
+                 graph=None):
+    """
+    Update citizen data at the table(import) with cursor, return
+    (old citizen data, if load_old is True, else None, citizen data).
+    Rows of citizen and his relatives are locked, so concurrent
+    updates keep relationships symmetric.
+    If relatives graph of import is given, citizens are checked by it,
+    and it's updated before commit, so caller should drop it,
+    if commit fails. Graph may be outdated by other process: citizens,
+    which it misses, are checked by table, and table, which is dropped,
+    means there is no import.
+    """
+    try:
+        return update_citizen_rows(import_id, citizen_id, citizen_update,
+                                   cur, load_old, graph)
+    except psycopg2.errors.UndefinedTable:
+        if graph is not None:
+            graph.outdated = True
+        raise ValueError('There is no import {}'
+                         .format(import_id))
+
+
+def update_citizen_rows(import_id,
+                        citizen_id,
+                        citizen_update,
+                        cur,
+                        load_old,
+                        graph):
+    relatives = citizen_update.get('relatives')
+    if graph is None \
+            or graph.get_missing([citizen_id] + (relatives or [])):
+        app.logger.debug('If there is import %d...',
+                         import_id)
+        check_import_exists(import_id, cur)
+        app.logger.debug('If there is citizen %d...',
+                         citizen_id)
+        check_citizen_exists(import_id, citizen_id, cur)
+        app.logger.debug('If relatives list of %d is correct...',
+                         citizen_id)
+        check_citizen_relatives_exist(import_id, citizen_update, cur)
+        if graph is not None:
+            # Citizens are in table, but not in graph.
+            graph.outdated = True
+            graph = None
+    if relatives is not None:
+        current_relatives = lock_citizens(import_id, citizen_id,
+                                          relatives, cur)
+    old_citizen_data = None
+    if load_old:
+        old_citizen_data = get_citizen(import_id, citizen_id, cur,
+                                       for_update=True)
+
+    if relatives is not None:
+        removed = sorted(set(current_relatives)
+                         .difference(relatives, [citizen_id]))
+        added = sorted(set(relatives)
+                       .difference(current_relatives, [citizen_id]))
+        update_back_links(import_id, citizen_id, removed, added, cur)
+
+    update_sql = prepare_update_info_sql(
+        import_id,
+        citizen_id,
+        citizen_update,
+        cur)
+    execute(cur, 'UPDATE', update_sql, import_id=import_id)
+    citizen_data = get_citizen(import_id, citizen_id, cur)
+    # Rows are still locked, so graph is changed in order
+    # of commits.
+    if graph is not None and relatives is not None:
+        with graph.lock:
+            graph.set_relatives(citizen_id, relatives)
+    return old_citizen_data, citizen_data
 
 
 def update_import(import_id,
                   citizen_id,
-                  citizen_update):
+                  citizen_update,
+                  on_change=None,
+                  graph=None):
     """
     Update citizen data at the table(import).
+    After commit on_change(old_citizen_data, citizen_data) is called,
+    if it's given.
     """
-    with psycopg2.connect(**DB_CREDENTIALS) as conn:
+    with shards.get(import_id).connection() as conn:
         with conn.cursor() as cur:
             app.logger.debug('DB cursor is ready...')
-            cur.execute(SET_TIMEZONE_SQL)
-            app.logger.debug('Set GMT as timezone.')
+            old_citizen_data, citizen_data = apply_update(
+                import_id, citizen_id, citizen_update, cur,
+                load_old=on_change is not None,
+                graph=graph)
+    if on_change is not None:
+        on_change(old_citizen_data, citizen_data)
+    return citizen_data
+
+
+def lock_batch(import_id, updates, cur):
+    """
+    Lock rows, which updates of batch may change, in order of ids,
+    before they are applied. Updates of batch change relatives only
+    of these rows, so batches and single PATCHes take locks in the same
+    order and don't deadlock.
+    """
+    citizen_ids = sorted({citizen_id for citizen_id, _, _ in updates})
+    locked_ids = set(citizen_ids)
+    for _, citizen_update, _ in updates:
+        locked_ids.update(citizen_update.get('relatives', []))
+    while True:
+        try:
+            execute(cur, 'LOCK_BATCH',
+                    LOCK_BATCH_SQL.format(import_id=import_id),
+                    (sorted(locked_ids), citizen_ids),
+                    import_id)
+        except psycopg2.errors.UndefinedTable:
+            raise ValueError('There is no import {}'
+                             .format(import_id))
+        rows = dict(cur.fetchall())
+        current_relatives = {relative_id
+                             for citizen_id in citizen_ids
+                             for relative_id in rows.get(citizen_id, [])}
+        if set(rows).issuperset(current_relatives):
+            return
+        execute(cur, 'ROLLBACK_TO_SAVEPOINT', ROLLBACK_TO_SAVEPOINT_SQL)
+        locked_ids.update(current_relatives)
+
 
+def apply_batch(import_id, updates, graph):
+    results = []
+    with shards.get(import_id).connection() as conn:
+        with conn.cursor() as cur:
+            lock_batch(import_id, updates, cur)
+            for citizen_id, citizen_update, load_old in updates:
+                execute(cur, 'SAVEPOINT_UPDATE', SAVEPOINT_UPDATE_SQL)
+                try:
+                    result = apply_update(import_id, citizen_id,
+                                          citizen_update, cur,
+                                          load_old=load_old,
+                                          graph=graph)
+                except psycopg2.extensions.TransactionRollbackError:
+                    # The whole batch is rolled back.
+                    raise
+                except (ValueError, psycopg2.Error) as error:
+                    execute(cur, 'ROLLBACK_TO_UPDATE',
+                            ROLLBACK_TO_UPDATE_SQL)
+                    # Graph is changed after all statements of update,
+                    # so only DB error may leave it changed.
+                    if graph is not None \
+                            and isinstance(error, psycopg2.Error):
+                        graph.outdated = True
+                        graph = None
+                    result = error
+                else:
+                    execute(cur, 'RELEASE_UPDATE', RELEASE_UPDATE_SQL)
+                results.append(result)
+    return results
+
+
+def update_import_batch(import_id, updates, graph=None):
+    """
+    Apply updates of import in one transaction, in order.
+    updates is list of (citizen_id, citizen_update, load_old).
+    Return list of (old citizen data, citizen data) or error
+    of every update: failed one is rolled back to its savepoint,
+    others are committed anyway. Batch, which is rolled back
+    because of deadlock, is tried again without graph, which it
+    could have changed.
+    """
+    for attempt in range(PATCH_ATTEMPTS):
+        try:
+            results = apply_batch(import_id, updates, graph)
+            break
+        except psycopg2.extensions.TransactionRollbackError:
+            if graph is not None:
+                graph.outdated = True
+                graph = None
+            if attempt == PATCH_ATTEMPTS - 1:
+                raise
+    app.logger.debug('%d updates of import %d are committed.',
+                     len(updates),
+                     import_id)
+    return results
+
+
+def load_relatives(import_id):
+    """
+    Load (citizen_id, relatives) of every citizen of import.
+    """
+    with shards.get(import_id).connection() as conn:
+        with conn.cursor() as cur:
             app.logger.debug('If there is import %d...',
                              import_id)
             check_import_exists(import_id, cur)
-            app.logger.debug('If there is citizen %d...',
-                             citizen_id)
-            check_citizen_exists(import_id, citizen_id, cur)
-            app.logger.debug('If his new relatives list is correct...',
-                             citizen_id)
-            check_citizen_relatives_exist(import_id, citizen_update, cur)
-
-            if 'relatives' in citizen_update:
-                new_relatives = citizen_update['relatives']
-                app.logger.debug('New relatives: %s', new_relatives)
-                current_relatives = get_current_relatives(import_id,
-                                                          citizen_id,
-                                                          cur)
-                app.logger.debug('Old relatives: %s', current_relatives)
-                ex_relatives = list(set(current_relatives)
-                                    - set(new_relatives))
-                new_relatives = list(set(new_relatives)
-                                     - set(current_relatives))
-                for relative_id in ex_relatives:
-                    remove_relative(
-                        import_id=import_id,
-                        relative_id=citizen_id,
-                        citizen_id=relative_id,
-                        cur=cur)
-                for relative_id in new_relatives:
-                    add_relative(
-                        import_id=import_id,
-                        relative_id=citizen_id,
-                        citizen_id=relative_id,
-                        cur=cur)
-
-            update_sql = prepare_update_info_sql(
-                import_id,
-                citizen_id,
-                citizen_update,
-                cur)
-            cur.execute(update_sql)
-            citizen_sql = GET_CITIZEN_SQL.format(import_id=import_id,
-                                                 citizen_id=citizen_id)
-            cur.execute(citizen_sql)
-            citizen_tuple = cur.fetchall()[0]
-            citizen_data = tuple_to_citizen_data(citizen_tuple)
-            return citizen_data
+            execute(cur, 'GET_RELATIVES',
+                    GET_RELATIVES_SQL.format(import_id=import_id),
+                    import_id=import_id)
+            return cur.fetchall()
+
+
+def get_existing_citizens(import_id, citizen_ids):
+    """
+    Return ids of citizen_ids, which are in table of import.
+    """
+    with shards.get(import_id).connection() as conn:
+        with conn.cursor() as cur:
+            check_import_exists(import_id, cur)
+            execute(cur, 'GET_EXISTING_CITIZENS',
+                    GET_EXISTING_CITIZENS_SQL.format(import_id=import_id),
+                    (citizen_ids,),
+                    import_id)
+            return [row[0] for row in cur.fetchall()]
+
+
+def load_towns_birth_dates(import_id):
+    """
+    Load (town, birth date ordinal) of every citizen of import.
+    """
+    with shards.get(import_id).connection() as conn:
+        with conn.cursor() as cur:
+            check_import_exists(import_id, cur)
+            execute(cur, 'GET_TOWNS_BIRTH_DATES',
+                    GET_TOWNS_BIRTH_DATES_SQL.format(import_id=import_id),
+                    import_id=import_id)
+            return [(town, birth_date.toordinal())
+                    for town, birth_date in cur.fetchall()]
 
 
 def load_import(import_id):
     """
     Load citizens data from given table(import).
     """
-    with psycopg2.connect(**DB_CREDENTIALS) as conn:
+    with shards.get(import_id).connection() as conn:
         with conn.cursor() as cur:
             app.logger.debug('DB cursor is ready...')
-            cur.execute(SET_TIMEZONE_SQL)
-            app.logger.debug('Set GMT as timezone.')
             app.logger.debug('If there is import %d...',
                              import_id)
             check_import_exists(import_id, cur)
 
             sql = GET_FULL_TABLE_SQL.format(import_id=import_id)
-            cur.execute(sql)
+            execute(cur, 'GET_FULL_TABLE', sql, import_id=import_id)
             result = cur.fetchall()
             app.logger.debug('There is %d rows at import %d.',
                              len(result),
@@ -367,11 +728,9 @@ def calculate_birthdays(import_id):
     """
     Calculate birthdays presents stat.
     """
-    with psycopg2.connect(**DB_CREDENTIALS) as conn:
+    with shards.get(import_id).connection() as conn:
         with conn.cursor() as cur:
             app.logger.debug('DB cursor is ready...')
-            cur.execute(SET_TIMEZONE_SQL)
-            app.logger.debug('Set GMT as timezone.')
             app.logger.debug('If there is import %d...',
                              import_id)
             check_import_exists(import_id, cur)
@@ -385,11 +744,9 @@ def calculate_ages_stat(import_id):
     """
     Calculate towns ages percentiles.
     """
-    with psycopg2.connect(**DB_CREDENTIALS) as conn:
+    with shards.get(import_id).connection() as conn:
         with conn.cursor() as cur:
             app.logger.debug('DB cursor is ready...')
-            cur.execute(SET_TIMEZONE_SQL)
-            app.logger.debug('Set GMT as timezone.')
             app.logger.debug('If there is import %d...',
                              import_id)
             check_import_exists(import_id, cur)
@@ -397,3 +754,376 @@ def calculate_ages_stat(import_id):
             app.logger.debug('Ages stat preparing...')
             ages_stat = prepare_ages_stat(import_id, cur)
             return ages_stat
+
+
+def render_json(import_id, name, sql, params=None):
+    """
+    Run query, which renders answer to JSON, and return it as raw bytes.
+    """
+    with shards.get(import_id).connection() as conn:
+        with conn.cursor() as cur:
+            app.logger.debug('DB cursor is ready...')
+            app.logger.debug('If there is import %d...',
+                             import_id)
+            check_import_exists(import_id, cur)
+
+            psycopg2.extensions.register_type(psycopg2.extensions.BYTES,
+                                              cur)
+            execute(cur, name, sql.format(import_id=import_id), params,
+                    import_id)
+            data_json = cur.fetchone()[0]
+            app.logger.debug('Import %d answer is %d bytes.',
+                             import_id,
+                             len(data_json))
+            return data_json
+
+
+def delete_import(import_id):
+    """
+    Drop table of import and remove it from registry.
+    """
+    check_import_id(import_id)
+    with shards.get(import_id).connection() as conn:
+        with conn.cursor() as cur:
+            execute(cur, 'UNREGISTER_IMPORT',
+                    UNREGISTER_IMPORT_SQL.format(import_id=import_id))
+            registered = cur.rowcount > 0
+            execute(cur, 'CHECK_IF_TABLE_EXISTS',
+                    CHECK_IF_TABLE_EXISTS_SQL.format(import_id=import_id))
+            if cur.fetchone()[0] is not None:
+                execute(cur, 'DROP_TABLE',
+                        DROP_TABLE_SQL.format(import_id=import_id))
+                app.logger.debug('Table \'import_%d\' has been dropped.',
+                                 import_id)
+            elif not registered:
+                raise ValueError('There is no import {}'
+                                 .format(import_id))
+
+
+def list_imports():
+    """
+    Return (import_id, creation timestamp) of every import.
+    """
+    imports = []
+    for pool in shards.pools:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                execute(cur, 'GET_IMPORTS', GET_IMPORTS_SQL)
+                imports.extend(cur.fetchall())
+    return sorted(imports)
+
+
+def export_import(import_id, file_object,
+                  compression_level=config.SNAPSHOT_COMPRESSION_LEVEL):
+    """
+    Write snapshot of import to file.
+    """
+    with tempfile.TemporaryFile() as compressed_data:
+        writer = CompressingWriter(compressed_data, compression_level)
+        with shards.get(import_id).connection() as conn:
+            with conn.cursor() as cur:
+                check_import_exists(import_id, cur)
+                copy(cur, 'COPY_TO',
+                     COPY_TO_SQL.format(import_id=import_id),
+                     writer,
+                     import_id)
+                rows = cur.rowcount
+        writer.close()
+        app.logger.debug('Import %d: %d rows, %d bytes are exported.',
+                         import_id,
+                         rows,
+                         writer.size)
+        compressed_data.seek(0)
+        write_snapshot(file_object,
+                       {
+                           'schema_version': SCHEMA_VERSION,
+                           'columns': FIELD_NAMES,
+                           'rows': rows,
+                           'size': writer.size,
+                           'sha256': writer.sha256.hexdigest(),
+                       },
+                       compressed_data)
+
+
+def restore_import(file_object):
+    """
+    Create new import from snapshot. Data isn't checked again,
+    only its checksum. Return {'import_id': import_id}.
+    """
+    header = read_header(file_object)
+    if header.get('schema_version') != SCHEMA_VERSION \
+            or header.get('columns') != FIELD_NAMES:
+        raise ValueError('Snapshot schema version {} isn\'t supported.'
+                         .format(header.get('schema_version')))
+    reader = DecompressingReader(file_object)
+    with shards.next().connection() as conn:
+        with conn.cursor() as cur:
+            import_id = get_new_table_id(cur)
+            execute(cur, 'CREATE_TABLE',
+                    CREATE_TABLE_SQL.format(import_id=import_id))
+            try:
+                copy(cur, 'COPY_FROM',
+                     COPY_FROM_SQL.format(import_id=import_id),
+                     reader,
+                     import_id)
+            except psycopg2.DataError as error:
+                raise ValueError('Snapshot data is incorrect: {}'
+                                 .format(error))
+            reader.check(header)
+            app.logger.debug('Import %d: %d rows are restored.',
+                             import_id,
+                             cur.rowcount)
+            execute(cur, 'CREATE_INDEXES',
+                    CREATE_INDEXES_SQL.format(import_id=import_id),
+                    import_id=import_id)
+        conn.commit()
+        vacuum_table(import_id, conn)
+    return {'import_id': import_id}
+
+
+def get_town_birth_date(citizen):
+    """
+    Town and birth date ordinal for age sketch.
+    """
+    return citizen.town, str_to_date(citizen.birth_date).toordinal()
+
+
+class PostgresEngine(StorageEngine):
+    """
+    Every import is a table in PostgreSQL.
+    Relatives graphs of imports are kept in memory and loaded
+    at first PATCH after restart.
+    """
+    def __init__(self, age_sketch_resolution=0, result_cache=None,
+                 patch_batch_size=config.PATCH_BATCH_SIZE,
+                 patch_batch_delay=config.PATCH_BATCH_DELAY_SECONDS):
+        super().__init__(age_sketch_resolution, result_cache)
+        self.relatives_graphs = ImportsRelativesGraphs()
+        # Number of changes of import, which this process is making.
+        self.changes_lock = threading.Lock()
+        self.changes = Counter()
+        self.patch_batcher = None
+        if patch_batch_size > 1:
+            self.patch_batcher = WriteBatcher(self.apply_updates,
+                                              patch_batch_size,
+                                              patch_batch_delay)
+
+    def prepare(self):
+        """
+        Migrate schema and open pool connections.
+        """
+        connections = shards.warm_up()
+        app.logger.info('%d DB connections are opened.', connections)
+
+    def save_import(self, citizens):
+        import_id_json = save_new_import(citizens)
+        import_id = import_id_json['import_id']
+        self.age_sketches.create(import_id,
+                                 map(get_town_birth_date, citizens),
+                                 self.get_version(import_id))
+        self.relatives_graphs.create(
+            import_id,
+            [(citizen.citizen_id, citizen.relatives)
+             for citizen in citizens])
+        return import_id_json
+
+    @contextmanager
+    def changing(self, import_id):
+        """
+        Import is being changed from start of transaction till its
+        age sketch gets the new version.
+        """
+        with self.changes_lock:
+            self.changes[import_id] += 1
+        try:
+            yield
+        finally:
+            with self.changes_lock:
+                self.changes[import_id] -= 1
+                if not self.changes[import_id]:
+                    del self.changes[import_id]
+
+    def delete_import(self, import_id):
+        with self.changing(import_id):
+            delete_import(import_id)
+            self.change_version(import_id)
+            self.age_sketches.drop(import_id)
+        self.relatives_graphs.drop(import_id)
+
+    def list_imports(self):
+        return list_imports()
+
+    def export_snapshot(self, import_id, file_object):
+        export_import(import_id, file_object)
+
+    def restore_snapshot(self, file_object):
+        # Relatives graph is loaded at the first PATCH.
+        return restore_import(file_object)
+
+    def get_relatives_graph(self, import_id):
+        graph = self.relatives_graphs.get(import_id)
+        if graph is None:
+            graph = self.relatives_graphs.create(import_id,
+                                                 load_relatives(import_id))
+        return graph
+
+    def append_citizens(self, import_id, citizens):
+        graph = self.get_relatives_graph(import_id)
+        new_ids = {citizen.citizen_id for citizen in citizens}
+        missing = graph.get_missing(sorted(
+            {relative_id for citizen in citizens
+             for relative_id in citizen.relatives}.difference(new_ids)))
+        if missing and get_existing_citizens(import_id, missing):
+            # They are appended by other process.
+            graph.outdated = True
+            graph = self.get_relatives_graph(import_id)
+        check_relationships([(citizen.citizen_id, citizen.relatives)
+                             for citizen in citizens],
+                            existing_citizens=graph)
+        with self.changing(import_id):
+            try:
+                append_citizens(import_id, citizens, graph)
+            except psycopg2.Error:
+                self.relatives_graphs.drop(import_id)
+                raise
+            self.age_sketches.update(
+                import_id, self.change_version(import_id),
+                added=map(get_town_birth_date, citizens))
+        return {'import_id': import_id}
+
+    def update_age_sketch(self, import_id, changed_citizens):
+        """
+        Apply version change of import to its age sketch.
+        changed_citizens is list of (old citizen data, citizen data).
+        """
+        self.age_sketches.update(
+            import_id, self.change_version(import_id),
+            changes=[(get_town_birth_date(old_citizen_data),
+                      get_town_birth_date(citizen_data))
+                     for old_citizen_data, citizen_data
+                     in changed_citizens])
+
+    def need_old_citizen(self, import_id, citizen_update):
+        return self.age_sketches.has(import_id) \
+            and ('town' in citizen_update or 'birth_date' in citizen_update)
+
+    def update_citizen(self, import_id, citizen_id, citizen_update):
+        if self.patch_batcher is not None:
+            return self.patch_batcher.do(import_id, citizen_id,
+                                         citizen_update)
+        changed_citizens = []
+        on_change = None
+        if self.need_old_citizen(import_id, citizen_update):
+            def on_change(old_citizen_data, citizen_data):
+                changed_citizens.append((old_citizen_data, citizen_data))
+        graph = self.get_relatives_graph(import_id)
+        with self.changing(import_id):
+            for attempt in range(PATCH_ATTEMPTS):
+                try:
+                    citizen = update_import(import_id, citizen_id,
+                                            citizen_update,
+                                            on_change=on_change,
+                                            graph=graph)
+                    break
+                except psycopg2.extensions.TransactionRollbackError:
+                    # Deadlock, if relatives were changed concurrently
+                    # after they had been read. It's rolled back.
+                    if attempt == PATCH_ATTEMPTS - 1:
+                        raise
+                except psycopg2.Error:
+                    self.relatives_graphs.drop(import_id)
+                    raise
+            self.update_age_sketch(import_id, changed_citizens)
+        return citizen
+
+    def apply_updates(self, import_id, writes):
+        """
+        Apply batch of PATCHes (writes of (citizen_id, citizen_update))
+        in one transaction.
+        """
+        graph = self.get_relatives_graph(import_id)
+        updates = [(citizen_id, citizen_update,
+                    self.need_old_citizen(import_id, citizen_update))
+                   for citizen_id, citizen_update
+                   in (write.args for write in writes)]
+        with self.changing(import_id):
+            try:
+                results = update_import_batch(import_id, updates, graph)
+            except psycopg2.Error:
+                self.relatives_graphs.drop(import_id)
+                raise
+            changed_citizens = []
+            for write, result in zip(writes, results):
+                if isinstance(result, Exception):
+                    write.error = result
+                    continue
+                old_citizen_data, write.result = result
+                if old_citizen_data is not None:
+                    changed_citizens.append((old_citizen_data,
+                                             write.result))
+            self.update_age_sketch(import_id, changed_citizens)
+
+    def load_import(self, import_id):
+        return load_import(import_id)
+
+    def calculate_birthdays(self, import_id):
+        return calculate_birthdays(import_id)
+
+    def get_age_percentiles(self, import_id):
+        """
+        Percentiles from age sketch of the current version of import.
+        Sketch, which is changed by other process or isn't created
+        by this one yet, is (re)built from table. Table, which is
+        being changed, may already have change, which isn't applied
+        to version yet, so sketch isn't built, and None is returned.
+        """
+        fractions = [fraction for _, fraction in PERCENTILES]
+        version = self.get_version(import_id)
+        towns_percentiles = self.age_sketches.percentiles(
+            import_id, fractions, get_today(), version)
+        if towns_percentiles is not None or not self.age_sketches.enabled \
+                or self.changes[import_id]:
+            return towns_percentiles
+        towns_birth_dates = load_towns_birth_dates(import_id)
+        with self.changes_lock:
+            # Change, which is started later, is applied to sketch.
+            if self.changes[import_id] \
+                    or self.get_version(import_id) != version:
+                return None
+            self.age_sketches.create(import_id, towns_birth_dates, version)
+        return self.age_sketches.percentiles(import_id, fractions,
+                                             get_today(), version)
+
+    def calculate_ages_stat(self, import_id, approximate=False):
+        if approximate:
+            towns_percentiles = self.get_age_percentiles(import_id)
+            if towns_percentiles is not None:
+                return format_ages_stat(towns_percentiles)
+        return calculate_ages_stat(import_id)
+
+    def use_db_json(self):
+        """
+        JSON rendering is read from app config at every request.
+        """
+        return (has_app_context()
+                and app.config.get('JSON_RENDERING') == 'db')
+
+    def load_import_json(self, import_id):
+        if self.use_db_json():
+            return render_json(import_id, 'GET_FULL_TABLE_JSON',
+                               GET_FULL_TABLE_JSON_SQL)
+        return super().load_import_json(import_id)
+
+    def calculate_birthdays_json(self, import_id):
+        if self.use_db_json():
+            return render_json(import_id, 'GET_BIRTHDAYS_JSON',
+                               GET_BIRTHDAYS_JSON_SQL)
+        return super().calculate_birthdays_json(import_id)
+
+    def calculate_ages_stat_json(self, import_id, approximate=False):
+        if self.use_db_json() and not (approximate
+                                       and self.age_sketches.enabled):
+            return render_json(import_id, 'GET_AGES_JSON', GET_AGES_JSON_SQL,
+                               ([name for name, _ in PERCENTILES],
+                                [fraction for _, fraction in PERCENTILES]))
+        return super().calculate_ages_stat_json(import_id, approximate)
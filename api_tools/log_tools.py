@@ -0,0 +1,133 @@
+"""
+Logging setup: records are put into queue by request threads
+and written by separate listener thread.
+"""
+import atexit
+import copy
+import json
+import queue
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_app_context
+
+EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Put records into queue, so formatting by handlers happens at
+    listener thread, not at request one. Like QueueHandler, message
+    is merged with its args and traceback is rendered here, since
+    args may change and traceback keeps frames of request thread,
+    but record isn't formatted and keeps its data fields.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = EXCEPTION_FORMATTER.formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SampledDebugFilter(logging.Filter):
+    """
+    Pass records below the level only for sampled requests.
+    """
+    def __init__(self, level):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        return has_app_context() and g.get('debug_sampled', False)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format record as JSON line: time, level, logger, message
+    and fields of record's data dict.
+    """
+    def format(self, record):
+        fields = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields.update(getattr(record, 'data', {}))
+        return json.dumps(fields, sort_keys=True, default=str)
+
+
+LEVEL_NAMES = ['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'NOTSET']
+
+
+def setup_logging(level='INFO',
+                  log_format=None,
+                  debug_sample_rate=0.0,
+                  handlers=None):
+    """
+    Configure root logger to write through queue, return listener.
+    """
+    level_number = logging.getLevelName(level)
+    if not isinstance(level_number, int):
+        raise ValueError('Unknown log level {}, expected one of {}'.format(
+            level, ', '.join(LEVEL_NAMES)))
+    level = level_number
+    if handlers is None:
+        handlers = [logging.StreamHandler()]
+    formatter = logging.Formatter(log_format)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(-1)
+    queue_handler = AsyncQueueHandler(log_queue)
+    root_logger = logging.getLogger()
+    if debug_sample_rate > 0:
+        # Loggers should create debug records,
+        # filter drops them for not sampled requests.
+        root_logger.setLevel(min(level, logging.DEBUG))
+        queue_handler.addFilter(SampledDebugFilter(level))
+    else:
+        root_logger.setLevel(level)
+    root_logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_file_logging(logger_name, path, max_bytes=0, backup_count=0):
+    """
+    Write records of logger as JSON lines to rotated file through queue,
+    instead of the main log. Return listener.
+    """
+    handler = RotatingFileHandler(path,
+                                  maxBytes=max_bytes,
+                                  backupCount=backup_count)
+    handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.Queue(-1)
+    logger = logging.getLogger(logger_name)
+    logger.addHandler(AsyncQueueHandler(log_queue))
+    logger.propagate = False
+
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def sample_request_debug(debug_sample_rate):
+    """
+    Decide, if current request should be logged with debug level.
+    """
+    g.debug_sampled = (debug_sample_rate > 0
+                       and random.random() < debug_sample_rate)
@@ -0,0 +1,271 @@
+"""
+In-memory storage: every import is kept as set of typed columns.
+"""
+import threading
+import time
+from array import array
+from collections import defaultdict, Counter
+from datetime import date
+
+from flask import current_app as app, has_app_context
+
+from api_tools import numpy_analytics
+from api_tools.citizen import Citizen
+from api_tools.check_data import (
+    str_to_date,
+    date_to_str,
+    get_today,
+    check_relationships,
+)
+from api_tools.stat_tools import (
+    PERCENTILES,
+    get_age,
+    percentile_cont,
+    format_ages_stat,
+)
+from api_tools.relatives_graph import RelativesGraph, check_citizens_exist
+from api_tools.storage import StorageEngine
+
+GENDERS = ['male', 'female']
+
+
+class StringColumn:
+    """
+    Dictionary encoded strings column.
+    """
+    def __init__(self):
+        self.codes = array('i')
+        self.values = []
+        self.value_codes = {}
+
+    def encode(self, value):
+        code = self.value_codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.value_codes[value] = code
+        return code
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+
+    def __getitem__(self, row):
+        return self.values[self.codes[row]]
+
+    def __setitem__(self, row, value):
+        self.codes[row] = self.encode(value)
+
+
+class ColumnarImport:
+    """
+    Citizens of one import stored by columns.
+    """
+    def __init__(self, citizens):
+        self.lock = threading.RLock()
+        self.citizen_ids = array('i')
+        self.towns = StringColumn()
+        self.streets = StringColumn()
+        self.buildings = StringColumn()
+        self.apartments = array('i')
+        self.names = StringColumn()
+        # Dates are stored as proleptic Gregorian ordinals.
+        self.birth_dates = array('i')
+        self.genders = array('b')
+        for citizen in citizens:
+            self.append(citizen)
+        self.graph = RelativesGraph([
+            (citizen.citizen_id, citizen.relatives) for citizen in citizens])
+
+    def __len__(self):
+        return len(self.citizen_ids)
+
+    def append(self, citizen):
+        self.citizen_ids.append(citizen.citizen_id)
+        self.towns.append(citizen.town)
+        self.streets.append(citizen.street)
+        self.buildings.append(citizen.building)
+        self.apartments.append(citizen.apartment)
+        self.names.append(citizen.name)
+        self.birth_dates.append(str_to_date(citizen.birth_date).toordinal())
+        self.genders.append(GENDERS.index(citizen.gender))
+
+    def extend(self, citizens):
+        for citizen in citizens:
+            self.append(citizen)
+        self.graph.append([
+            (citizen.citizen_id, citizen.relatives) for citizen in citizens])
+
+    def towns_birth_dates(self, start=0):
+        for row in range(start, len(self)):
+            yield self.towns[row], self.birth_dates[row]
+
+    def get_row(self, import_id, citizen_id):
+        check_citizens_exist(self.graph, import_id, [citizen_id])
+        return self.graph.rows[citizen_id]
+
+    def update(self, row, citizen_update):
+        for field, value in citizen_update.items():
+            if field == 'town':
+                self.towns[row] = value
+            elif field == 'street':
+                self.streets[row] = value
+            elif field == 'building':
+                self.buildings[row] = value
+            elif field == 'apartment':
+                self.apartments[row] = value
+            elif field == 'name':
+                self.names[row] = value
+            elif field == 'birth_date':
+                self.birth_dates[row] = str_to_date(value).toordinal()
+            elif field == 'gender':
+                self.genders[row] = GENDERS.index(value)
+            elif field == 'relatives':
+                self.graph.set_relatives(self.citizen_ids[row], value)
+
+    def get_citizen(self, row):
+        return Citizen(
+            self.citizen_ids[row],
+            self.towns[row],
+            self.streets[row],
+            self.buildings[row],
+            self.apartments[row],
+            self.names[row],
+            date_to_str(date.fromordinal(self.birth_dates[row])),
+            GENDERS[self.genders[row]],
+            array('i', self.graph.row_relatives(row)))
+
+
+class MemoryEngine(StorageEngine):
+    """
+    Imports are kept in process memory, nothing is persisted.
+    """
+    def __init__(self, age_sketch_resolution=0, result_cache=None):
+        super().__init__(age_sketch_resolution, result_cache)
+        self.lock = threading.Lock()
+        self.imports = {}
+        self.created = {}
+        self.next_import_id = 0
+
+    def get_import(self, import_id):
+        columns = self.imports.get(import_id)
+        if columns is None:
+            raise ValueError('There is no import {}'
+                             .format(import_id))
+        return columns
+
+    def save_import(self, citizens):
+        columns = ColumnarImport(citizens)
+        with self.lock:
+            import_id = self.next_import_id
+            self.next_import_id += 1
+        self.age_sketches.create(import_id, columns.towns_birth_dates(),
+                                 self.get_version(import_id))
+        with self.lock:
+            self.imports[import_id] = columns
+            self.created[import_id] = time.time()
+        return {'import_id': import_id}
+
+    def delete_import(self, import_id):
+        with self.lock:
+            self.get_import(import_id)
+            del self.imports[import_id]
+            del self.created[import_id]
+        self.change_version(import_id)
+        self.age_sketches.drop(import_id)
+
+    def list_imports(self):
+        with self.lock:
+            return sorted(self.created.items())
+
+    def append_citizens(self, import_id, citizens):
+        columns = self.get_import(import_id)
+        with columns.lock:
+            check_relationships(
+                [(citizen.citizen_id, citizen.relatives)
+                 for citizen in citizens],
+                existing_citizens=columns.graph)
+            start = len(columns)
+            columns.extend(citizens)
+            self.age_sketches.update(
+                import_id, self.change_version(import_id),
+                added=columns.towns_birth_dates(start))
+        return {'import_id': import_id}
+
+    def update_citizen(self, import_id, citizen_id, citizen_update):
+        columns = self.get_import(import_id)
+        with columns.lock:
+            row = columns.get_row(import_id, citizen_id)
+            check_citizens_exist(columns.graph, import_id,
+                                 citizen_update.get('relatives', []))
+            old_town_birth_date = (columns.towns[row],
+                                   columns.birth_dates[row])
+            columns.update(row, citizen_update)
+            self.age_sketches.update(
+                import_id, self.change_version(import_id),
+                changes=[(old_town_birth_date,
+                          (columns.towns[row], columns.birth_dates[row]))])
+            return columns.get_citizen(row)
+
+    def load_import(self, import_id):
+        columns = self.get_import(import_id)
+        with columns.lock:
+            return [columns.get_citizen(row) for row in range(len(columns))]
+
+    def use_numpy(self):
+        """
+        Analytics engine is read from app config at every request.
+        """
+        return (has_app_context()
+                and app.config.get('ANALYTICS_ENGINE') == 'numpy'
+                and numpy_analytics.is_available())
+
+    def calculate_birthdays(self, import_id):
+        columns = self.get_import(import_id)
+        if self.use_numpy():
+            with columns.lock:
+                return numpy_analytics.calculate_birthdays(columns)
+        with columns.lock:
+            months = [date.fromordinal(ordinal).month
+                      for ordinal in columns.birth_dates]
+            presents = defaultdict(Counter)
+            for row, relative_row in zip(*columns.graph.edges()):
+                presents[months[relative_row]][columns.citizen_ids[row]] += 1
+        data = {}
+        for month in sorted(presents):
+            data[str(month)] = [
+                {'citizen_id': citizen_id, 'presents': number}
+                for citizen_id, number in sorted(presents[month].items())]
+        return data
+
+    @staticmethod
+    def calculate_ages_percentiles(columns, fractions):
+        today = get_today()
+        towns_ages = defaultdict(list)
+        for row, ordinal in enumerate(columns.birth_dates):
+            age = get_age(date.fromordinal(ordinal), today)
+            towns_ages[columns.towns[row]].append(age)
+        towns_percentiles = {}
+        for town, ages in towns_ages.items():
+            ages.sort()
+            towns_percentiles[town] = [percentile_cont(ages, fraction)
+                                       for fraction in fractions]
+        return towns_percentiles
+
+    def calculate_ages_stat(self, import_id, approximate=False):
+        columns = self.get_import(import_id)
+        fractions = [fraction for _, fraction in PERCENTILES]
+        if approximate:
+            towns_percentiles = self.age_sketches.percentiles(
+                import_id, fractions, get_today(),
+                self.get_version(import_id))
+            if towns_percentiles is not None:
+                return format_ages_stat(towns_percentiles)
+        with columns.lock:
+            if self.use_numpy():
+                towns_percentiles = \
+                    numpy_analytics.calculate_ages_percentiles(columns,
+                                                               fractions)
+            else:
+                towns_percentiles = self.calculate_ages_percentiles(
+                    columns, fractions)
+        return format_ages_stat(towns_percentiles)
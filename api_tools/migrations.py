@@ -0,0 +1,128 @@
+"""
+Versioned schema migrations. They are applied once at service start
+instead of checking schema at every request. Applied versions are kept
+at schema_migrations table, so every migration runs once per database.
+"""
+import re
+
+from flask import current_app as app
+
+from api_tools.query_log import execute
+from api_tools.sql_queries import (
+    GET_TABLES_SQL,
+    LOCK_SCHEMA_SQL,
+    CREATE_MIGRATIONS_TABLE_SQL,
+    GET_MIGRATIONS_SQL,
+    ADD_MIGRATION_SQL,
+    SET_ROLE_TIMEZONE_SQL,
+    SET_TIMEZONE_SQL,
+    CREATE_TYPE_SQL,
+    CHECK_IF_REGISTRY_EXISTS_SQL,
+    CREATE_REGISTRY_SQL,
+    REGISTER_TABLES_SQL,
+    UPGRADE_TABLE_SQL,
+    CREATE_INDEXES_SQL,
+    DROP_RELATIVES_INDEX_SQL,
+)
+
+TABLE_NAME_PATTERN = 'import_(\\d+)'
+
+
+def get_table_ids(cur):
+    """
+    Ids of all import tables.
+    """
+    execute(cur, 'GET_TABLES', GET_TABLES_SQL)
+    return [int(re.match(TABLE_NAME_PATTERN, table[0])[1])
+            for table in cur.fetchall()
+            if re.match(TABLE_NAME_PATTERN, table[0]) is not None]
+
+
+def create_type(cur):
+    execute(cur, 'CREATE_TYPE', CREATE_TYPE_SQL)
+
+
+def create_registry(cur):
+    """
+    Create imports registry, if there is no one yet, and register
+    tables of imports, created before it.
+    """
+    execute(cur, 'CHECK_IF_REGISTRY_EXISTS', CHECK_IF_REGISTRY_EXISTS_SQL)
+    if cur.fetchone()[0] is not None:
+        return
+    table_ids = get_table_ids(cur)
+    start = max(table_ids) + 1 if table_ids else 0
+    execute(cur, 'CREATE_REGISTRY', CREATE_REGISTRY_SQL.format(start=start))
+    if table_ids:
+        execute(cur, 'REGISTER_TABLES', REGISTER_TABLES_SQL, (table_ids,))
+    app.logger.info('Imports registry is created, %d imports registered.',
+                    len(table_ids))
+
+
+def set_timezone(cur):
+    """
+    New connections of service role get GMT timezone, current one too.
+    """
+    execute(cur, 'SET_ROLE_TIMEZONE', SET_ROLE_TIMEZONE_SQL)
+    execute(cur, 'SET_TIMEZONE', SET_TIMEZONE_SQL)
+
+
+def upgrade_import_tables(cur):
+    """
+    Add birth_month column and indexes to tables of old imports.
+    """
+    table_ids = get_table_ids(cur)
+    for import_id in table_ids:
+        execute(cur, 'UPGRADE_TABLE',
+                UPGRADE_TABLE_SQL.format(import_id=import_id),
+                import_id=import_id)
+        execute(cur, 'CREATE_INDEXES',
+                CREATE_INDEXES_SQL.format(import_id=import_id),
+                import_id=import_id)
+    app.logger.info('%d import tables are upgraded.', len(table_ids))
+
+
+def drop_relatives_indexes(cur):
+    """
+    Drop unused GIN indexes on relatives, so updates don't maintain them.
+    """
+    for import_id in get_table_ids(cur):
+        execute(cur, 'DROP_RELATIVES_INDEX',
+                DROP_RELATIVES_INDEX_SQL.format(import_id=import_id),
+                import_id=import_id)
+
+
+# (version, function(cur)), versions only grow.
+MIGRATIONS = [
+    (1, create_type),
+    (2, create_registry),
+    (3, set_timezone),
+    (4, upgrade_import_tables),
+    (5, drop_relatives_indexes),
+]
+# Version of tables columns, which snapshots are made with.
+# Later migrations change only indexes, so snapshots are still valid.
+SCHEMA_VERSION = 4
+
+
+def migrate(cur, migrations=MIGRATIONS):
+    """
+    Apply migrations, which aren't applied yet, in one transaction.
+    Return versions of applied ones.
+    """
+    execute(cur, 'LOCK_SCHEMA', LOCK_SCHEMA_SQL)
+    execute(cur, 'CREATE_MIGRATIONS_TABLE', CREATE_MIGRATIONS_TABLE_SQL)
+    execute(cur, 'GET_MIGRATIONS', GET_MIGRATIONS_SQL)
+    applied = {row[0] for row in cur.fetchall()}
+    versions = []
+    for version, migration in migrations:
+        if version in applied:
+            continue
+        app.logger.info('Schema migration %d (%s)...',
+                        version,
+                        migration.__name__)
+        migration(cur)
+        execute(cur, 'ADD_MIGRATION', ADD_MIGRATION_SQL,
+                (version, migration.__name__))
+        versions.append(version)
+    return versions
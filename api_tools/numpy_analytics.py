@@ -0,0 +1,112 @@
+"""
+Vectorized birthdays and ages stat for imports kept in memory.
+NumPy is optional: check is_available() before use.
+"""
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from api_tools.check_data import get_today
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def is_available():
+    return np is not None
+
+
+def ordinals_to_dates(ordinals):
+    return (np.frombuffer(ordinals, dtype=np.int32).astype(np.int64)
+            - EPOCH_ORDINAL).astype('datetime64[D]')
+
+
+def get_dates_parts(dates):
+    """
+    Return years, months (1-12) and days (1-31) of datetime64 array.
+    """
+    months_start = dates.astype('datetime64[M]')
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = months_start.astype(np.int64) % 12 + 1
+    days = (dates - months_start).astype(np.int64) + 1
+    return years, months, days
+
+
+def get_ages(ordinals, today):
+    years, months, days = get_dates_parts(ordinals_to_dates(ordinals))
+    before_birthday = ((months > today.month)
+                       | ((months == today.month) & (days > today.day)))
+    return today.year - years - before_birthday
+
+
+def get_relatives_adjacency(columns):
+    """
+    Relatives as arrays of owner rows and relative rows.
+    """
+    graph = columns.graph
+    if graph.changed:
+        graph.compact()
+    offsets = np.frombuffer(graph.offsets, dtype=np.int32)
+    owner_rows = np.repeat(np.arange(len(columns)), np.diff(offsets))
+    relative_rows = np.frombuffer(graph.neighbors, dtype=np.int32)
+    return owner_rows, relative_rows
+
+
+def calculate_birthdays(columns):
+    """
+    Presents number for every citizen and month of relatives birthdays.
+    """
+    rows_number = len(columns)
+    owner_rows, relative_rows = get_relatives_adjacency(columns)
+    _, months, _ = get_dates_parts(ordinals_to_dates(columns.birth_dates))
+    keys = (months[relative_rows] - 1) * rows_number + owner_rows
+    presents = np.bincount(keys, minlength=12 * rows_number)
+    presents = presents.reshape(12, rows_number)
+
+    citizen_ids = np.frombuffer(columns.citizen_ids, dtype=np.int32)
+    order = np.argsort(citizen_ids)
+    data = {}
+    for month in range(12):
+        month_presents = presents[month][order]
+        rows = np.nonzero(month_presents)[0]
+        if len(rows) == 0:
+            continue
+        data[str(month + 1)] = [
+            {'citizen_id': citizen_id, 'presents': number}
+            for citizen_id, number
+            in zip(citizen_ids[order][rows].tolist(),
+                   month_presents[rows].tolist())]
+    return data
+
+
+def calculate_ages_percentiles(columns, percentiles):
+    """
+    percentile_cont of ages for every town.
+    Return {town: [percentile value for every fraction]}.
+    """
+    ages = get_ages(columns.birth_dates, get_today())
+    towns = np.frombuffer(columns.towns.codes, dtype=np.int32)
+    order = np.lexsort((ages, towns))
+    sorted_ages = ages[order].astype(np.float64)
+    counts = np.bincount(towns, minlength=len(columns.towns.values))
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    counts, offsets = counts[present], offsets[present]
+    town_names = [town for town, is_present
+                  in zip(columns.towns.values, present) if is_present]
+
+    towns_values = []
+    for fraction in percentiles:
+        # The same operations order as at percentile_cont.
+        positions = fraction * (counts - 1).astype(np.float64)
+        first_rows = np.floor(positions).astype(np.int64)
+        second_rows = np.ceil(positions).astype(np.int64)
+        first = sorted_ages[offsets + first_rows]
+        second = sorted_ages[offsets + second_rows]
+        towns_values.append(first + (positions - first_rows)
+                            * (second - first))
+
+    return {town: [float(values[number]) for values in towns_values]
+            for number, town in enumerate(town_names)}
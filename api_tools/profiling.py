@@ -0,0 +1,150 @@
+"""
+On-demand profiling of requests.
+
+Request is profiled, if it has profiling header or it's sampled.
+Profile is saved either as pstats file (cProfile) or as collapsed
+stacks ("module:function;module:function count" lines), sampled from
+request thread, which flame graph tools take as is.
+"""
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_FORMATS = {
+    'pstats': '.prof',
+    'collapsed': '.txt',
+}
+PROFILE_NAME_PATTERN = re.compile(r'^[\w.-]+\.(prof|txt)$')
+
+
+def should_profile(header_value, sample_rate):
+    if header_value is not None and header_value not in ('', '0'):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+
+class StatsProfiler:
+    """
+    Deterministic profile of calls in current thread.
+    """
+    extension = PROFILE_FORMATS['pstats']
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+
+class StackSampler(threading.Thread):
+    """
+    Sample stacks of current thread every interval seconds.
+
+    Sampler thread waits for the GIL, while request thread runs Python
+    code, so it samples at most once per sys.getswitchinterval()
+    (5 ms by default), whatever smaller interval is. Profiles of
+    requests shorter than several switch intervals are empty or show
+    only where request thread released the GIL.
+    """
+    extension = PROFILE_FORMATS['collapsed']
+
+    def __init__(self, interval=0.001):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(
+                    frame.f_globals.get('__name__', '?'), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def save(self, path):
+        with open(path, 'w') as file_object:
+            for stack, count in sorted(self.stacks.items()):
+                file_object.write('{} {}\n'.format(stack, count))
+
+
+def start_profiler(profile_format='pstats', interval=0.001):
+    if profile_format == 'collapsed':
+        return StackSampler(interval)
+    return StatsProfiler()
+
+
+class ProfilesStore:
+    """
+    Directory with the latest max_files profiles.
+    """
+    def __init__(self, directory, max_files=50):
+        self.directory = directory
+        self.max_files = max_files
+        self.lock = threading.Lock()
+
+    def save(self, profiler, label):
+        """
+        Save profile, remove the oldest ones, return profile name.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        name = '{:.6f}_{}_{}{}'.format(
+            time.time(), re.sub(r'[^\w-]', '_', label),
+            threading.get_ident(), profiler.extension)
+        profiler.save(os.path.join(self.directory, name))
+        with self.lock:
+            for old_profile in self.list()[self.max_files:]:
+                os.remove(os.path.join(self.directory, old_profile['name']))
+        return name
+
+    def list(self):
+        """
+        Profiles info, the newest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if PROFILE_NAME_PATTERN.match(name) is None:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Removed by another request.
+                continue
+            profiles.append({
+                'name': name,
+                'size': stat.st_size,
+                'created': stat.st_mtime,
+            })
+        profiles.sort(key=lambda profile: profile['name'], reverse=True)
+        return profiles
+
+    def get_path(self, name):
+        """
+        Path of saved profile, ValueError for unknown name.
+        """
+        path = os.path.join(self.directory, name)
+        if PROFILE_NAME_PATTERN.match(name) is None \
+                or not os.path.isfile(path):
+            raise ValueError('There is no profile {}'.format(name))
+        return path
@@ -0,0 +1,167 @@
+"""
+Timing of DB statements.
+
+Every statement is executed with its name (name of query at
+sql_queries.py), time is added to per-statement stats. Statements
+slower than SLOW_QUERY_THRESHOLD_MS are logged to slow queries logger
+with import size and, for sampled ones, EXPLAIN plan.
+"""
+import re
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+import psycopg2.extensions
+from flask import current_app as app, has_app_context
+
+from api_tools.sql_queries import (
+    ESTIMATE_IMPORT_ROWS_SQL,
+    SAVEPOINT_EXPLAIN_SQL,
+    ROLLBACK_TO_EXPLAIN_SQL,
+    RELEASE_EXPLAIN_SQL,
+)
+
+SLOW_QUERY_LOGGER = 'api_tools.slow_queries'
+# Read-only statements are explained with ANALYZE (run once more),
+# others only get plan. Statements, which are not listed, aren't explained.
+ANALYZE_PREFIXES = ('SELECT', 'WITH')
+EXPLAIN_PREFIXES = ('UPDATE', 'DELETE')
+# Locking SELECT (FOR UPDATE/SHARE) and WITH with writes aren't run again.
+WRITE_PATTERN = re.compile(r'\b(UPDATE|SHARE|INSERT|DELETE)\b')
+
+logger = logging.getLogger(SLOW_QUERY_LOGGER)
+
+
+class QueriesStats:
+    """
+    Number, total and max time of every named statement.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = defaultdict(lambda: {
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'slow': 0,
+        })
+
+    def add(self, name, milliseconds, is_slow):
+        with self.lock:
+            stat = self.stats[name]
+            stat['count'] += 1
+            stat['total_ms'] += milliseconds
+            stat['max_ms'] = max(stat['max_ms'], milliseconds)
+            stat['slow'] += is_slow
+
+    def get(self):
+        with self.lock:
+            return {name: dict(stat) for name, stat in self.stats.items()}
+
+
+queries_stats = QueriesStats()
+
+
+def get_setting(name, default):
+    if not has_app_context():
+        return default
+    return app.config.get(name, default)
+
+
+def execute(cur, name, sql, params=None, import_id=None):
+    """
+    cur.execute(sql, params), timed as statement name.
+    """
+    start = time.perf_counter()
+    cur.execute(sql, params)
+    add_time(cur, name, sql, params, import_id, start)
+
+
+def copy(cur, name, sql, file_object, import_id=None):
+    """
+    cur.copy_expert(sql, file_object), timed as statement name.
+    """
+    start = time.perf_counter()
+    cur.copy_expert(sql, file_object)
+    add_time(cur, name, sql, None, import_id, start)
+
+
+def add_time(cur, name, sql, params, import_id, start):
+    milliseconds = (time.perf_counter() - start) * 1000
+    threshold = get_setting('SLOW_QUERY_THRESHOLD_MS', 0)
+    is_slow = 0 < threshold <= milliseconds
+    queries_stats.add(name, milliseconds, is_slow)
+    if is_slow:
+        log_slow_query(cur, name, sql, params, import_id, milliseconds)
+
+
+def get_plan(cur, sql, params):
+    """
+    Plan of statement, or None, if it isn't explained.
+    """
+    statement = sql.lstrip().upper()
+    if statement.startswith(ANALYZE_PREFIXES) \
+            and WRITE_PATTERN.search(statement) is None:
+        explain = 'EXPLAIN (ANALYZE, BUFFERS) '
+    elif statement.startswith(ANALYZE_PREFIXES + EXPLAIN_PREFIXES):
+        explain = 'EXPLAIN '
+    else:
+        return None
+    cur.execute(explain + sql, params)
+    return '\n'.join(row[0] for row in cur.fetchall())
+
+
+def explain_statement(conn, sql, params, import_id, data):
+    """
+    Add import size and sampled plan of statement to data.
+    In transaction it's done inside savepoint, so error
+    (e.g. statement timeout) doesn't abort transaction of caller.
+    """
+    in_transaction = not conn.autocommit
+    with conn.cursor() as explain_cur:
+        if in_transaction:
+            explain_cur.execute(SAVEPOINT_EXPLAIN_SQL)
+        try:
+            if import_id is not None:
+                explain_cur.execute(ESTIMATE_IMPORT_ROWS_SQL
+                                    .format(import_id=import_id))
+                row = explain_cur.fetchone()
+                if row is not None:
+                    data['import_rows'] = row[0]
+            sample_rate = get_setting('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.0)
+            if sample_rate > 0 and random.random() < sample_rate:
+                data['plan'] = get_plan(explain_cur, sql, params)
+        except Exception:
+            if in_transaction:
+                explain_cur.execute(ROLLBACK_TO_EXPLAIN_SQL)
+            raise
+        if in_transaction:
+            explain_cur.execute(RELEASE_EXPLAIN_SQL)
+
+
+def log_slow_query(cur, name, sql, params, import_id, milliseconds):
+    """
+    Log slow statement. Additional queries use their own cursor,
+    so results of statement are left for caller. Cancelled explain
+    (statement timeout or gone client) is raised after logging.
+    """
+    data = {
+        'statement': name,
+        'milliseconds': round(milliseconds, 3),
+        'import_id': import_id,
+        'import_rows': None,
+        'plan': None,
+    }
+    cancel_error = None
+    try:
+        explain_statement(cur.connection, sql, params, import_id, data)
+    except psycopg2.extensions.QueryCanceledError as error:
+        cancel_error = error
+    except Exception:
+        logger.exception('Can\'t explain slow statement %s.', name)
+    logger.warning('Slow statement %s: %.1f ms, import %s (%s rows).',
+                   name, milliseconds, import_id, data['import_rows'],
+                   extra={'data': data})
+    if cancel_error is not None:
+        raise cancel_error
@@ -0,0 +1,183 @@
+"""
+Relatives graph of import in compressed sparse row (CSR) format.
+
+Relatives of citizen at row r are rows neighbors[offsets[r]:offsets[r + 1]].
+PATCH replaces relatives of few rows, so changed rows are kept aside
+and the arrays are rebuilt, when there are too many of them.
+"""
+import threading
+from array import array
+
+# Part of changed rows, after which arrays are rebuilt.
+COMPACT_FRACTION = 0.25
+
+
+class RelativesGraph:
+    """
+    Relatives of citizens of one import. Relatives order is kept.
+    Graph is outdated, if it's found to miss citizens of import
+    (appended by other process), then it's loaded again.
+    """
+    def __init__(self, citizens_relatives):
+        """
+        citizens_relatives is list of (citizen_id, relatives ids).
+        """
+        self.lock = threading.RLock()
+        self.outdated = False
+        self.citizen_ids = array('i', [citizen_id for citizen_id, _
+                                       in citizens_relatives])
+        self.rows = {citizen_id: row for row, citizen_id
+                     in enumerate(self.citizen_ids)}
+        self.changed = {}
+        self.offsets = array('i', [0])
+        self.neighbors = array('i')
+        for _, relatives in citizens_relatives:
+            self.neighbors.extend(self.rows[relative_id]
+                                  for relative_id in relatives)
+            self.offsets.append(len(self.neighbors))
+
+    def __len__(self):
+        return len(self.citizen_ids)
+
+    def __contains__(self, citizen_id):
+        return citizen_id in self.rows
+
+    def get_missing(self, citizen_ids):
+        """
+        Return ids, which are not in import.
+        """
+        return [citizen_id for citizen_id in citizen_ids
+                if citizen_id not in self.rows]
+
+    def neighbor_rows(self, row):
+        rows = self.changed.get(row)
+        if rows is None:
+            rows = self.neighbors[self.offsets[row]:self.offsets[row + 1]]
+        return rows
+
+    def row_relatives(self, row):
+        return [self.citizen_ids[neighbor]
+                for neighbor in self.neighbor_rows(row)]
+
+    def relatives(self, citizen_id):
+        return self.row_relatives(self.rows[citizen_id])
+
+    def edges(self):
+        """
+        Return (owner rows, relative rows) arrays of all relations.
+        """
+        if self.changed:
+            self.compact()
+        owner_rows = array('i')
+        for row in range(len(self)):
+            owner_rows.extend(
+                [row] * (self.offsets[row + 1] - self.offsets[row]))
+        return owner_rows, self.neighbors
+
+    def get_changed_rows(self, row, new_rows):
+        """
+        Rows of other citizens, who lose and get back-link to row.
+        """
+        current_rows = set(self.neighbor_rows(row))
+        removed = current_rows.difference(new_rows, {row})
+        added = set(new_rows) - current_rows - {row}
+        return removed, added
+
+    def set_relatives(self, citizen_id, relatives):
+        """
+        Replace relatives of citizen and back-links to him.
+        """
+        row = self.rows[citizen_id]
+        new_rows = [self.rows[relative_id] for relative_id in relatives]
+        removed, added = self.get_changed_rows(row, new_rows)
+        for relative_row in removed:
+            self.changed[relative_row] = array(
+                'i', [neighbor for neighbor
+                      in self.neighbor_rows(relative_row)
+                      if neighbor != row])
+        for relative_row in added:
+            relative_rows = array('i', self.neighbor_rows(relative_row))
+            relative_rows.append(row)
+            self.changed[relative_row] = relative_rows
+        self.changed[row] = array('i', new_rows)
+        if len(self.changed) > COMPACT_FRACTION * len(self):
+            self.compact()
+
+    def get_back_links(self, citizens_relatives):
+        """
+        Return (relative_id, citizen_id) of back-links, which appended
+        citizens add to relatives of citizens of import, in order.
+        """
+        return [(relative_id, citizen_id)
+                for citizen_id, relatives in citizens_relatives
+                for relative_id in relatives
+                if relative_id in self.rows]
+
+    def append(self, citizens_relatives):
+        """
+        Add new citizens, back-links to them are appended to relatives
+        of citizens of import.
+        """
+        back_links = self.get_back_links(citizens_relatives)
+        for citizen_id, _ in citizens_relatives:
+            self.rows[citizen_id] = len(self.citizen_ids)
+            self.citizen_ids.append(citizen_id)
+        for _, relatives in citizens_relatives:
+            self.neighbors.extend(self.rows[relative_id]
+                                  for relative_id in relatives)
+            self.offsets.append(len(self.neighbors))
+        for relative_id, citizen_id in back_links:
+            relative_row = self.rows[relative_id]
+            relative_rows = array('i', self.neighbor_rows(relative_row))
+            relative_rows.append(self.rows[citizen_id])
+            self.changed[relative_row] = relative_rows
+        if len(self.changed) > COMPACT_FRACTION * len(self):
+            self.compact()
+
+    def compact(self):
+        """
+        Move changed rows back to CSR arrays.
+        """
+        offsets = array('i', [0])
+        neighbors = array('i')
+        for row in range(len(self)):
+            neighbors.extend(self.neighbor_rows(row))
+            offsets.append(len(neighbors))
+        self.offsets, self.neighbors = offsets, neighbors
+        self.changed = {}
+
+
+def check_citizens_exist(graph, import_id, citizen_ids):
+    missing = graph.get_missing(citizen_ids)
+    if missing:
+        raise ValueError('There is no citizen {} in import {}'
+                         .format(missing[0], import_id))
+
+
+class ImportsRelativesGraphs:
+    """
+    Graphs of imports, loaded by this process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.imports = {}
+
+    def get(self, import_id):
+        """
+        Graph of import, or None, if it isn't loaded or it's outdated.
+        """
+        with self.lock:
+            graph = self.imports.get(import_id)
+            if graph is not None and graph.outdated:
+                del self.imports[import_id]
+                return None
+            return graph
+
+    def create(self, import_id, citizens_relatives):
+        graph = RelativesGraph(citizens_relatives)
+        with self.lock:
+            return self.imports.setdefault(import_id, graph)
+
+    def drop(self, import_id):
+        with self.lock:
+            self.imports.pop(import_id, None)
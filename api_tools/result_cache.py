@@ -0,0 +1,188 @@
+"""
+Cache of GET answers, shared by worker processes of one host.
+
+Answers (JSON bytes) are files at cache directory (it's better to put
+it at tmpfs, e.g. /dev/shm), named by import id, its version and key
+of request. Version of import is a file too, so update in one process
+invalidates answers for all of them: version is incremented, answers
+of old versions are removed. If total size of answers is above
+max_bytes, the least recently used ones are removed.
+
+Files are written to temporary ones and renamed, so readers never see
+a part of file. Versions changes and eviction are serialized between
+processes by flock of lock file.
+"""
+import fcntl
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+from flask import current_app as app
+
+LOCK_NAME = '.lock'
+TEMPORARY_PREFIX = '.tmp'
+VERSION_NAME = '{import_id}.version'
+ANSWER_NAME = '{import_id}.{version}.{key}.json'
+ANSWER_NAME_PATTERN = re.compile(r'(\d+)\.(\d+)\.\w+\.json$')
+
+
+def get_key(name, args):
+    """
+    Part of file name for function name and its arguments.
+    """
+    return re.sub(r'\W', '_', '_'.join([name] + [str(arg) for arg in args]))
+
+
+class SharedResultCache:
+    """
+    Answers of storage functions at directory, up to max_bytes.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def locked(self):
+        """
+        Exclusive lock between processes and threads: every call
+        opens lock file again, and flock locks are per open file.
+        """
+        with open(self.get_path(LOCK_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def write(self, path, data):
+        """
+        Write file atomically.
+        """
+        descriptor, temporary_path = tempfile.mkstemp(
+            dir=self.directory, prefix=TEMPORARY_PREFIX)
+        try:
+            with os.fdopen(descriptor, 'wb') as file_object:
+                file_object.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def get_version(self, import_id):
+        try:
+            with open(self.get_path(VERSION_NAME.format(import_id=import_id)),
+                      'rb') as file_object:
+                return int(file_object.read())
+        except FileNotFoundError:
+            return 0
+
+    def list_answers(self):
+        """
+        (path, import_id, version, size, modification time) of answers.
+        """
+        answers = []
+        for entry in os.scandir(self.directory):
+            match = ANSWER_NAME_PATTERN.match(entry.name)
+            if match is None:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            answers.append((entry.path, int(match.group(1)),
+                            int(match.group(2)), stat.st_size,
+                            stat.st_mtime))
+        return answers
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, import_id):
+        """
+        Increment version of import, remove its answers.
+        """
+        with self.locked():
+            version = self.get_version(import_id) + 1
+            self.write(self.get_path(VERSION_NAME.format(import_id=import_id)),
+                       str(version).encode())
+            for path, answer_import_id, _, _, _ in self.list_answers():
+                if answer_import_id == import_id:
+                    self.remove(path)
+        return version
+
+    def get(self, import_id, version, key):
+        """
+        Cached answer or None.
+        """
+        path = self.get_path(ANSWER_NAME.format(import_id=import_id,
+                                                version=version,
+                                                key=key))
+        try:
+            with open(path, 'rb') as file_object:
+                data = file_object.read()
+            # Modification time is the last use for eviction.
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, import_id, version, key, data):
+        """
+        Save answer, if version of import isn't changed meanwhile,
+        and evict the least recently used ones. Cache errors only
+        are logged, answer is given anyway.
+        """
+        if len(data) > self.max_bytes:
+            return
+        try:
+            with self.locked():
+                if self.get_version(import_id) != version:
+                    return
+                self.write(self.get_path(ANSWER_NAME.format(
+                    import_id=import_id, version=version, key=key)), data)
+                self.evict()
+        except OSError:
+            app.logger.exception('Answer isn\'t cached.')
+
+    def evict(self):
+        answers = self.list_answers()
+        size = sum(answer[3] for answer in answers)
+        answers.sort(key=lambda answer: answer[4])
+        for path, _, _, answer_size, _ in answers:
+            if size <= self.max_bytes:
+                break
+            self.remove(path)
+            size -= answer_size
+
+    def wrap(self, function, version):
+        """
+        function(import_id, *args), which answer is cached
+        for this version of import.
+        """
+        def cached_function(import_id, *args):
+            key = get_key(function.__name__, args)
+            data = self.get(import_id, version, key)
+            if data is None:
+                data = function(import_id, *args)
+                self.put(import_id, version, key, data)
+            return data
+        return cached_function
+
+    def get_stats(self):
+        answers = self.list_answers()
+        return {
+            'answers': len(answers),
+            'bytes': sum(answer[3] for answer in answers),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,79 @@
+"""
+Imports retention: background reaper deletes imports, which are too old
+or above maximum number, in small batches off the request path.
+"""
+import threading
+import time
+
+# Pause between batches, so deletion doesn't hold DB for long.
+BATCH_PAUSE_SECONDS = 1.0
+
+
+def select_expired(imports, now, max_age=0, max_count=0):
+    """
+    imports is list of (import_id, creation timestamp) sorted by id.
+    Return ids to delete, the oldest first. 0 turns limit off.
+    """
+    expired = set()
+    if max_age > 0:
+        expired.update(import_id for import_id, created_at in imports
+                       if now - created_at > max_age)
+    if 0 < max_count < len(imports):
+        expired.update(import_id for import_id, _
+                       in imports[:len(imports) - max_count])
+    return sorted(expired)
+
+
+class ImportsReaper(threading.Thread):
+    """
+    Every interval seconds delete expired imports of storage,
+    batch_size at once.
+    """
+    def __init__(self, app, storage, max_age=0, max_count=0,
+                 interval=60, batch_size=10):
+        super().__init__(name='imports-reaper', daemon=True)
+        self.app = app
+        self.storage = storage
+        self.max_age = max_age
+        self.max_count = max_count
+        self.interval = interval
+        self.batch_size = batch_size
+        self.stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.max_age > 0 or self.max_count > 0
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.reap()
+            except Exception:
+                self.app.logger.exception('Imports cleanup failed.')
+
+    def stop(self):
+        self.stopped.set()
+
+    def reap(self):
+        """
+        Delete expired imports, return number of deleted ones.
+        """
+        with self.app.app_context():
+            expired = select_expired(self.storage.list_imports(),
+                                     time.time(),
+                                     self.max_age,
+                                     self.max_count)
+            deleted = 0
+            for start in range(0, len(expired), self.batch_size):
+                if start > 0 and self.stopped.wait(BATCH_PAUSE_SECONDS):
+                    break
+                for import_id in expired[start:start + self.batch_size]:
+                    try:
+                        self.storage.delete_import(import_id)
+                        deleted += 1
+                    except ValueError:
+                        # Already deleted by request.
+                        pass
+            if expired:
+                self.app.logger.info('%d expired imports deleted.', deleted)
+            return deleted
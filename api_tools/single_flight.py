@@ -0,0 +1,52 @@
+"""
+Single-flight: concurrent calls with the same key share one execution.
+"""
+import threading
+
+
+class Call:
+    """
+    Execution, which other callers wait for.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    While function is running for key, other callers with the same key
+    wait for it and get its result (or its exception). Nothing is kept
+    after it's finished.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, function, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = Call()
+                self.executed += 1
+            else:
+                self.shared += 1
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
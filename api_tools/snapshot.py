@@ -0,0 +1,119 @@
+"""
+Snapshot of import: binary COPY data of its table, compressed by zlib.
+
+File is MAGIC, 4 bytes of header length, JSON header and compressed
+data. Header keeps format and schema versions, columns, size and
+SHA-256 of uncompressed data, which is checked at restore.
+"""
+import hashlib
+import json
+import shutil
+import struct
+import zlib
+
+MAGIC = b'YBSSNAP\n'
+FORMAT_VERSION = 1
+HEADER_LENGTH = struct.Struct('>I')
+MAX_HEADER_LENGTH = 1 << 16
+# Header keys, which reader checks data with, and their types.
+REQUIRED_KEYS = {
+    'size': int,
+    'sha256': str,
+}
+CHUNK_SIZE = 1 << 16
+
+
+class CompressingWriter:
+    """
+    File-like object for COPY TO: compresses and hashes data.
+    """
+    def __init__(self, file_object, level=1):
+        self.file_object = file_object
+        self.compressor = zlib.compressobj(level)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        self.file_object.write(self.compressor.compress(data))
+
+    def close(self):
+        self.file_object.write(self.compressor.flush())
+
+
+class DecompressingReader:
+    """
+    File-like object for COPY FROM: decompresses and hashes data.
+    """
+    def __init__(self, file_object):
+        self.file_object = file_object
+        self.decompressor = zlib.decompressobj()
+        self.buffer = bytearray()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) \
+                and not self.decompressor.eof:
+            chunk = self.file_object.read(CHUNK_SIZE)
+            try:
+                if not chunk:
+                    self.buffer += self.decompressor.flush()
+                    break
+                self.buffer += self.decompressor.decompress(chunk)
+            except zlib.error as error:
+                raise ValueError('Snapshot is corrupted: {}'.format(error))
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def check(self, header):
+        if self.size != header['size'] \
+                or self.sha256.hexdigest() != header['sha256']:
+            raise ValueError('Snapshot checksum doesn\'t match.')
+
+
+def write_snapshot(file_object, header, compressed_data):
+    """
+    Write header and compressed data from compressed_data file.
+    """
+    header = dict(header, format=FORMAT_VERSION)
+    header_json = json.dumps(header, sort_keys=True).encode()
+    file_object.write(MAGIC)
+    file_object.write(HEADER_LENGTH.pack(len(header_json)))
+    file_object.write(header_json)
+    shutil.copyfileobj(compressed_data, file_object)
+
+
+def read_header(file_object):
+    """
+    Read header, file is left at compressed data.
+    """
+    if file_object.read(len(MAGIC)) != MAGIC:
+        raise ValueError('It isn\'t import snapshot.')
+    try:
+        header_length, = HEADER_LENGTH.unpack(
+            file_object.read(HEADER_LENGTH.size))
+    except struct.error:
+        raise ValueError('Snapshot header is corrupted.')
+    if header_length > MAX_HEADER_LENGTH:
+        raise ValueError('Snapshot header is too long.')
+    try:
+        header = json.loads(file_object.read(header_length).decode())
+    except ValueError:
+        raise ValueError('Snapshot header is corrupted.')
+    if not isinstance(header, dict):
+        raise ValueError('Snapshot header is corrupted.')
+    if header.get('format') != FORMAT_VERSION:
+        raise ValueError('Unknown snapshot format {}.'
+                         .format(header.get('format')))
+    for key, value_type in REQUIRED_KEYS.items():
+        if not isinstance(header.get(key), value_type):
+            raise ValueError('Snapshot header has no correct {}.'
+                             .format(key))
+    return header
@@ -4,6 +4,78 @@ SELECT table_name
 FROM information_schema.tables
 WHERE table_schema = 'public';
 """
+# Schema migrations are applied once by one process at a time.
+LOCK_SCHEMA_SQL = "SELECT pg_advisory_xact_lock(hashtext('schema'));"
+CREATE_MIGRATIONS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version integer PRIMARY KEY,
+    name text NOT NULL,
+    applied_at timestamptz NOT NULL DEFAULT now()
+);
+"""
+GET_MIGRATIONS_SQL = "SELECT version FROM schema_migrations"
+ADD_MIGRATION_SQL = """
+INSERT INTO schema_migrations (version, name)
+VALUES (%s, %s)
+"""
+# Session default for every new connection of service role,
+# so requests don't set it.
+SET_ROLE_TIMEZONE_SQL = "ALTER ROLE CURRENT_USER SET timezone TO 'GMT';"
+# Registry of imports: ids come from sequence, so concurrent imports
+# never get the same one, and creation time is kept for retention.
+CHECK_IF_REGISTRY_EXISTS_SQL = "SELECT to_regclass('public.imports');"
+CREATE_REGISTRY_SQL = """
+CREATE SEQUENCE import_id_seq MINVALUE 0 START {start};
+CREATE TABLE imports (
+    import_id integer PRIMARY KEY DEFAULT nextval('import_id_seq'),
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+ALTER SEQUENCE import_id_seq OWNED BY imports.import_id;
+"""
+REGISTER_TABLES_SQL = """
+INSERT INTO imports (import_id)
+SELECT unnest(%s::integer[])
+"""
+# Statements, which don't depend on import table, are prepared
+# once for every pooled connection.
+PREPARE_STATEMENTS_SQL = """
+PREPARE check_import(integer) AS
+SELECT to_regclass('public.import_' || $1);
+PREPARE register_import AS
+INSERT INTO imports DEFAULT VALUES RETURNING import_id;
+PREPARE unregister_import(integer) AS
+DELETE FROM imports WHERE import_id = $1;
+PREPARE get_imports AS
+SELECT import_id, EXTRACT(EPOCH FROM created_at)::float8
+FROM imports
+ORDER BY import_id;
+"""
+REGISTER_IMPORT_SQL = "EXECUTE register_import"
+GET_IMPORTS_SQL = "EXECUTE get_imports"
+# Shard i of n allocates import ids i, i + n, i + 2n...
+# Registrations are blocked, while its sequence is restarted.
+LOCK_REGISTRY_SQL = "LOCK TABLE imports IN SHARE MODE;"
+GET_SEQUENCE_SQL = """
+SELECT increment_by, last_value, start_value
+FROM pg_sequences
+WHERE schemaname = 'public' AND sequencename = 'import_id_seq'
+"""
+RESTART_SEQUENCE_SQL = """
+ALTER SEQUENCE import_id_seq INCREMENT BY {increment} RESTART WITH {start};
+"""
+DROP_TABLE_SQL = "DROP TABLE import_{import_id};"
+# Planner's estimate, it's cheap to get for slow queries log.
+ESTIMATE_IMPORT_ROWS_SQL = """
+SELECT reltuples::bigint
+FROM pg_class
+WHERE oid = to_regclass('import_{import_id}')
+"""
+# Failed explain of slow statement is rolled back to savepoint,
+# so transaction of request goes on.
+SAVEPOINT_EXPLAIN_SQL = "SAVEPOINT explain_slow_query"
+ROLLBACK_TO_EXPLAIN_SQL = "ROLLBACK TO SAVEPOINT explain_slow_query"
+RELEASE_EXPLAIN_SQL = "RELEASE SAVEPOINT explain_slow_query"
+UNREGISTER_IMPORT_SQL = "EXECUTE unregister_import({import_id})"
 CREATE_TYPE_SQL = """
 DO $$
 BEGIN
@@ -23,9 +95,29 @@ CREATE TABLE import_{import_id} (
     name varchar(256),
     birth_date date,
     gender gender_type,
-    relatives integer[]
+    relatives integer[],
+    birth_month smallint
+        GENERATED ALWAYS AS (EXTRACT(MONTH FROM birth_date)) STORED
 );
 """
+# Tables of imports, created before birth_month column.
+UPGRADE_TABLE_SQL = """
+ALTER TABLE import_{import_id}
+ADD COLUMN IF NOT EXISTS birth_month smallint
+    GENERATED ALWAYS AS (EXTRACT(MONTH FROM birth_date)) STORED;
+"""
+# Indexes are built after bulk insert, it's faster than updating them.
+CREATE_INDEXES_SQL = """
+CREATE INDEX IF NOT EXISTS import_{import_id}_town_birth_date_idx
+ON import_{import_id} (town, birth_date);
+"""
+# Relatives are updated by primary key, GIN index isn't used any more.
+DROP_RELATIVES_INDEX_SQL = """
+DROP INDEX IF EXISTS import_{import_id}_relatives_idx;
+"""
+# Can't be run inside transaction. Fills visibility map,
+# so index-only scans don't read the table.
+VACUUM_ANALYZE_SQL = "VACUUM ANALYZE import_{import_id};"
 INSERT_DATA_PATTERN = '({})'.format(','.join(['%s' for _ in range(9)]))
 FIELD_NAMES = [
     'citizen_id',
@@ -39,9 +131,18 @@ FIELD_NAMES = [
     'relatives',
 ]
 INSERT_INTO_SQL = 'INSERT INTO import_{import_id} VALUES '
-CHECK_IF_TABLE_EXISTS_SQL = """
-SELECT to_regclass('public.import_{import_id}');
-"""
+# Columns are listed, generated birth_month can't be copied to.
+COPY_TO_SQL = (
+    "COPY import_{import_id} ("
+    + ", ".join(FIELD_NAMES)
+    + ") TO STDOUT WITH (FORMAT binary)"
+)
+COPY_FROM_SQL = (
+    "COPY import_{import_id} ("
+    + ", ".join(FIELD_NAMES)
+    + ") FROM STDIN WITH (FORMAT binary)"
+)
+CHECK_IF_TABLE_EXISTS_SQL = "EXECUTE check_import({import_id})"
 CHECK_IF_CITIZEN_EXISTS_SQL = """
 SELECT EXISTS (
     SELECT 1
@@ -60,59 +161,167 @@ UPDATE import_{import_id}
 SET {fields}
 WHERE citizen_id={citizen_id}
 """
-GET_RELATIVES_SQL = """
-SELECT relatives
+ADD_RELATIVE_SQL = """
+UPDATE import_{import_id}
+SET relatives = array_append(relatives, {citizen_id})
+WHERE citizen_id = ANY(%s)
+AND NOT relatives @> ARRAY[{citizen_id}]
+"""
+# Ex-relatives are known from relatives graph.
+REMOVE_BACK_LINK_SQL = """
+UPDATE import_{import_id}
+SET relatives = array_remove(relatives, {citizen_id})
+WHERE citizen_id = ANY(%s)
+"""
+# PATCH locks rows, it changes, in order of ids, so concurrent PATCHes
+# don't deadlock: citizen, given ids and current relatives of citizen.
+# Savepoint lets to release locks, if relatives are changed meanwhile.
+LOCK_CITIZENS_SQL = """
+SAVEPOINT lock_citizens;
+SELECT citizen_id, relatives
+FROM import_{import_id}
+WHERE citizen_id = ANY(%s::integer[] || (
+    SELECT {citizen_id} || relatives
+    FROM import_{import_id}
+    WHERE citizen_id = {citizen_id}
+))
+ORDER BY citizen_id
+FOR UPDATE
+"""
+ROLLBACK_TO_SAVEPOINT_SQL = "ROLLBACK TO SAVEPOINT lock_citizens"
+# Batch of PATCHes locks all rows, which its updates may change,
+# at once in order of ids: given ids and current relatives of citizens.
+LOCK_BATCH_SQL = """
+SAVEPOINT lock_citizens;
+SELECT citizen_id, relatives
+FROM import_{import_id}
+WHERE citizen_id = ANY(%s::integer[] || ARRAY(
+    SELECT unnest(relatives)
+    FROM import_{import_id}
+    WHERE citizen_id = ANY(%s)
+))
+ORDER BY citizen_id
+FOR UPDATE
+"""
+# Every update of batch has its own savepoint, so failed one
+# doesn't roll back others.
+SAVEPOINT_UPDATE_SQL = "SAVEPOINT update_citizen"
+ROLLBACK_TO_UPDATE_SQL = "ROLLBACK TO SAVEPOINT update_citizen"
+RELEASE_UPDATE_SQL = "RELEASE SAVEPOINT update_citizen"
+GET_EXISTING_CITIZENS_SQL = """
+SELECT citizen_id
 FROM import_{import_id}
-WHERE citizen_id = {citizen_id}
+WHERE citizen_id = ANY(%s)
+"""
+LOCK_ROWS_SQL = """
+SELECT citizen_id
+FROM import_{import_id}
+WHERE citizen_id = ANY(%s)
+ORDER BY citizen_id
+FOR UPDATE
+"""
+# Citizens, appended to import, are added to relatives of its citizens
+# in order of (relative_id, citizen_id) pairs.
+ADD_BACK_LINKS_SQL = """
+UPDATE import_{import_id} AS citizens
+SET relatives = citizens.relatives || back_links.citizen_ids
+FROM (
+    SELECT relative_id, array_agg(citizen_id ORDER BY position) AS citizen_ids
+    FROM unnest(%s::integer[], %s::integer[])
+        WITH ORDINALITY AS links(relative_id, citizen_id, position)
+    GROUP BY relative_id
+) AS back_links
+WHERE citizens.citizen_id = back_links.relative_id
+"""
+GET_RELATIVES_SQL = "SELECT citizen_id, relatives FROM import_{import_id}"
+GET_TOWNS_BIRTH_DATES_SQL = """
+SELECT town, birth_date FROM import_{import_id}
 """
 GET_CITIZEN_SQL = GET_FULL_TABLE_SQL + "\nWHERE citizen_id={citizen_id}"
+# Relationships are symmetric, so citizen buys presents to everyone,
+# who has him at relatives.
 GET_BIRTHDAYS_SQL = """
-WITH birth_dates as (
-        SELECT
-        citizen_id,
-        date_part('month', birth_date) as birth_month
-        FROM import_{import_id}
-        ),
-    relatives as (
-        SELECT
-        citizen_id,
-        unnest(relatives) as relative_id
-        FROM import_{import_id}
-        )
 SELECT
     birth_month,
-    citizen_id,
-    SUM(counter) as presents
-FROM (
-    SELECT
-    relatives.citizen_id as citizen_id,
-    birth_dates.birth_month as birth_month,
-    1 as counter
-    FROM relatives
-    INNER JOIN birth_dates
-    ON (relatives.relative_id = birth_dates.citizen_id)
-    ) as ungrouped_data
-GROUP BY citizen_id, birth_month
-ORDER BY birth_month, citizen_id
+    relative_id as citizen_id,
+    count(*) as presents
+FROM import_{import_id}, unnest(relatives) as relative_id
+GROUP BY birth_month, relative_id
+ORDER BY birth_month, relative_id
 """
+# Ages histogram of every town: percentile_cont would sort all ages,
+# but grouping needs only index-only scan on (town, birth_date).
+# Percentiles are calculated from histogram.
 GET_AGES_SQL = """
 SELECT
 town,
-round(p50::numeric, 2) as p50,
-round(p75::numeric, 2) as p75,
-round(p99::numeric, 2) as p99
-FROM (
+EXTRACT (YEAR FROM age(birth_date)) as age,
+count(*) as citizens_number
+FROM import_{import_id}
+GROUP BY town, age
+ORDER BY town, age
+"""
+# Answers rendered to JSON by DB, fetched as single text value.
+GET_FULL_TABLE_JSON_SQL = (
+    "SELECT coalesce(json_agg(citizens), '[]')::text FROM (\n"
+    + GET_FULL_TABLE_SQL
+    + "\n) AS citizens"
+)
+GET_BIRTHDAYS_JSON_SQL = (
+    "SELECT coalesce(json_object_agg(birth_month, presents"
+    " ORDER BY birth_month), '{{}}')::text FROM (\n"
+    "SELECT birth_month, json_agg(json_build_object("
+    "'citizen_id', citizen_id, 'presents', presents)"
+    " ORDER BY citizen_id) AS presents FROM (\n"
+    + GET_BIRTHDAYS_SQL
+    + "\n) AS birthdays GROUP BY birth_month\n) AS months"
+)
+# percentile_cont from ages histogram, the same way as
+# stat_tools.percentile_cont_histogram. Percentiles names and
+# fractions are arrays parameters.
+GET_AGES_JSON_SQL = """
+WITH histogram AS (
+    SELECT
+    town,
+    EXTRACT (YEAR FROM age(birth_date))::float8 as age,
+    count(*) as citizens_number
+    FROM import_{import_id}
+    GROUP BY town, age
+), cumulative AS (
+    SELECT
+    town,
+    age,
+    sum(citizens_number) OVER (PARTITION BY town ORDER BY age) as seen,
+    sum(citizens_number) OVER (PARTITION BY town) as total
+    FROM histogram
+), positions AS (
+    SELECT DISTINCT
+    town,
+    name,
+    fraction * (total - 1)::float8 as position
+    FROM cumulative, unnest(%s::text[], %s::float8[]) AS p(name, fraction)
+), percentiles AS (
     SELECT
     town,
-    percentile_cont(0.5) within GROUP (order by age) as p50,
-    percentile_cont(0.75) within GROUP (order by age) as p75,
-    percentile_cont(0.99) within GROUP (order by age) as p99
-    FROM (
+    name,
+    first + (position - floor(position)) * (second - first) as value
+    FROM positions, LATERAL (
         SELECT
-        EXTRACT (YEAR FROM age(birth_date)) as age,
-        town
-        FROM import_{import_id}
-        ) as towns_ages
+        min(age) FILTER (WHERE seen > floor(position)) as first,
+        min(age) FILTER (WHERE seen > ceil(position)) as second
+        FROM cumulative
+        WHERE cumulative.town = positions.town
+    ) AS ages
+)
+SELECT coalesce(json_agg(town_stat ORDER BY town COLLATE "C"), '[]')::text
+FROM (
+    SELECT
+    town,
+    jsonb_build_object('town', town)
+    || jsonb_object_agg(name, round(value::numeric, 2)) as town_stat
+    FROM percentiles
     GROUP BY town
-    ) as towns_stat
-"""
\ No newline at end of file
+) AS towns
+"""
+# Statement timeout of request, only until the end of transaction.
+SET_STATEMENT_TIMEOUT_SQL = "SET LOCAL statement_timeout = %s"
@@ -0,0 +1,85 @@
+"""
+Tools to calculate ages stat the same way as PostgreSQL does.
+"""
+import math
+from decimal import Decimal, ROUND_HALF_UP
+
+PERCENTILES = [
+    ('p50', 0.5),
+    ('p75', 0.75),
+    ('p99', 0.99),
+]
+
+
+def get_age(birth_date, today):
+    """
+    Full years, like EXTRACT(YEAR FROM age(birth_date)) in PostgreSQL.
+    """
+    return (today.year - birth_date.year
+            - ((today.month, today.day) < (birth_date.month, birth_date.day)))
+
+
+def interpolate(first, second, position):
+    """
+    Value at position between first_row and second_row,
+    the same operations order as at percentile_cont.
+    """
+    return first + (position - int(position)) * (second - first)
+
+
+def percentile_cont(sorted_values, fraction):
+    """
+    Linear interpolation between closest ranks, like percentile_cont.
+    """
+    position = fraction * (len(sorted_values) - 1)
+    first_row = int(position)
+    first = float(sorted_values[first_row])
+    if first_row == position:
+        return first
+    second = float(sorted_values[first_row + 1])
+    return interpolate(first, second, position)
+
+
+def percentile_cont_histogram(values_counts, fraction):
+    """
+    percentile_cont of values, given as sorted list of (value, count).
+    """
+    total = sum(count for _, count in values_counts)
+    position = fraction * (total - 1)
+    first_row = int(position)
+    second_row = math.ceil(position)
+    first = second = None
+    seen = 0
+    for value, count in values_counts:
+        seen += count
+        if first is None and first_row < seen:
+            first = float(value)
+        if second_row < seen:
+            second = float(value)
+            break
+    if first_row == position:
+        return first
+    return interpolate(first, second, position)
+
+
+def round_percentile(value, precision=2):
+    """
+    Round like round(value::numeric, 2): float8 is converted to numeric
+    with 15 significant digits, then half is rounded away from zero.
+    """
+    number = Decimal('{:.15g}'.format(value))
+    quantum = Decimal(1).scaleb(-precision)
+    return float(number.quantize(quantum, rounding=ROUND_HALF_UP))
+
+
+def format_ages_stat(towns_percentiles):
+    """
+    {town: [p50, p75, p99]} -> answer format.
+    """
+    data = []
+    for town, values in sorted(towns_percentiles.items()):
+        town_dict = {'town': town}
+        for (name, _), value in zip(PERCENTILES, values):
+            town_dict[name] = round_percentile(value)
+        data.append(town_dict)
+    return data
@@ -0,0 +1,127 @@
+"""
+Interface of imports storage.
+"""
+import json
+import threading
+from collections import Counter
+
+from api_tools.age_sketch import ImportsAgeSketches
+from api_tools.citizen import citizens_to_json
+
+
+def to_json(data):
+    """
+    Encode like Flask jsonify.
+    """
+    return json.dumps(data, sort_keys=True,
+                      separators=(',', ':')).encode()
+
+
+class StorageEngine:
+    """
+    Base class of storage engines. Methods raise ValueError,
+    if import or citizen doesn't exist.
+    Version of import is changed by every update or deletion.
+    If result_cache is given, versions are kept there, so they are
+    shared with other processes.
+    """
+    def __init__(self, age_sketch_resolution=0, result_cache=None):
+        self.age_sketches = ImportsAgeSketches(age_sketch_resolution)
+        self.result_cache = result_cache
+        self.versions_lock = threading.Lock()
+        self.versions = Counter()
+
+    def get_version(self, import_id):
+        if self.result_cache is not None:
+            return self.result_cache.get_version(import_id)
+        return self.versions[import_id]
+
+    def change_version(self, import_id):
+        """
+        Increment version of import, return new one.
+        """
+        if self.result_cache is not None:
+            return self.result_cache.invalidate(import_id)
+        with self.versions_lock:
+            self.versions[import_id] += 1
+            return self.versions[import_id]
+
+    def prepare(self):
+        """
+        Called once at service start, before requests.
+        """
+
+    def save_import(self, citizens):
+        """
+        Save checked citizens records, return {'import_id': import_id}.
+        """
+        raise NotImplementedError
+
+    def append_citizens(self, import_id, citizens):
+        """
+        Add citizens records, checked one by one, to import.
+        Their relatives may be citizens of import, back-links are added
+        to them. Return {'import_id': import_id}.
+        """
+        raise NotImplementedError
+
+    def export_snapshot(self, import_id, file_object):
+        """
+        Write binary snapshot of import to file.
+        """
+        raise NotImplementedError
+
+    def restore_snapshot(self, file_object):
+        """
+        Create new import from snapshot, return {'import_id': import_id}.
+        """
+        raise NotImplementedError
+
+    def update_citizen(self, import_id, citizen_id, citizen_update):
+        """
+        Update citizen and his relatives, return updated citizen record.
+        """
+        raise NotImplementedError
+
+    def load_import(self, import_id):
+        """
+        Return list of citizens records.
+        """
+        raise NotImplementedError
+
+    def delete_import(self, import_id):
+        """
+        Delete import with all its data.
+        """
+        raise NotImplementedError
+
+    def list_imports(self):
+        """
+        Return list of (import_id, creation timestamp), sorted by id.
+        """
+        raise NotImplementedError
+
+    def calculate_birthdays(self, import_id):
+        """
+        Return presents stat by months.
+        """
+        raise NotImplementedError
+
+    def calculate_ages_stat(self, import_id, approximate=False):
+        """
+        Return towns ages percentiles. Approximate ones are calculated
+        from age sketches, if there is sketch for this import.
+        """
+        raise NotImplementedError
+
+    def load_import_json(self, import_id):
+        """
+        Return citizens list encoded to JSON bytes.
+        """
+        return citizens_to_json(self.load_import(import_id)).encode()
+
+    def calculate_birthdays_json(self, import_id):
+        return to_json(self.calculate_birthdays(import_id))
+
+    def calculate_ages_stat_json(self, import_id, approximate=False):
+        return to_json(self.calculate_ages_stat(import_id, approximate))
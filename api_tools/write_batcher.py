@@ -0,0 +1,95 @@
+"""
+Group commit: concurrent writes with the same key are collected
+for a short time and applied by one of the callers together,
+so they share one transaction and one commit.
+"""
+import threading
+
+
+class Write:
+    """
+    Write, which its caller waits for.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Batch:
+    def __init__(self, previous):
+        self.writes = []
+        self.full = threading.Event()
+        self.applied = threading.Event()
+        self.previous = previous
+
+
+class WriteBatcher:
+    """
+    The first caller of batch is its leader: it waits up to max_delay
+    seconds (or until there are max_size writes) and calls
+    apply(key, writes), which sets result or error of every write.
+    Batches of key are applied one by one in order of arrival,
+    and writes inside batch keep their order.
+    """
+    def __init__(self, apply, max_size, max_delay):
+        self.apply = apply
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        # Open batch and the last batch of every key.
+        self.open_batches = {}
+        self.last_batches = {}
+        self.batches = 0
+        self.writes = 0
+
+    def close(self, key, batch):
+        if self.open_batches.get(key) is batch:
+            del self.open_batches[key]
+
+    def do(self, key, *args):
+        """
+        Add write to batch of key, return its result or raise its error.
+        """
+        write = Write(args)
+        with self.lock:
+            batch = self.open_batches.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = Batch(self.last_batches.get(key))
+                self.open_batches[key] = batch
+                self.last_batches[key] = batch
+                self.batches += 1
+            batch.writes.append(write)
+            self.writes += 1
+            if len(batch.writes) >= self.max_size:
+                self.close(key, batch)
+                batch.full.set()
+        if is_leader:
+            self.run(key, batch)
+        write.done.wait()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    def run(self, key, batch):
+        batch.full.wait(self.max_delay)
+        with self.lock:
+            self.close(key, batch)
+        if batch.previous is not None:
+            batch.previous.applied.wait()
+            batch.previous = None
+        try:
+            self.apply(key, batch.writes)
+        except Exception as error:
+            for write in batch.writes:
+                if write.result is None and write.error is None:
+                    write.error = error
+        finally:
+            with self.lock:
+                if self.last_batches.get(key) is batch:
+                    del self.last_batches[key]
+            batch.applied.set()
+            for write in batch.writes:
+                write.done.set()
@@ -3,7 +3,7 @@ Run Flask application.
 """
 import os
 import pickle
-import logging
+import tempfile
 
 from flask import (
     Flask,
@@ -11,56 +11,277 @@ from flask import (
     jsonify,
     abort,
     make_response,
+    send_file,
+    g,
     logging as flask_logging,
 )
 import psycopg2
+import psycopg2.extensions
 
+from api_tools import config
+from api_tools.log_tools import (
+    setup_logging,
+    setup_file_logging,
+    sample_request_debug,
+)
 from api_tools.check_data import (
     check_citizens_group,
+    check_citizens_list,
     check_update_citizen,
 )
-from api_tools.db_tools import (
-    check_citizen_exists,
-    check_citizen_relatives_exist,
-    check_import_exists,
-    save_new_import,
-    update_import,
-    load_import,
-    calculate_birthdays,
-    calculate_ages_stat,
+from api_tools.citizen import Citizen
+from api_tools.db_tools import PostgresEngine
+from api_tools.memory_engine import MemoryEngine
+from api_tools.retention import ImportsReaper
+from api_tools.admission import AdmissionLimit
+from api_tools.single_flight import SingleFlight
+from api_tools.result_cache import SharedResultCache
+from api_tools.cancellation import (
+    ClientDisconnected,
+    RequestGuard,
+    get_client_socket,
+)
+from api_tools.query_log import SLOW_QUERY_LOGGER, queries_stats
+from api_tools.profiling import (
+    ProfilesStore,
+    should_profile,
+    start_profiler,
 )
 
 app = Flask(__name__)
+app.config.from_object(config)
+
+setup_logging(
+    level=app.config['LOG_LEVEL'],
+    log_format=app.config['LOG_FORMAT'],
+    debug_sample_rate=app.config['DEBUG_SAMPLE_RATE'])
+app.logger.removeHandler(flask_logging.default_handler)
+if app.config['SLOW_QUERY_LOG_PATH']:
+    setup_file_logging(
+        SLOW_QUERY_LOGGER,
+        app.config['SLOW_QUERY_LOG_PATH'],
+        max_bytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+        backup_count=app.config['SLOW_QUERY_LOG_BACKUP_COUNT'])
+
+STORAGE_ENGINES = {
+    'postgres': PostgresEngine,
+    'memory': MemoryEngine,
+}
+
 
-logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s %(levelname)s:%(module)s %(message)s')
+def check_age_sketches(config):
+    """
+    Import versions are shared by workers only through result cache,
+    without it age sketches of postgres engine miss PATCHes of other
+    workers.
+    """
+    if config['STORAGE_ENGINE'] == 'postgres' \
+            and config['AGE_SKETCH_RESOLUTION_DAYS'] > 0 \
+            and not config['RESULT_CACHE_DIR']:
+        raise ValueError('AGE_SKETCH_RESOLUTION_DAYS of postgres engine '
+                         'needs RESULT_CACHE_DIR, which keeps import '
+                         'versions of all workers.')
 
+
+check_age_sketches(app.config)
+result_cache = None
+# Memory engine keeps imports per process, so answers can't be shared.
+if app.config['RESULT_CACHE_DIR'] \
+        and app.config['STORAGE_ENGINE'] == 'postgres':
+    result_cache = SharedResultCache(app.config['RESULT_CACHE_DIR'],
+                                     app.config['RESULT_CACHE_MAX_BYTES'])
+storage = STORAGE_ENGINES[app.config['STORAGE_ENGINE']](
+    age_sketch_resolution=app.config['AGE_SKETCH_RESOLUTION_DAYS'],
+    result_cache=result_cache)
+with app.app_context():
+    try:
+        storage.prepare()
+    except psycopg2.OperationalError:
+        # Schema and connections are prepared at the first request then.
+        app.logger.exception('Storage isn\'t ready at start.')
+reaper = ImportsReaper(
+    app,
+    storage,
+    max_age=app.config['IMPORTS_MAX_AGE_SECONDS'],
+    max_count=app.config['IMPORTS_MAX_COUNT'],
+    interval=app.config['RETENTION_INTERVAL_SECONDS'],
+    batch_size=app.config['RETENTION_BATCH_SIZE'])
+if reaper.enabled:
+    reaper.start()
+
+IMPORT_URL = '/imports/<int:import_id>'
 PATCH_URL = '/imports/<int:import_id>/citizens/<int:citizen_id>'
 GET_CITIZENS_URL = '/imports/<int:import_id>/citizens'
 GET_BIRTHDAYS_URL = '/imports/<int:import_id>/citizens/birthdays'
 GET_AGES_URL = '/imports/<int:import_id>/towns/stat/percentile/age'
+SNAPSHOT_URL = '/imports/<int:import_id>/snapshot'
+RESTORE_URL = '/imports/snapshot'
+
+
+ADMISSION_LIMITED_ENDPOINTS = ['get_birthdays', 'get_ages']
+admission_limits = {}
+if app.config['ANALYTICS_CONCURRENCY'] > 0:
+    admission_limits = {
+        endpoint: AdmissionLimit(
+            app.config['ANALYTICS_CONCURRENCY'],
+            queue_size=app.config['ANALYTICS_QUEUE_SIZE'],
+            timeout=app.config['ANALYTICS_QUEUE_TIMEOUT_SECONDS'])
+        for endpoint in ADMISSION_LIMITED_ENDPOINTS}
+
+
+# Statement timeouts of routes, their queries are also cancelled,
+# when client disconnects.
+STATEMENT_TIMEOUTS_MS = {
+    'get_citizens': app.config['READ_STATEMENT_TIMEOUT_MS'],
+    'get_birthdays': app.config['ANALYTICS_STATEMENT_TIMEOUT_MS'],
+    'get_ages': app.config['ANALYTICS_STATEMENT_TIMEOUT_MS'],
+}
+
+
+single_flight = SingleFlight()
+profiles = ProfilesStore(app.config['PROFILE_DIR'],
+                         max_files=app.config['PROFILE_MAX_FILES'])
+
+
+def read_import(function, import_id, *args):
+    """
+    Concurrent identical reads of the same import version
+    share one call of storage function. With shared result cache
+    answer is calculated once per host.
+    """
+    version = storage.get_version(import_id)
+    key = (function.__name__, import_id, version) + args
+    if storage.result_cache is not None:
+        function = storage.result_cache.wrap(function, version)
+    try:
+        if not app.config['COALESCE_READS']:
+            return function(import_id, *args)
+        try:
+            return single_flight.do(key, function, import_id, *args)
+        except ClientDisconnected:
+            guard = g.get('request_guard')
+            if guard is None or guard.disconnected:
+                raise
+            # Client of shared call is gone, but this one is still here.
+            return single_flight.do(key, function, import_id, *args)
+    except psycopg2.extensions.QueryCanceledError:
+        abort_request('Request is too long, try again later.',
+                      code=503,
+                      headers={'Retry-After':
+                               str(app.config['RETRY_AFTER_SECONDS'])})
+    except ClientDisconnected:
+        # Nobody reads the answer, it's only logged.
+        abort_request('Client is disconnected.', code=499)
 
 
-def abort_request(message, code=400):
+def abort_request(message, code=400, headers=None):
     app.logger.error('Request error (%d): %s', code, message)
 
     response = jsonify(code=code, message=message)
     response.status_code = code
+    if headers is not None:
+        response.headers.extend(headers)
     abort(response)
 
 
+@app.before_request
+def sample_debug_logging():
+    sample_request_debug(app.config['DEBUG_SAMPLE_RATE'])
+
+
+@app.before_request
+def start_profiling():
+    if not app.config['PROFILING']:
+        return
+    if should_profile(request.headers.get(app.config['PROFILE_HEADER']),
+                      app.config['PROFILE_SAMPLE_RATE']):
+        g.profiler = start_profiler(
+            app.config['PROFILE_FORMAT'],
+            app.config['PROFILE_SAMPLING_INTERVAL_SECONDS'])
+
+
+@app.after_request
+def save_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        name = profiles.save(profiler, request.endpoint or 'unknown')
+        app.logger.info('Request profile is saved: %s', name)
+        response.headers['X-Profile-Name'] = name
+    return response
+
+
+@app.before_request
+def guard_request():
+    statement_timeout = STATEMENT_TIMEOUTS_MS.get(request.endpoint)
+    if statement_timeout is None:
+        return
+    g.request_guard = RequestGuard(statement_timeout,
+                                   get_client_socket(request.environ))
+
+
+@app.before_request
+def admit_request():
+    limit = admission_limits.get(request.endpoint)
+    if limit is None:
+        return
+    if not limit.acquire():
+        abort_request('Service is overloaded, try again later.',
+                      code=503,
+                      headers={'Retry-After':
+                               str(app.config['RETRY_AFTER_SECONDS'])})
+    g.admission_limit = limit
+
+
+@app.teardown_request
+def release_request(exception):
+    limit = g.pop('admission_limit', None)
+    if limit is not None:
+        limit.release()
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+
+
 def correct_response(data, code=200):
     json_data = {'data': data}
     return make_response(jsonify(json_data), code)
 
 
+def encoded_response(data_json, code=200):
+    """
+    Response for data, which is already encoded to JSON.
+    """
+    return app.response_class(b'{"data":' + data_json + b'}\n',
+                              status=code,
+                              mimetype='application/json')
+
+
 @app.route('/ping')
 def ping():
     app.logger.debug('Test.')
     return 'pong'
 
 
+@app.route('/admin/admission', methods=['GET'])
+def get_admission_stats():
+    return correct_response({endpoint: limit.get_stats()
+                             for endpoint, limit
+                             in admission_limits.items()})
+
+
+@app.route('/admin/queries', methods=['GET'])
+def get_queries_stats():
+    return correct_response(queries_stats.get())
+
+
+@app.route('/admin/cache', methods=['GET'])
+def get_cache_stats():
+    if storage.result_cache is None:
+        abort_request('Result cache is off.', 404)
+    return correct_response(storage.result_cache.get_stats())
+
+
 @app.route('/imports', methods=['POST'])
 def import_data():
     app.logger.info('Data import.')
@@ -68,8 +289,85 @@ def import_data():
     citizens = data['citizens']
     try:
         check_citizens_group(citizens)
-        import_id_json = save_new_import(citizens)
+        citizens = [Citizen.from_dict(citizen_data)
+                    for citizen_data in citizens]
+        import_id_json = storage.save_import(citizens)
+        return correct_response(import_id_json, code=201)
+    except ValueError as error:
+        abort_request(error.args)
+
+
+@app.route(GET_CITIZENS_URL, methods=['POST'])
+def append_data(import_id):
+    app.logger.info('Data append.')
+    data = request.get_json(force=True)
+    citizens = data['citizens']
+    app.logger.debug('Append %d citizens to import %d.',
+                     len(citizens),
+                     import_id)
+    try:
+        # Relationships are checked by storage against import.
+        check_citizens_list(citizens)
+        citizens = [Citizen.from_dict(citizen_data)
+                    for citizen_data in citizens]
+        import_id_json = storage.append_citizens(import_id, citizens)
+        return correct_response(import_id_json, code=201)
+    except ValueError as error:
+        abort_request(error.args)
+
+
+@app.route(SNAPSHOT_URL, methods=['GET'])
+def export_snapshot(import_id):
+    app.logger.info('Snapshot export.')
+    snapshot = tempfile.TemporaryFile()
+    try:
+        storage.export_snapshot(import_id, snapshot)
+    except NotImplementedError:
+        snapshot.close()
+        abort_request('Storage doesn\'t support snapshots.', code=501)
+    except ValueError as error:
+        snapshot.close()
+        abort_request(error.args)
+    snapshot.seek(0)
+    response = send_file(snapshot, mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = (
+        'attachment; filename=import_{}.snapshot'.format(import_id))
+    return response
+
+
+@app.route(RESTORE_URL, methods=['POST'])
+def restore_snapshot():
+    app.logger.info('Snapshot restore.')
+    try:
+        import_id_json = storage.restore_snapshot(request.stream)
         return correct_response(import_id_json, code=201)
+    except NotImplementedError:
+        abort_request('Storage doesn\'t support snapshots.', code=501)
+    except ValueError as error:
+        abort_request(error.args)
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def get_profiles():
+    return correct_response(profiles.list())
+
+
+@app.route('/admin/profiles/<name>', methods=['GET'])
+def get_profile(name):
+    try:
+        path = profiles.get_path(name)
+    except ValueError as error:
+        abort_request(error.args)
+    return send_file(path, as_attachment=True)
+
+
+@app.route(IMPORT_URL, methods=['DELETE'])
+def delete_data(import_id):
+    app.logger.info('Data delete.')
+    app.logger.debug('Delete import %d.', import_id)
+    try:
+        storage.delete_import(import_id)
+        return correct_response({'import_id': import_id})
     except ValueError as error:
         abort_request(error.args)
 
@@ -77,27 +375,32 @@ def import_data():
 @app.route(PATCH_URL, methods=['PATCH'])
 def patch_data(import_id, citizen_id):
     app.logger.info('Data patch.')
-    app.logger.debug('In import {} patch citizen {}.'
-                     .format(import_id, citizen_id))
+    app.logger.debug('In import %d patch citizen %d.',
+                     import_id, citizen_id)
     citizen_update = request.get_json(force=True)
     try:
         check_update_citizen(citizen_update)
-        citizen_json = update_import(import_id,
-                                     citizen_id,
-                                     citizen_update)
-        return correct_response(citizen_json)
+        citizen = storage.update_citizen(import_id,
+                                         citizen_id,
+                                         citizen_update)
+        return encoded_response(citizen.to_json().encode())
     except ValueError as error:
         abort_request(error.args)
+    except psycopg2.extensions.TransactionRollbackError:
+        # Deadlock, even after retries.
+        abort_request('Citizens are changed concurrently, try again later.',
+                      code=503,
+                      headers={'Retry-After':
+                               str(app.config['RETRY_AFTER_SECONDS'])})
 
 
 @app.route(GET_CITIZENS_URL, methods=['GET'])
 def get_citizens(import_id):
     app.logger.info('Get citizens.')
-    app.logger.debug('Get citizens from  import {}.'
-                     .format(import_id))
+    app.logger.debug('Get citizens from import %d.', import_id)
     try:
-        data = load_import(import_id)
-        return correct_response(data)
+        return encoded_response(read_import(storage.load_import_json,
+                                            import_id))
     except ValueError as error:
         abort_request(error.args)
 
@@ -105,11 +408,10 @@ def get_citizens(import_id):
 @app.route(GET_BIRTHDAYS_URL, methods=['GET'])
 def get_birthdays(import_id):
     app.logger.info('Get birthdays.')
-    app.logger.debug('Get birthdays from  import {}.'
-                     .format(import_id))
+    app.logger.debug('Get birthdays from import %d.', import_id)
     try:
-        birthdays = calculate_birthdays(import_id)
-        return correct_response(birthdays)
+        return encoded_response(read_import(storage.calculate_birthdays_json,
+                                            import_id))
     except ValueError as error:
         abort_request(error.args)
 
@@ -117,10 +419,11 @@ def get_birthdays(import_id):
 @app.route(GET_AGES_URL, methods=['GET'])
 def get_ages(import_id):
     app.logger.info('Get ages.')
-    app.logger.debug('Get ages from  import {}.'
-                     .format(import_id))
+    app.logger.debug('Get ages from import %d.', import_id)
     try:
-        ages = calculate_ages_stat(import_id)
-        return correct_response(ages)
+        mode = request.args.get('mode', app.config['AGES_STAT_MODE'])
+        return encoded_response(read_import(storage.calculate_ages_stat_json,
+                                            import_id,
+                                            mode == 'approximate'))
     except ValueError as error:
         abort_request(error.args)
@@ -9,5 +9,8 @@ setup(
     name="api_tools",
     version="0.1",
     install_requires=requirements,
+    extras_require={
+        "numpy": ["numpy>=1.15"],
+    },
     packages=find_packages(include=["api_tools"]),
 )
@@ -0,0 +1,137 @@
+"""
+Benchmarks settings, test data and results recording.
+
+Run them with:
+    pytest test/benchmark --benchmark
+"""
+import os
+import json
+import time
+import importlib.util
+
+import pytest
+import psycopg2
+
+GENERATOR_PATH = os.path.join(os.path.dirname(__file__),
+                              '..', 'load_testing', 'dataset_generator.py')
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_SIZES = '1000,100000,1000000'
+RESULTS = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('benchmark')
+    group.addoption('--benchmark', action='store_true', default=False,
+                    help='Run benchmarks.')
+    group.addoption('--benchmark-sizes', default=DEFAULT_SIZES,
+                    help='Comma separated numbers of citizens.')
+    group.addoption('--benchmark-rounds', type=int, default=3,
+                    help='How many times to repeat every measurement.')
+    group.addoption('--benchmark-output', default='benchmark_results.json',
+                    help='Where to save results.')
+    group.addoption('--benchmark-baseline', default=BASELINE_PATH,
+                    help='Results to compare with.')
+    group.addoption('--benchmark-tolerance', type=float, default=0.2,
+                    help='Allowed slowdown relative to baseline.')
+    group.addoption('--benchmark-save-baseline', action='store_true',
+                    default=False,
+                    help='Save results as new baseline.')
+    group.addoption('--benchmark-dsn',
+                    default=os.environ.get('BENCHMARK_DSN'),
+                    help='PostgreSQL DSN for cursor-dependent benchmarks.')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'benchmark: performance measurement.')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--benchmark'):
+        return
+    skip_benchmark = pytest.mark.skip(reason='use --benchmark to run')
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
+def pytest_generate_tests(metafunc):
+    if 'size' in metafunc.fixturenames:
+        sizes = [int(size) for size
+                 in metafunc.config.getoption('--benchmark-sizes').split(',')]
+        metafunc.parametrize('size', sizes, scope='session')
+
+
+def load_generator():
+    spec = importlib.util.spec_from_file_location('dataset_generator',
+                                                  GENERATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='session')
+def citizens(size):
+    generator = load_generator()
+    # Mean degree 0.2: size // 10 relationships.
+    return list(generator.DatasetGenerator(citizen_number=size,
+                                           mean_degree=0.2))
+
+
+@pytest.fixture(scope='session')
+def db_cursor(request):
+    dsn = request.config.getoption('--benchmark-dsn')
+    if not dsn:
+        pytest.skip('set --benchmark-dsn or BENCHMARK_DSN')
+    try:
+        conn = psycopg2.connect(dsn)
+    except psycopg2.OperationalError as error:
+        pytest.skip('can\'t connect to DB: {}'.format(error))
+    with conn.cursor() as cur:
+        yield cur
+    conn.close()
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file_object:
+        return json.load(file_object)
+
+
+@pytest.fixture
+def run_benchmark(request):
+    """
+    Measure the best time of function call, save it
+    and compare with baseline.
+    """
+    config = request.config
+    rounds = config.getoption('--benchmark-rounds')
+    baseline = load_baseline(config.getoption('--benchmark-baseline'))
+    tolerance = config.getoption('--benchmark-tolerance')
+
+    def run(name, size, function, *args):
+        timings = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            function(*args)
+            timings.append(time.perf_counter() - start)
+        seconds = min(timings)
+        RESULTS.setdefault(name, {})[str(size)] = seconds
+        base_seconds = baseline.get(name, {}).get(str(size))
+        if base_seconds is not None \
+                and seconds > base_seconds * (1 + tolerance):
+            pytest.fail('{} with {} citizens: {:.4f}s, baseline {:.4f}s.'
+                        .format(name, size, seconds, base_seconds))
+    return run
+
+
+def pytest_sessionfinish(session):
+    if not RESULTS:
+        return
+    config = session.config
+    paths = [config.getoption('--benchmark-output')]
+    if config.getoption('--benchmark-save-baseline'):
+        paths.append(config.getoption('--benchmark-baseline'))
+    for path in paths:
+        with open(path, 'w') as file_object:
+            json.dump(RESULTS, file_object, indent=2, sort_keys=True)
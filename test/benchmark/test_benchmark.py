@@ -0,0 +1,92 @@
+"""
+Benchmarks for api_tools/check_data.py and api_tools/db_tools.py
+"""
+import json
+
+import pytest
+from api_tools.citizen import Citizen, citizens_to_json
+from api_tools.check_data import (
+    str_to_date,
+    check_citizen_fields,
+    check_citizens_group,
+)
+from api_tools.db_tools import (
+    citizen_data_to_string,
+    tuple_to_citizen_data,
+    prepare_update_info_sql,
+)
+from api_tools.sql_queries import FIELD_NAMES
+
+pytestmark = pytest.mark.benchmark
+UPDATE_DATA = {
+    'town': 'town_1',
+    'birth_date': '01.02.1990',
+    'relatives': [1, 2, 3],
+}
+
+
+def check_all_fields(citizens):
+    for citizen in citizens:
+        check_citizen_fields(citizen)
+
+
+def parse_all_dates(citizens):
+    for citizen in citizens:
+        str_to_date(citizen['birth_date'])
+
+
+def convert_all_citizens(citizens, cur):
+    for citizen in citizens:
+        citizen_data_to_string(citizen, cur)
+
+
+def convert_all_tuples(citizen_tuples):
+    for citizen_tuple in citizen_tuples:
+        tuple_to_citizen_data(citizen_tuple)
+
+
+def prepare_all_updates(citizens, cur):
+    for citizen in citizens:
+        prepare_update_info_sql(0, citizen['citizen_id'], UPDATE_DATA, cur)
+
+
+def test_check_citizens_group(size, citizens, run_benchmark):
+    run_benchmark('check_citizens_group', size,
+                  check_citizens_group, citizens)
+
+
+def test_check_citizen_fields(size, citizens, run_benchmark):
+    run_benchmark('check_citizen_fields', size,
+                  check_all_fields, citizens)
+
+
+def test_str_to_date(size, citizens, run_benchmark):
+    run_benchmark('str_to_date', size, parse_all_dates, citizens)
+
+
+def test_citizen_data_to_string(size, citizens, db_cursor, run_benchmark):
+    records = [Citizen.from_dict(citizen) for citizen in citizens]
+    run_benchmark('citizen_data_to_string', size,
+                  convert_all_citizens, records, db_cursor)
+
+
+def test_tuple_to_citizen_data(size, citizens, run_benchmark):
+    citizen_tuples = [tuple(citizen[field] for field in FIELD_NAMES)
+                      for citizen in citizens]
+    run_benchmark('tuple_to_citizen_data', size,
+                  convert_all_tuples, citizen_tuples)
+
+
+def test_prepare_update_info_sql(size, citizens, db_cursor, run_benchmark):
+    run_benchmark('prepare_update_info_sql', size,
+                  prepare_all_updates, citizens, db_cursor)
+
+
+def test_json_serialization(size, citizens, run_benchmark):
+    run_benchmark('json_serialization', size,
+                  json.dumps, {'data': citizens})
+
+
+def test_citizens_to_json(size, citizens, run_benchmark):
+    records = [Citizen.from_dict(citizen) for citizen in citizens]
+    run_benchmark('citizens_to_json', size, citizens_to_json, records)
@@ -4,16 +4,20 @@ Load testing of our service.
 """
 import sys
 import os
-import subprocess
+import math
+import time
 import random
+import asyncio
 import logging
 import json
 import argparse
-from copy import deepcopy
+from collections import Counter
 from datetime import datetime
 from argparse import RawTextHelpFormatter
 
 from api_tools.check_data import DATE_FORMAT
+from dataset_generator import DatasetGenerator, get_towns
+import aiohttp
 import requests
 
 MIN_DATE = '01.01.1920'
@@ -25,26 +29,28 @@ IMPORT_PATH = '/imports'
 GET_CITIZENS_PATH = '/imports/{import_id}/citizens'
 GET_BIRTHDAYS_PATH = '/imports/{import_id}/citizens/birthdays'
 GET_AGES_PATH = '/imports/{import_id}/towns/stat/percentile/age'
+PATCH_PATH = '/imports/{import_id}/citizens/{citizen_id}'
+OPERATIONS = [
+    'get_citizens',
+    'get_birthdays',
+    'get_ages',
+    'patch',
+    'post',
+]
+DEFAULT_WORKLOAD = 'get_citizens=1,get_birthdays=1,get_ages=1'
+PERCENTILES = [50, 90, 99, 99.9]
+# Histogram buckets grow by 1%, so percentiles have 1% precision.
+BUCKET_BASE = 1.01
 
 logger = logging.getLogger(__name__)
 
 
-def get_towns(towns_number=20):
-    return ['town_' + str(i) for i in range(towns_number)]
-
-
 def get_random_birth_date():
-    random_ts = random.randrange(MIN_TS, MAX_TS)
+    random_ts = random.randrange(int(MIN_TS), int(MAX_TS))
     random_dt = datetime.fromtimestamp(random_ts)
     return random_dt.strftime(DATE_FORMAT)
 
 
-def generate_pair(citizen_number):
-    first = random.randrange(citizen_number)
-    second = random.randrange(citizen_number)
-    return first, second
-
-
 def remove_test_file(filename=TEST_JSON):
     try:
         os.remove(filename)
@@ -55,37 +61,261 @@ def remove_test_file(filename=TEST_JSON):
 def create_test_import(citizen_number=10000,
                        pairs_number=1000,
                        towns_number=20):
-    towns = get_towns(towns_number)
-    base_dict = {
-        'name': 'Аркадий',
-        'street': 'Тимура Фрунзе',
-        'building': 'Мамонтов',
-        'apartment': 1,
-        'gender': 'male',
+    generator = DatasetGenerator(
+        citizen_number=citizen_number,
+        towns_number=towns_number,
+        mean_degree=2 * pairs_number / max(citizen_number, 1))
+    return {'citizens': list(generator)}
+
+
+class LatencyHistogram:
+    """
+    Log-scaled latency histogram with constant memory.
+    """
+    def __init__(self):
+        self.buckets = Counter()
+        self.statuses = Counter()
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def add(self, latency, status):
+        self.statuses[str(status)] += 1
+        self.count += 1
+        self.total += latency
+        self.min = latency if self.min is None else min(self.min, latency)
+        self.max = latency if self.max is None else max(self.max, latency)
+        microseconds = max(latency * 1e6, 1.)
+        self.buckets[int(math.log(microseconds, BUCKET_BASE))] += 1
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.statuses.update(other.statuses)
+        self.count += other.count
+        self.total += other.total
+        for latency in [other.min, other.max]:
+            if latency is not None:
+                self.min = (latency if self.min is None
+                            else min(self.min, latency))
+                self.max = (latency if self.max is None
+                            else max(self.max, latency))
+
+    @staticmethod
+    def bucket_ms(index):
+        return BUCKET_BASE ** (index + 1) / 1000
+
+    def percentile(self, percent):
+        """
+        Upper bound of the bucket with given percentile, in ms.
+        """
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(self.bucket_ms(index), self.max * 1000)
+        return None
+
+    def to_dict(self):
+        if self.count == 0:
+            return {'count': 0}
+        errors = sum(number for status, number in self.statuses.items()
+                     if not status.startswith('2'))
+        latency = {
+            'min': self.min * 1000,
+            'mean': self.total / self.count * 1000,
+            'max': self.max * 1000,
+        }
+        for percent in PERCENTILES:
+            latency['p{}'.format(percent)] = self.percentile(percent)
+        # Buckets are 1% apart, so 6 significant digits keep them apart.
+        histogram = {'{:.6g}'.format(self.bucket_ms(index)): number
+                     for index, number in sorted(self.buckets.items())}
+        return {
+            'count': self.count,
+            'errors': errors,
+            'statuses': dict(self.statuses),
+            'latency_ms': latency,
+            'histogram_ms': histogram,
+        }
+
+
+def parse_workload(workload):
+    """
+    'get_ages=2,patch=1' -> {'get_ages': 2., 'patch': 1.}
+    """
+    weights = {}
+    for item in workload.split(','):
+        operation, weight = item.split('=')
+        if operation not in OPERATIONS:
+            raise ValueError('Unknown operation {}, choose from {}.'
+                             .format(operation, OPERATIONS))
+        weights[operation] = float(weight)
+    return weights
+
+
+class RequestFactory:
+    """
+    Choose next operation according to workload weights
+    and prepare its method, url and body.
+    """
+    def __init__(self, address, import_id, weights,
+                 citizen_number, towns, post_data):
+        self.address = address
+        self.import_id = import_id
+        self.operations = list(weights)
+        self.weights = [weights[operation] for operation in self.operations]
+        self.citizen_number = citizen_number
+        self.towns = towns
+        self.post_data = post_data
+
+    def get_url(self, path, **kwargs):
+        return self.address + path.format(import_id=self.import_id,
+                                          **kwargs)
+
+    def next_request(self):
+        operation = random.choices(self.operations, self.weights)[0]
+        if operation == 'get_citizens':
+            return operation, 'GET', self.get_url(GET_CITIZENS_PATH), None
+        if operation == 'get_birthdays':
+            return operation, 'GET', self.get_url(GET_BIRTHDAYS_PATH), None
+        if operation == 'get_ages':
+            return operation, 'GET', self.get_url(GET_AGES_PATH), None
+        if operation == 'patch':
+            citizen_id = random.randrange(self.citizen_number)
+            body = {
+                'town': random.choice(self.towns),
+                'apartment': random.randrange(1, 1000),
+                'birth_date': get_random_birth_date(),
+            }
+            return (operation, 'PATCH',
+                    self.get_url(PATCH_PATH, citizen_id=citizen_id), body)
+        return operation, 'POST', self.address + IMPORT_PATH, self.post_data
+
+
+async def send_request(session, factory, stats, start=None):
+    """
+    Send one request and record its latency. Latency is counted
+    from start (scheduled time in open-loop mode).
+    """
+    loop = asyncio.get_event_loop()
+    if start is None:
+        start = loop.time()
+    operation, method, url, body = factory.next_request()
+    try:
+        async with session.request(method, url, json=body) as response:
+            await response.read()
+            status = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        logger.debug('%s request failed: %s', operation, error)
+        status = type(error).__name__
+    stats[operation].add(loop.time() - start, status)
+
+
+async def run_closed_loop(session, factory, stats,
+                          requests_number, concurrency):
+    """
+    Every worker sends next request after the previous answer.
+    """
+    counter = iter(range(requests_number))
+
+    async def worker():
+        for _ in counter:
+            await send_request(session, factory, stats)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+
+async def run_open_loop(session, factory, stats,
+                        requests_number, rate):
+    """
+    Send requests with constant rate regardless of answers.
+    """
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    tasks = []
+    for request_number in range(requests_number):
+        scheduled = start + request_number / rate
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(
+            send_request(session, factory, stats, start=scheduled)))
+    await asyncio.gather(*tasks)
+
+
+async def run_load(factory, args):
+    stats = {operation: LatencyHistogram() for operation in OPERATIONS}
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        if args.rate:
+            await run_open_loop(session, factory, stats,
+                                args.requests, args.rate)
+        else:
+            await run_closed_loop(session, factory, stats,
+                                  args.requests, args.concurrency)
+    return stats
+
+
+def make_report(stats, duration, args):
+    total = LatencyHistogram()
+    for histogram in stats.values():
+        total.merge(histogram)
+    return {
+        'settings': {
+            'citizens': args.citizens,
+            'pairs': args.pairs,
+            'towns': args.towns,
+            'workload': parse_workload(args.workload),
+            'mode': 'open' if args.rate else 'closed',
+            'rate': args.rate,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+        },
+        'duration_s': duration,
+        'throughput_rps': total.count / duration if duration else None,
+        'total': total.to_dict(),
+        'operations': {operation: histogram.to_dict()
+                       for operation, histogram in stats.items()
+                       if histogram.count > 0},
     }
-    random.seed(42)
-    citizens = []
-    for citizen_id in range(citizen_number):
-        citizen = deepcopy(base_dict)
-        citizen['citizen_id'] = citizen_id
-        citizen['birth_date'] = get_random_birth_date()
-        citizen['town'] = random.choice(towns)
-        citizen['relatives'] = []
-        citizens.append(citizen)
-    for _ in range(pairs_number):
-        pair = generate_pair(citizen_number)
-        if (pair[0] not in citizens[pair[1]]['relatives']
-                and pair[1] not in  citizens[pair[0]]['relatives']):
-                if pair[0] != pair[1]:
-                    citizens[pair[1]]['relatives'].append(pair[0])
-                    citizens[pair[0]]['relatives'].append(pair[1])
-                else:
-                    citizens[pair[1]]['relatives'].append(pair[0])
-    return {'citizens': citizens}
 
 
+def log_report(report):
+    logger.info('%d requests in %.2fs (%.1f rps).',
+                report['total']['count'],
+                report['duration_s'],
+                report['throughput_rps'])
+    for operation, result in sorted(report['operations'].items()):
+        latency = result['latency_ms']
+        logger.info('%s: %d requests, %d errors, '
+                    'p50=%.1fms p90=%.1fms p99=%.1fms p99.9=%.1fms',
+                    operation, result['count'], result['errors'],
+                    latency['p50'], latency['p90'],
+                    latency['p99'], latency['p99.9'])
+
+
+def compare_reports(report, previous_report):
+    """
+    Log latency percentiles changes between two runs.
+    """
+    for operation, result in sorted(report['operations'].items()):
+        previous = previous_report['operations'].get(operation)
+        if previous is None or previous['count'] == 0:
+            continue
+        changes = []
+        for percent in PERCENTILES:
+            key = 'p{}'.format(percent)
+            old = previous['latency_ms'][key]
+            new = result['latency_ms'][key]
+            changes.append('{}: {:.1f} -> {:.1f}ms ({:+.1f}%)'
+                           .format(key, old, new, (new - old) / old * 100))
+        logger.info('%s %s', operation, ', '.join(changes))
+
 
 def main():
+
     argparser = argparse.ArgumentParser(description=__doc__,
                                         formatter_class=RawTextHelpFormatter)
     argparser.add_argument(
@@ -128,7 +358,8 @@ def main():
         "--concurrency",
         type=int,
         default=100,
-        help='Number of concurrency requests at one moment.'
+        help='Number of concurrency requests at one moment '
+             '(connections limit in open-loop mode).'
     )
     argparser.add_argument(
         "-r",
@@ -144,6 +375,40 @@ def main():
         required=True,
         help='Address to test.'
     )
+    argparser.add_argument(
+        "-w",
+        "--workload",
+        type=str,
+        default=DEFAULT_WORKLOAD,
+        help='Operations weights, e.g. \'get_ages=2,patch=1,post=0.1\'.\n'
+             'Operations: {}.'.format(', '.join(OPERATIONS))
+    )
+    argparser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help='Requests per second for open-loop mode.\n'
+             'Without it every of CONCURRENCY workers waits for answer.'
+    )
+    argparser.add_argument(
+        "--post-citizens",
+        type=int,
+        default=10,
+        help='Number of citizens in imports for \'post\' operation.'
+    )
+    argparser.add_argument(
+        "-o",
+        "--report",
+        type=str,
+        default=None,
+        help='Where to save JSON report.'
+    )
+    argparser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help='Previous JSON report to compare with.'
+    )
 
     args = argparser.parse_args()
     logging.basicConfig(
@@ -167,46 +432,41 @@ def main():
     logger.info('Test data is successfully imported with id={}.'
                 .format(import_id))
 
-    logger.info('Test getting full table from DB.')
-    get_full_url = (args.address
-                    + GET_CITIZENS_PATH.format(import_id=import_id))
-    subprocess.call(["ab",
-                    '-c',
-                     str(args.concurrency),
-                     '-n',
-                     str(args.requests),
-                     get_full_url
-                     ])
-
-    logger.info('Test getting birthdays from DB.')
-    get_birthdays_url = (args.address
-                     + GET_BIRTHDAYS_PATH.format(import_id=import_id))
-    subprocess.call(["ab",
-                    '-c',
-                     str(args.concurrency),
-                     '-n',
-                     str(args.requests),
-                     get_birthdays_url
-                     ])
-
-    logger.info('Test getting ages from DB.')
-    get_ages_url = (args.address
-                     + GET_AGES_PATH.format(import_id=import_id))
-    subprocess.call(["ab",
-                    '-c',
-                     str(args.concurrency),
-                     '-n',
-                     str(args.requests),
-                     get_ages_url
-                     ])
+    factory = RequestFactory(
+        address=args.address,
+        import_id=import_id,
+        weights=parse_workload(args.workload),
+        citizen_number=args.citizens,
+        towns=get_towns(args.towns),
+        post_data=create_test_import(
+            citizen_number=args.post_citizens,
+            pairs_number=args.post_citizens // 10,
+            towns_number=args.towns,
+        ),
+    )
+    logger.info('Start load testing with workload %s.', args.workload)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    start = time.perf_counter()
+    stats = loop.run_until_complete(run_load(factory, args))
+    duration = time.perf_counter() - start
+    loop.close()
 
+    report = make_report(stats, duration, args)
+    log_report(report)
+    if args.compare:
+        with open(args.compare, 'r') as file_object:
+            compare_reports(report, json.load(file_object))
+    if args.report:
+        with open(args.report, 'w') as file_object:
+            json.dump(report, file_object, indent=2, sort_keys=True)
+        logger.info('Report is saved to %s.', args.report)
+    return 0
 
 
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except Exception as err:
         logger.critical(err, exc_info=True)
         sys.exit(1)
-
-
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Generator of synthetic imports.
+
+Citizens are written one by one as JSON ({"citizens": [...]}) or NDJSON
+(citizen per line), so memory doesn't depend on import size.
+Relatives of citizen are chosen among the next WINDOW citizens, and
+back-links wait in memory until their citizen is written, so relationships
+are symmetric and only about WINDOW * MEAN_DEGREE links are kept.
+The same seed and options give the same file.
+"""
+import sys
+import json
+import math
+import random
+import logging
+import argparse
+from bisect import bisect
+from itertools import accumulate
+from datetime import date
+from argparse import RawTextHelpFormatter
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ['json', 'ndjson']
+DEGREE_DISTRIBUTIONS = ['poisson', 'pareto']
+BIRTH_DATE_DISTRIBUTIONS = ['uniform', 'normal']
+MIN_BIRTH_DATE = date(1920, 1, 1)
+MAX_BIRTH_DATE = date(2019, 1, 1)
+DAYS_IN_YEAR = 365.2425
+FIRST_NAMES = [
+    'Александр', 'Мария', 'Сергей', 'Анна', 'Дмитрий', 'Елена', 'Андрей',
+    'Ольга', 'Алексей', 'Татьяна', 'Иван', 'Наталья', 'Михаил', 'Ирина',
+    'Николай', 'Екатерина',
+]
+LAST_NAMES = [
+    'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Петров',
+    'Соколов', 'Михайлов', 'Новиков', 'Фёдоров', 'Морозов', 'Волков',
+    'Алексеев', 'Лебедев', 'Семёнов', 'Егоров',
+]
+STREET_NAMES = [
+    'Ленина', 'Мира', 'Садовая', 'Школьная', 'Лесная', 'Советская',
+    'Молодёжная', 'Центральная', 'Новая', 'Набережная',
+]
+
+
+def get_towns(towns_number=20):
+    return ['town_' + str(i) for i in range(towns_number)]
+
+
+def get_names(names_number):
+    """
+    Names are 'Last First', numbered, when combinations are over.
+    """
+    names = []
+    for number in range(names_number):
+        name = '{} {}'.format(LAST_NAMES[number % len(LAST_NAMES)],
+                              FIRST_NAMES[number // len(LAST_NAMES)
+                                          % len(FIRST_NAMES)])
+        cycle = number // (len(LAST_NAMES) * len(FIRST_NAMES))
+        if cycle:
+            name += ' ' + str(cycle + 1)
+        names.append(name)
+    return names
+
+
+def get_streets(streets_number):
+    return ['улица {} {}'.format(STREET_NAMES[number % len(STREET_NAMES)],
+                                 number // len(STREET_NAMES) + 1)
+            for number in range(streets_number)]
+
+
+def zipf_cum_weights(number, skew):
+    """
+    Cumulative weights of Zipf distribution: weight of k-th value
+    is 1 / (k + 1) ** skew. 0 skew is uniform distribution.
+    """
+    return list(accumulate(1 / (rank + 1) ** skew
+                           for rank in range(number)))
+
+
+class DatasetGenerator:
+    """
+    Seeded stream of citizens records.
+    mean_degree is mean number of relatives, degree_distribution is
+    distribution of number of links to the next citizens:
+    'poisson' or 'pareto' (heavy tail with degree_alpha exponent).
+    Towns sizes follow Zipf distribution with town_skew exponent.
+    Birth dates are 'uniform' or 'normal' by age (mean_age, age_std).
+    """
+    def __init__(self,
+                 citizen_number=10000,
+                 seed=42,
+                 towns_number=20,
+                 town_skew=0.0,
+                 names_number=1000,
+                 streets_number=100,
+                 mean_degree=0.2,
+                 degree_distribution='poisson',
+                 degree_alpha=2.5,
+                 window=1000,
+                 birth_date_distribution='uniform',
+                 mean_age=40.0,
+                 age_std=20.0):
+        if degree_distribution not in DEGREE_DISTRIBUTIONS:
+            raise ValueError('Unknown degree distribution {}'
+                             .format(degree_distribution))
+        # Mean of pareto distribution is finite only with alpha > 1.
+        if degree_distribution == 'pareto' and degree_alpha <= 1:
+            raise ValueError('Degree alpha {} of pareto distribution '
+                             'should be greater than 1'.format(degree_alpha))
+        if birth_date_distribution not in BIRTH_DATE_DISTRIBUTIONS:
+            raise ValueError('Unknown birth date distribution {}'
+                             .format(birth_date_distribution))
+        self.citizen_number = citizen_number
+        self.seed = seed
+        self.towns = get_towns(towns_number)
+        self.towns_cum_weights = zipf_cum_weights(towns_number, town_skew)
+        self.names = get_names(names_number)
+        self.streets = get_streets(streets_number)
+        # Every link is counted by both citizens.
+        self.mean_links = mean_degree / 2
+        self.degree_distribution = degree_distribution
+        self.degree_alpha = degree_alpha
+        self.window = window
+        self.birth_date_distribution = birth_date_distribution
+        self.mean_age = mean_age
+        self.age_std = age_std
+        self.min_ordinal = MIN_BIRTH_DATE.toordinal()
+        self.max_ordinal = MAX_BIRTH_DATE.toordinal() - 1
+
+    def get_links_number(self, random_generator):
+        """
+        Number of links to the next citizens with mean self.mean_links.
+        """
+        if self.mean_links <= 0:
+            return 0
+        if self.degree_distribution == 'pareto':
+            # Lomax distribution with mean self.mean_links,
+            # rounded randomly to keep mean.
+            value = ((random_generator.paretovariate(self.degree_alpha) - 1)
+                     * self.mean_links * (self.degree_alpha - 1))
+            links_number = int(value)
+            if random_generator.random() < value - links_number:
+                links_number += 1
+            return links_number
+        # Poisson distribution by Knuth.
+        limit = math.exp(-self.mean_links)
+        links_number = 0
+        product = random_generator.random()
+        while product > limit:
+            links_number += 1
+            product *= random_generator.random()
+        return links_number
+
+    def get_birth_date(self, random_generator):
+        if self.birth_date_distribution == 'normal':
+            age = random_generator.gauss(self.mean_age, self.age_std)
+            ordinal = int(self.max_ordinal - age * DAYS_IN_YEAR)
+            ordinal = max(self.min_ordinal, min(self.max_ordinal, ordinal))
+        else:
+            ordinal = random_generator.randint(self.min_ordinal,
+                                               self.max_ordinal)
+        return date.fromordinal(ordinal).strftime('%d.%m.%Y')
+
+    def __iter__(self):
+        """
+        Citizens records in order of ids from 0.
+        """
+        random_generator = random.Random(self.seed)
+        # Back-links to citizens, which aren't written yet.
+        back_links = {}
+        for citizen_id in range(self.citizen_number):
+            relatives = back_links.pop(citizen_id, [])
+            last_id = min(citizen_id + self.window, self.citizen_number - 1)
+            links_number = min(self.get_links_number(random_generator),
+                               last_id - citizen_id)
+            if links_number:
+                for relative_id in random_generator.sample(
+                        range(citizen_id + 1, last_id + 1), links_number):
+                    relatives.append(relative_id)
+                    back_links.setdefault(relative_id, []).append(citizen_id)
+            town_index = bisect(
+                self.towns_cum_weights,
+                random_generator.random() * self.towns_cum_weights[-1])
+            yield {
+                'citizen_id': citizen_id,
+                'town': self.towns[min(town_index, len(self.towns) - 1)],
+                'street': random_generator.choice(self.streets),
+                'building': str(random_generator.randint(1, 200)),
+                'apartment': random_generator.randint(1, 500),
+                'name': random_generator.choice(self.names),
+                'birth_date': self.get_birth_date(random_generator),
+                'gender': random_generator.choice(['male', 'female']),
+                'relatives': relatives,
+            }
+
+
+def write_dataset(citizens, file_object, output_format='json'):
+    """
+    Write citizens to text file one by one, return their number.
+    """
+    if output_format not in FORMATS:
+        raise ValueError('Unknown format {}'.format(output_format))
+    number = 0
+    if output_format == 'json':
+        file_object.write('{"citizens": [')
+    for citizen in citizens:
+        if output_format == 'json':
+            if number:
+                file_object.write(',')
+            file_object.write('\n')
+        file_object.write(json.dumps(citizen, ensure_ascii=False))
+        if output_format == 'ndjson':
+            file_object.write('\n')
+        number += 1
+    if output_format == 'json':
+        file_object.write('\n]}\n')
+    return number
+
+
+def main():
+
+    argparser = argparse.ArgumentParser(description=__doc__,
+                                        formatter_class=RawTextHelpFormatter)
+    argparser.add_argument(
+        "-n",
+        "--citizens",
+        type=int,
+        default=10000,
+        help='Number of citizens.'
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default='-',
+        help='Output file, \'-\' is stdout.'
+    )
+    argparser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default='json',
+        choices=FORMATS,
+        help='{"citizens": [...]} or one citizen per line.'
+    )
+    argparser.add_argument(
+        "-s",
+        "--seed",
+        type=int,
+        default=42
+    )
+    argparser.add_argument(
+        "-t",
+        "--towns",
+        type=int,
+        default=20
+    )
+    argparser.add_argument(
+        "--town-skew",
+        type=float,
+        default=0.0,
+        help='Zipf exponent of towns sizes, 0 is equal towns.'
+    )
+    argparser.add_argument(
+        "--names",
+        type=int,
+        default=1000,
+        help='Number of different names.'
+    )
+    argparser.add_argument(
+        "--streets",
+        type=int,
+        default=100,
+        help='Number of different streets.'
+    )
+    argparser.add_argument(
+        "--mean-degree",
+        type=float,
+        default=0.2,
+        help='Mean number of relatives.'
+    )
+    argparser.add_argument(
+        "--degree-distribution",
+        type=str,
+        default='poisson',
+        choices=DEGREE_DISTRIBUTIONS
+    )
+    argparser.add_argument(
+        "--degree-alpha",
+        type=float,
+        default=2.5,
+        help='Tail exponent of \'pareto\' degree distribution (> 1).'
+    )
+    argparser.add_argument(
+        "--window",
+        type=int,
+        default=1000,
+        help='Relatives are chosen among so many next citizens.'
+    )
+    argparser.add_argument(
+        "--birth-dates",
+        type=str,
+        default='uniform',
+        choices=BIRTH_DATE_DISTRIBUTIONS,
+        help='Uniform between {} and {} or normal by age.'
+             .format(MIN_BIRTH_DATE, MAX_BIRTH_DATE)
+    )
+    argparser.add_argument(
+        "--mean-age",
+        type=float,
+        default=40.0
+    )
+    argparser.add_argument(
+        "--age-std",
+        type=float,
+        default=20.0
+    )
+
+    args = argparser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s:%(module)s %(message)s')
+
+    generator = DatasetGenerator(
+        citizen_number=args.citizens,
+        seed=args.seed,
+        towns_number=args.towns,
+        town_skew=args.town_skew,
+        names_number=args.names,
+        streets_number=args.streets,
+        mean_degree=args.mean_degree,
+        degree_distribution=args.degree_distribution,
+        degree_alpha=args.degree_alpha,
+        window=args.window,
+        birth_date_distribution=args.birth_dates,
+        mean_age=args.mean_age,
+        age_std=args.age_std,
+    )
+    if args.output == '-':
+        number = write_dataset(generator, sys.stdout, args.format)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as file_object:
+            number = write_dataset(generator, file_object, args.format)
+    logger.info('%d citizens are written.', number)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""
+Tests for api_tools/admission.py and its use at service/run.py
+"""
+import os
+import sys
+import time
+import threading
+
+from api_tools.admission import AdmissionLimit
+from api_tools.memory_engine import MemoryEngine
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                '..', '..', 'service'))
+import run  # noqa: E402
+
+
+def test_admission_limit():
+    limit = AdmissionLimit(2, queue_size=1, timeout=5)
+    assert limit.acquire() and limit.acquire()
+    results = []
+    waiting = threading.Thread(target=lambda: results.append(limit.acquire()))
+    waiting.start()
+    while limit.get_stats()['waiting'] == 0:
+        time.sleep(0.001)
+    # Queue is full.
+    assert not limit.acquire()
+    limit.release()
+    waiting.join()
+    assert results == [True]
+    stats = limit.get_stats()
+    assert (stats['running'], stats['waiting'], stats['max_waiting']) \
+        == (2, 0, 1)
+    assert (stats['admitted'], stats['rejected']) == (3, 1)
+
+
+def test_admission_timeout():
+    limit = AdmissionLimit(1, queue_size=1, timeout=0.01)
+    assert limit.acquire()
+    assert not limit.acquire()
+    assert limit.get_stats()['timed_out'] == 1
+    limit.release()
+    assert limit.acquire()
+
+
+def test_overloaded_route(monkeypatch):
+    monkeypatch.setattr(run, 'storage', MemoryEngine())
+    limit = AdmissionLimit(1)
+    monkeypatch.setattr(run, 'admission_limits', {'get_birthdays': limit})
+    client = run.app.test_client()
+    assert limit.acquire()
+    response = client.get('/imports/0/citizens/birthdays')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == \
+        str(run.app.config['RETRY_AFTER_SECONDS'])
+    assert client.get('/ping').status_code == 200
+    limit.release()
+    # Unknown import, but request is admitted and released.
+    assert client.get('/imports/0/citizens/birthdays').status_code == 400
+    stats = client.get('/admin/admission').get_json()['data']
+    assert stats['get_birthdays']['running'] == 0
+    assert stats['get_birthdays']['rejected'] == 1
@@ -0,0 +1,99 @@
+"""
+Tests for api_tools/age_sketch.py
+"""
+import random
+from datetime import date
+
+import pytest
+from api_tools.age_sketch import (
+    BirthDateSketch,
+    TownsAgeSketch,
+    ImportsAgeSketches,
+)
+from api_tools.stat_tools import get_age, percentile_cont
+
+TODAY = date(2019, 8, 20)
+FRACTIONS = [0.5, 0.75, 0.99]
+# Resolution in days and allowed error in years.
+RESOLUTION_TEST = [
+    (1, 0),
+    (30, 1),
+    (365, 2),
+]
+
+
+def create_birth_dates(number=1000, seed=42):
+    random.seed(seed)
+    return [random.randrange(date(1920, 1, 1).toordinal(),
+                             TODAY.toordinal())
+            for _ in range(number)]
+
+
+def exact_percentiles(ordinals):
+    ages = sorted(get_age(date.fromordinal(ordinal), TODAY)
+                  for ordinal in ordinals)
+    return [percentile_cont(ages, fraction) for fraction in FRACTIONS]
+
+
+@pytest.mark.parametrize('resolution,max_error', RESOLUTION_TEST)
+def test_sketch_error(resolution, max_error):
+    ordinals = create_birth_dates()
+    sketch = BirthDateSketch(resolution)
+    for ordinal in ordinals:
+        sketch.add(ordinal)
+    for approximate, exact in zip(sketch.percentiles(FRACTIONS, TODAY),
+                                  exact_percentiles(ordinals)):
+        assert abs(approximate - exact) <= max_error
+
+
+@pytest.mark.parametrize('number', [1, 2, 3, 101])
+def test_small_sketch(number):
+    ordinals = create_birth_dates(number)
+    sketch = BirthDateSketch(1)
+    for ordinal in ordinals:
+        sketch.add(ordinal)
+    assert sketch.percentiles(FRACTIONS, TODAY) == exact_percentiles(ordinals)
+
+
+def test_sketch_remove_and_merge():
+    ordinals = create_birth_dates()
+    first, second = BirthDateSketch(1), BirthDateSketch(1)
+    for ordinal in ordinals[:500]:
+        first.add(ordinal)
+    for ordinal in ordinals[500:]:
+        second.add(ordinal)
+    for ordinal in ordinals[:100]:
+        second.add(ordinal)
+        second.remove(ordinal)
+    first.merge(second)
+    assert first.count == len(ordinals)
+    assert first.percentiles(FRACTIONS, TODAY) == exact_percentiles(ordinals)
+
+
+def test_towns_sketch():
+    ordinals = create_birth_dates()
+    towns_sketch = TownsAgeSketch(1)
+    for number, ordinal in enumerate(ordinals):
+        towns_sketch.add('town_{}'.format(number % 3), ordinal)
+    # Move citizen to new town.
+    towns_sketch.remove('town_0', ordinals[0])
+    towns_sketch.add('town_3', ordinals[0])
+    towns_sketch.remove('town_3', ordinals[0])
+    assert sorted(towns_sketch.towns) == ['town_0', 'town_1', 'town_2']
+    percentiles = towns_sketch.percentiles(FRACTIONS, TODAY)
+    assert percentiles['town_0'] == exact_percentiles(ordinals[3::3])
+    assert percentiles['town_1'] == exact_percentiles(ordinals[1::3])
+
+
+def test_sketch_versions():
+    ordinals = create_birth_dates(10)
+    sketches = ImportsAgeSketches(1)
+    sketches.create(1, [('town', ordinal) for ordinal in ordinals], 0)
+    sketches.update(1, 1, changes=[(('town', ordinals[0]),
+                                    ('town', ordinals[1]))])
+    assert sketches.percentiles(1, FRACTIONS, TODAY, 0) is None
+    assert sketches.percentiles(1, FRACTIONS, TODAY, 1) \
+        == {'town': exact_percentiles(ordinals[1:2] + ordinals[1:])}
+    # Version 2 is made by other process, sketch misses its change.
+    sketches.update(1, 3, added=[('town', ordinals[0])])
+    assert not sketches.has(1)
@@ -0,0 +1,603 @@
+"""
+Tests for service/run.py routes with every storage engine.
+"""
+import os
+import sys
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+import psycopg2
+import psycopg2.extensions
+
+from api_tools import db_tools, numpy_analytics
+from api_tools.db_tools import DB_CREDENTIALS, PostgresEngine
+from api_tools.memory_engine import MemoryEngine
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                '..', '..', 'service'))
+import run  # noqa: E402
+
+DATA_PATH = 'test/test_data/import_data.json'
+PATCH_DATA_PATH = 'test/test_data/patch_data.json'
+
+
+def load_data(data_path=DATA_PATH):
+    with open(data_path, 'r') as file_object:
+        return json.load(file_object)
+
+
+def is_postgres_available():
+    try:
+        psycopg2.connect(connect_timeout=1, **DB_CREDENTIALS).close()
+    except psycopg2.OperationalError:
+        return False
+    return True
+
+
+@pytest.fixture(params=['memory', 'postgres'])
+def client(request, monkeypatch):
+    if request.param == 'postgres':
+        if not is_postgres_available():
+            pytest.skip('PostgreSQL is not available.')
+        storage = PostgresEngine()
+    else:
+        storage = MemoryEngine()
+    monkeypatch.setattr(run, 'storage', storage)
+    return run.app.test_client()
+
+
+def post_import(client, citizens):
+    response = client.post('/imports', json={'citizens': citizens})
+    assert response.status_code == 201
+    return response.get_json()['data']['import_id']
+
+
+def get_data(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.get_json()['data']
+
+
+def get_citizens(client, import_id):
+    citizens = get_data(client, '/imports/{}/citizens'.format(import_id))
+    return sorted(citizens, key=lambda citizen: citizen['citizen_id'])
+
+
+def get_age(birth_date_string):
+    today = datetime.now(timezone.utc).date()
+    birth_date = datetime.strptime(birth_date_string, '%d.%m.%Y').date()
+    age = today.year - birth_date.year
+    if (today.month, today.day) < (birth_date.month, birth_date.day):
+        age -= 1
+    return age
+
+
+def test_import_and_load(client):
+    citizens = load_data()
+    import_id = post_import(client, citizens)
+    assert isinstance(import_id, int)
+    assert get_citizens(client, import_id) == citizens
+
+
+def test_incorrect_import(client):
+    citizens = load_data()
+    citizens[0]['relatives'] = []
+    response = client.post('/imports', json={'citizens': citizens})
+    assert response.status_code == 400
+
+
+def test_patch(client):
+    import_id = post_import(client, load_data())
+    patch_data = load_data(PATCH_DATA_PATH)
+    response = client.patch('/imports/{}/citizens/3'.format(import_id),
+                            json=patch_data)
+    assert response.status_code == 200
+    citizen = response.get_json()['data']
+    for field, value in patch_data.items():
+        assert citizen[field] == value
+
+    citizens = get_citizens(client, import_id)
+    assert sorted(citizens[0]['relatives']) == [2, 3]
+    assert citizens[2]['relatives'] == [1]
+
+    response = client.patch('/imports/{}/citizens/3'.format(import_id),
+                            json={'relatives': [2]})
+    assert response.status_code == 200
+    citizens = get_citizens(client, import_id)
+    assert citizens[0]['relatives'] == [2]
+    assert sorted(citizens[1]['relatives']) == [1, 3]
+    assert citizens[2]['relatives'] == [2]
+
+
+@pytest.mark.parametrize('url,data', [
+    ('/imports/{import_id}/citizens/100', {'name': 'Test'}),
+    ('/imports/{import_id}/citizens/1', {'relatives': [100]}),
+    ('/imports/{import_id}/citizens/1', {'citizen_id': 2}),
+    ('/imports/100500/citizens/1', {'name': 'Test'}),
+])
+def test_incorrect_patch(client, url, data):
+    import_id = post_import(client, load_data())
+    response = client.patch(url.format(import_id=import_id), json=data)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('path', [
+    'citizens',
+    'citizens/birthdays',
+    'towns/stat/percentile/age',
+])
+def test_unknown_import(client, path):
+    response = client.get('/imports/100500/{}'.format(path))
+    assert response.status_code == 400
+
+
+def test_birthdays(client):
+    import_id = post_import(client, load_data())
+    birthdays = get_data(client,
+                         '/imports/{}/citizens/birthdays'.format(import_id))
+    assert birthdays == {
+        '4': [{'citizen_id': 1, 'presents': 1}],
+        '12': [{'citizen_id': 2, 'presents': 1}],
+    }
+
+
+def test_ages_stat(client):
+    citizens = load_data()
+    import_id = post_import(client, citizens)
+    ages_stat = get_data(
+        client, '/imports/{}/towns/stat/percentile/age'.format(import_id))
+    first, second = sorted([get_age(citizens[0]['birth_date']),
+                            get_age(citizens[1]['birth_date'])])
+    third = get_age(citizens[2]['birth_date'])
+    assert sorted(ages_stat, key=lambda town: town['town']) == [
+        {'town': 'Керчь', 'p50': third, 'p75': third, 'p99': third},
+        {
+            'town': 'Москва',
+            'p50': round(first + 0.5 * (second - first), 2),
+            'p75': round(first + 0.75 * (second - first), 2),
+            'p99': round(first + 0.99 * (second - first), 2),
+        },
+    ]
+
+
+def create_random_citizens(citizen_number=300, pairs_number=300):
+    random.seed(42)
+    citizens = []
+    for citizen_id in range(citizen_number):
+        birth_date = datetime.fromordinal(
+            random.randrange(700000, 737000)).strftime('%d.%m.%Y')
+        citizens.append({
+            'citizen_id': citizen_id,
+            'town': 'town_{}'.format(random.randrange(7)),
+            'street': 'street',
+            'building': '1',
+            'apartment': random.randrange(1, 100),
+            'name': 'name_{}'.format(citizen_id),
+            'birth_date': birth_date,
+            'gender': random.choice(['male', 'female']),
+            'relatives': [],
+        })
+    for _ in range(pairs_number):
+        first = random.randrange(citizen_number)
+        second = random.randrange(citizen_number)
+        if second in citizens[first]['relatives']:
+            continue
+        citizens[first]['relatives'].append(second)
+        if first != second:
+            citizens[second]['relatives'].append(first)
+    return citizens
+
+
+def collect_results(client):
+    """
+    Import random data, patch it and load all the stats.
+    """
+    patches = [
+        (5, {'relatives': [1, 2, 3], 'town': 'town_1'}),
+        (1, {'birth_date': '29.02.2000', 'relatives': []}),
+        (7, {'relatives': [7, 8]}),
+    ]
+    import_id = post_import(client, create_random_citizens())
+    for citizen_id, patch_data in patches:
+        response = client.patch(
+            '/imports/{}/citizens/{}'.format(import_id, citizen_id),
+            json=patch_data)
+        assert response.status_code == 200
+    citizens_data = get_citizens(client, import_id)
+    for citizen in citizens_data:
+        citizen['relatives'].sort()
+    birthdays = get_data(
+        client, '/imports/{}/citizens/birthdays'.format(import_id))
+    ages_stat = get_data(
+        client, '/imports/{}/towns/stat/percentile/age'.format(import_id))
+    ages_stat.sort(key=lambda town: town['town'])
+    return citizens_data, birthdays, ages_stat
+
+
+def test_engines_agree(monkeypatch):
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    results = []
+    for storage in [MemoryEngine(), PostgresEngine()]:
+        monkeypatch.setattr(run, 'storage', storage)
+        results.append(collect_results(run.app.test_client()))
+    assert results[0] == results[1]
+
+
+def test_numpy_analytics_agree(monkeypatch):
+    if not numpy_analytics.is_available():
+        pytest.skip('NumPy is not installed.')
+    monkeypatch.setattr(run, 'storage', MemoryEngine())
+    results = []
+    for analytics_engine in ['python', 'numpy']:
+        monkeypatch.setitem(run.app.config, 'ANALYTICS_ENGINE',
+                            analytics_engine)
+        results.append(collect_results(run.app.test_client()))
+    if is_postgres_available():
+        monkeypatch.setattr(run, 'storage', PostgresEngine())
+        results.append(collect_results(run.app.test_client()))
+    for result in results[1:]:
+        assert result == results[0]
+
+
+@pytest.mark.parametrize('storage_class', [MemoryEngine, PostgresEngine])
+def test_approximate_ages_stat(storage_class, monkeypatch):
+    if storage_class is PostgresEngine and not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    monkeypatch.setattr(run, 'storage',
+                        storage_class(age_sketch_resolution=1))
+    client = run.app.test_client()
+    import_id = post_import(client, create_random_citizens())
+    response = client.patch('/imports/{}/citizens/1'.format(import_id),
+                            json={'town': 'town_100',
+                                  'birth_date': '01.01.1950'})
+    assert response.status_code == 200
+
+    url = '/imports/{}/towns/stat/percentile/age'.format(import_id)
+    exact = get_data(client, url + '?mode=exact')
+    approximate = get_data(client, url + '?mode=approximate')
+    assert approximate == sorted(exact, key=lambda town: town['town'])
+
+
+def test_age_sketches_need_shared_versions():
+    config = {'STORAGE_ENGINE': 'postgres', 'AGE_SKETCH_RESOLUTION_DAYS': 1,
+              'RESULT_CACHE_DIR': ''}
+    with pytest.raises(ValueError):
+        run.check_age_sketches(config)
+    run.check_age_sketches(dict(config, RESULT_CACHE_DIR='/dev/shm/cache'))
+    run.check_age_sketches(dict(config, STORAGE_ENGINE='memory'))
+    run.check_age_sketches(dict(config, AGE_SKETCH_RESOLUTION_DAYS=0))
+
+
+def test_age_sketch_of_changing_import(monkeypatch):
+    """
+    Sketch isn't built from table, which is changed meanwhile.
+    """
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    storage = PostgresEngine(age_sketch_resolution=1)
+    monkeypatch.setattr(run, 'storage', storage)
+    client = run.app.test_client()
+    import_id = post_import(client, create_random_citizens())
+    storage.age_sketches.drop(import_id)
+    with run.app.app_context(), storage.changing(import_id):
+        assert storage.get_age_percentiles(import_id) is None
+    load_towns_birth_dates = db_tools.load_towns_birth_dates
+
+    def load_and_patch(import_id):
+        towns_birth_dates = load_towns_birth_dates(import_id)
+        response = client.patch('/imports/{}/citizens/1'.format(import_id),
+                                json={'birth_date': '01.01.1950'})
+        assert response.status_code == 200
+        return towns_birth_dates
+
+    monkeypatch.setattr(db_tools, 'load_towns_birth_dates', load_and_patch)
+    with run.app.app_context():
+        assert storage.get_age_percentiles(import_id) is None
+    assert not storage.age_sketches.has(import_id)
+    monkeypatch.setattr(db_tools, 'load_towns_birth_dates',
+                        load_towns_birth_dates)
+    url = '/imports/{}/towns/stat/percentile/age'.format(import_id)
+    exact = get_data(client, url + '?mode=exact')
+    approximate = get_data(client, url + '?mode=approximate')
+    assert approximate == sorted(exact, key=lambda town: town['town'])
+    assert storage.age_sketches.has(import_id)
+
+
+def test_relatives_graph_loading(monkeypatch):
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    client = run.app.test_client()
+    monkeypatch.setattr(run, 'storage', PostgresEngine())
+    import_id = post_import(client, load_data())
+    # New engine has no graph, like after restart.
+    monkeypatch.setattr(run, 'storage', PostgresEngine())
+    response = client.patch('/imports/{}/citizens/3'.format(import_id),
+                            json={'relatives': [2]})
+    assert response.status_code == 200
+    response = client.patch('/imports/{}/citizens/3'.format(import_id),
+                            json={'relatives': [100]})
+    assert response.status_code == 400
+    citizens = get_citizens(client, import_id)
+    assert [citizen['relatives'] for citizen in citizens] == [[2], [1, 3], [2]]
+    assert run.storage.get_relatives_graph(import_id).relatives(2) == [1, 3]
+
+
+def test_outdated_relatives_graph(monkeypatch):
+    """
+    Graph of worker is outdated by appends and deletion at other worker.
+    """
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    client = run.app.test_client()
+    workers = [PostgresEngine(), PostgresEngine()]
+    citizens = load_data()
+    monkeypatch.setattr(run, 'storage', workers[0])
+    import_id = post_import(client, citizens)
+    citizens_url = '/imports/{}/citizens'.format(import_id)
+
+    def append(worker, citizen_id, relatives):
+        monkeypatch.setattr(run, 'storage', worker)
+        response = client.post(citizens_url, json={'citizens': [
+            dict(citizens[0], citizen_id=citizen_id, relatives=relatives)]})
+        assert response.status_code == 201
+
+    def patch(worker, citizen_id, citizen_update):
+        monkeypatch.setattr(run, 'storage', worker)
+        return client.patch('{}/{}'.format(citizens_url, citizen_id),
+                            json=citizen_update)
+
+    append(workers[1], 4, [1])
+    assert patch(workers[0], 4, {'name': 'Test'}).status_code == 200
+    assert patch(workers[0], 3, {'relatives': [2, 4]}).status_code == 200
+    append(workers[1], 5, [])
+    append(workers[0], 6, [5])
+    relatives = {citizen['citizen_id']: citizen['relatives']
+                 for citizen in get_citizens(client, import_id)}
+    assert relatives == {1: [2, 4], 2: [1, 3], 3: [2, 4], 4: [1, 3],
+                         5: [6], 6: [5]}
+    monkeypatch.setattr(run, 'storage', workers[1])
+    assert client.delete('/imports/{}'.format(import_id)).status_code == 200
+    for citizen_update in [{'name': 'Test'}, {'relatives': [2]}]:
+        assert patch(workers[0], 1, citizen_update).status_code == 400
+
+
+def test_db_json_rendering_agrees(monkeypatch):
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    monkeypatch.setattr(run, 'storage', PostgresEngine())
+    results = []
+    for json_rendering in ['python', 'db']:
+        monkeypatch.setitem(run.app.config, 'JSON_RENDERING', json_rendering)
+        client = run.app.test_client()
+        results.append(collect_results(client))
+        import_id = post_import(client, load_data())
+        results.append((get_citizens(client, import_id),
+                        get_data(client, '/imports/{}/towns/stat/percentile'
+                                         '/age'.format(import_id))))
+    # Towns are sorted by code points at both ways.
+    assert results[:2] == results[2:]
+
+
+def test_delete_import(client):
+    import_id = post_import(client, load_data())
+    response = client.delete('/imports/{}'.format(import_id))
+    assert response.status_code == 200
+    assert response.get_json()['data'] == {'import_id': import_id}
+    for response in [
+            client.delete('/imports/{}'.format(import_id)),
+            client.get('/imports/{}/citizens'.format(import_id)),
+            client.patch('/imports/{}/citizens/1'.format(import_id),
+                         json={'name': 'Test'})]:
+        assert response.status_code == 400
+    assert import_id not in dict(run.storage.list_imports())
+
+
+def test_huge_import_id(client):
+    for import_id in [2 ** 31, 2 ** 70]:
+        for response in [
+                client.delete('/imports/{}'.format(import_id)),
+                client.get('/imports/{}/citizens'.format(import_id)),
+                client.get('/imports/{}/citizens/birthdays'
+                           .format(import_id)),
+                client.patch('/imports/{}/citizens/1'.format(import_id),
+                             json={'name': 'Test'})]:
+            assert response.status_code == 400
+
+
+def test_concurrent_imports(client):
+    citizens = load_data()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        import_ids = list(executor.map(
+            lambda _: post_import(run.app.test_client(), citizens),
+            range(16)))
+    assert len(set(import_ids)) == len(import_ids)
+
+
+def test_import_version(client):
+    import_id = post_import(client, load_data())
+    assert run.storage.get_version(import_id) == 0
+    response = client.patch('/imports/{}/citizens/1'.format(import_id),
+                            json={'name': 'Test'})
+    assert response.status_code == 200
+    assert run.storage.get_version(import_id) == 1
+    client.delete('/imports/{}'.format(import_id))
+    assert run.storage.get_version(import_id) == 2
+
+
+def test_append_citizens(client):
+    citizens = create_random_citizens()
+    first_ids = {citizen['citizen_id'] for citizen in citizens[:200]}
+    first_part = [dict(citizen,
+                       relatives=[relative_id
+                                  for relative_id in citizen['relatives']
+                                  if relative_id in first_ids])
+                  for citizen in citizens[:200]]
+    import_id = post_import(client, first_part)
+    append_url = '/imports/{}/citizens'.format(import_id)
+    response = client.post(append_url, json={'citizens': citizens[200:]})
+    assert response.status_code == 201
+    assert response.get_json()['data'] == {'import_id': import_id}
+
+    full_import_id = post_import(client, citizens)
+    results = []
+    for result_import_id in [import_id, full_import_id]:
+        citizens_data = get_citizens(client, result_import_id)
+        for citizen in citizens_data:
+            citizen['relatives'].sort()
+        results.append((
+            citizens_data,
+            get_data(client, '/imports/{}/citizens/birthdays'
+                             .format(result_import_id)),
+            get_data(client, '/imports/{}/towns/stat/percentile/age'
+                             .format(result_import_id))))
+    assert results[0] == results[1]
+    assert run.storage.get_version(import_id) == 1
+
+
+@pytest.mark.parametrize('citizen_id,relatives', [
+    (1, []),
+    (1000, [1001]),
+    (1000, [2000]),
+])
+def test_incorrect_append(client, citizen_id, relatives):
+    import_id = post_import(client, load_data())
+    citizen = dict(load_data()[0], citizen_id=citizen_id, relatives=relatives)
+    response = client.post('/imports/{}/citizens'.format(import_id),
+                           json={'citizens': [citizen]})
+    assert response.status_code == 400
+    assert get_citizens(client, import_id) == load_data()
+    response = client.post('/imports/{}/citizens'.format(import_id + 1000),
+                           json={'citizens': []})
+    assert response.status_code == 400
+
+
+def test_concurrent_patches(client):
+    """
+    100 writers change relatives of the same citizens at once,
+    relationships should stay symmetric.
+    """
+    citizens = create_random_citizens(50, 50)
+    import_id = post_import(client, citizens)
+    citizen_ids = [citizen['citizen_id'] for citizen in citizens]
+
+    def patch(seed):
+        patch_random = random.Random(seed)
+        test_client = run.app.test_client()
+        for _ in range(5):
+            citizen_id = patch_random.choice(citizen_ids)
+            relatives = patch_random.sample(citizen_ids,
+                                            patch_random.randint(0, 4))
+            response = test_client.patch(
+                '/imports/{}/citizens/{}'.format(import_id, citizen_id),
+                json={'relatives': relatives})
+            assert response.status_code == 200
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=100) as executor:
+        list(executor.map(patch, range(100)))
+    # 500 PATCHes of 50 citizens.
+    assert time.monotonic() - start < 30
+
+    relatives = {citizen['citizen_id']: citizen['relatives']
+                 for citizen in get_citizens(client, import_id)}
+    for citizen_id, citizen_relatives in relatives.items():
+        assert len(set(citizen_relatives)) == len(citizen_relatives)
+        for relative_id in citizen_relatives:
+            assert citizen_id in relatives[relative_id]
+    if isinstance(run.storage, PostgresEngine):
+        graph = run.storage.get_relatives_graph(import_id)
+        for citizen_id, citizen_relatives in relatives.items():
+            assert sorted(graph.relatives(citizen_id)) \
+                == sorted(citizen_relatives)
+
+
+def test_batched_patches(monkeypatch):
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    monkeypatch.setattr(run, 'storage',
+                        PostgresEngine(patch_batch_size=10,
+                                       patch_batch_delay=0.05))
+    client = run.app.test_client()
+    citizens = create_random_citizens(50, 50)
+    import_id = post_import(client, citizens)
+
+    def patch(citizen_id):
+        # The last PATCH has unknown relative and fails alone.
+        relatives = [(citizen_id + 1) % 50] if citizen_id < 49 else [100]
+        response = run.app.test_client().patch(
+            '/imports/{}/citizens/{}'.format(import_id, citizen_id),
+            json={'name': 'name {}'.format(citizen_id),
+                  'relatives': relatives})
+        return citizen_id, response.status_code, response.get_json()
+
+    with ThreadPoolExecutor(max_workers=50) as executor:
+        responses = list(executor.map(patch, range(50)))
+    for citizen_id, status_code, answer in responses[:-1]:
+        assert status_code == 200
+        assert answer['data']['citizen_id'] == citizen_id
+        assert answer['data']['name'] == 'name {}'.format(citizen_id)
+    assert responses[-1][1] == 400
+    assert run.storage.patch_batcher.batches < 50
+
+    relatives = {citizen['citizen_id']: citizen['relatives']
+                 for citizen in get_citizens(client, import_id)}
+    for citizen_id, citizen_relatives in relatives.items():
+        for relative_id in citizen_relatives:
+            assert citizen_id in relatives[relative_id]
+
+
+def test_patch_deadlock(monkeypatch):
+    storage = MemoryEngine()
+    monkeypatch.setattr(run, 'storage', storage)
+    client = run.app.test_client()
+    import_id = post_import(client, load_data())
+
+    def update_citizen(import_id, citizen_id, citizen_update):
+        raise psycopg2.extensions.TransactionRollbackError()
+
+    monkeypatch.setattr(storage, 'update_citizen', update_citizen)
+    response = client.patch('/imports/{}/citizens/1'.format(import_id),
+                            json={'name': 'Test'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] \
+        == str(run.app.config['RETRY_AFTER_SECONDS'])
+
+
+def test_batches_of_workers(monkeypatch):
+    """
+    Batches of several workers and single PATCHes change relatives
+    of the same citizens concurrently.
+    """
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    workers = [PostgresEngine(patch_batch_size=5, patch_batch_delay=0.01),
+               PostgresEngine(patch_batch_size=5, patch_batch_delay=0.01),
+               PostgresEngine()]
+    monkeypatch.setattr(run, 'storage', workers[0])
+    client = run.app.test_client()
+    import_id = post_import(client, create_random_citizens(20, 20))
+    random.seed(42)
+    updates = [(workers[number % 3], random.randrange(20),
+                random.sample(range(20), 3))
+               for number in range(90)]
+
+    def patch(update):
+        worker, citizen_id, relatives = update
+        with run.app.app_context():
+            worker.update_citizen(
+                import_id, citizen_id,
+                {'relatives': [relative_id for relative_id in relatives
+                               if relative_id != citizen_id]})
+
+    with ThreadPoolExecutor(max_workers=30) as executor:
+        list(executor.map(patch, updates))
+    relatives = {citizen['citizen_id']: citizen['relatives']
+                 for citizen in get_citizens(client, import_id)}
+    for citizen_id, citizen_relatives in relatives.items():
+        for relative_id in citizen_relatives:
+            assert citizen_id in relatives[relative_id]
@@ -0,0 +1,75 @@
+"""
+Tests for helpers of test/load_testing/api_load_testing.py
+"""
+import os
+import sys
+import logging
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                '..', 'load_testing'))
+import api_load_testing as load_testing  # noqa: E402
+
+
+def make_histogram(latencies, status=200):
+    histogram = load_testing.LatencyHistogram()
+    for latency in latencies:
+        histogram.add(latency, status)
+    return histogram
+
+
+def test_histogram_percentiles():
+    latencies = [index / 1000 for index in range(1, 1001)]
+    histogram = make_histogram(latencies)
+    for percent in load_testing.PERCENTILES:
+        exact = latencies[int(len(latencies) * percent / 100) - 1] * 1000
+        assert exact <= histogram.percentile(percent) <= exact * 1.02
+    assert histogram.percentile(100) == 1000
+    assert load_testing.LatencyHistogram().percentile(50) is None
+
+
+def test_histogram_merge():
+    histogram = make_histogram([0.001, 0.002])
+    histogram.merge(make_histogram([0.003], status=503))
+    histogram.merge(load_testing.LatencyHistogram())
+    assert histogram.to_dict()['latency_ms'] == {
+        'min': 1, 'mean': 2, 'max': 3,
+        'p50': pytest.approx(2, rel=0.01), 'p90': 3, 'p99': 3, 'p99.9': 3}
+    assert histogram.to_dict()['statuses'] == {'200': 2, '503': 1}
+    assert histogram.to_dict()['errors'] == 1
+
+
+def test_histogram_keys():
+    # Neighbour buckets of microseconds have distinct keys.
+    latencies = [load_testing.BUCKET_BASE ** (power + 0.5) / 1e6
+                 for power in range(200, 210)]
+    histogram = make_histogram(latencies)
+    histogram_ms = histogram.to_dict()['histogram_ms']
+    assert len(histogram_ms) == len(histogram.buckets) == len(latencies)
+    assert sum(histogram_ms.values()) == len(latencies)
+    assert load_testing.LatencyHistogram().to_dict() == {'count': 0}
+
+
+def test_parse_workload():
+    assert load_testing.parse_workload('get_ages=2,patch=0.5') \
+        == {'get_ages': 2., 'patch': .5}
+    for workload in ['unknown=1', 'get_ages', 'get_ages=x']:
+        with pytest.raises(ValueError):
+            load_testing.parse_workload(workload)
+
+
+def make_report(operations):
+    return {'operations': {operation: make_histogram(latencies).to_dict()
+                           for operation, latencies in operations.items()}}
+
+
+def test_compare_reports(caplog):
+    previous_report = make_report({'get_ages': [0.01], 'patch': [0.001]})
+    report = make_report({'get_ages': [0.02], 'post': [0.1]})
+    with caplog.at_level(logging.INFO):
+        load_testing.compare_reports(report, previous_report)
+    assert [record.getMessage() for record in caplog.records] \
+        == ['get_ages p50: 10.0 -> 20.0ms (+100.0%), '
+            'p90: 10.0 -> 20.0ms (+100.0%), p99: 10.0 -> 20.0ms (+100.0%), '
+            'p99.9: 10.0 -> 20.0ms (+100.0%)']
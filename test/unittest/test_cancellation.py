@@ -0,0 +1,160 @@
+"""
+Tests for api_tools/cancellation.py
+"""
+import socket
+import time
+
+import pytest
+import psycopg2.extensions
+from flask import g
+
+from api_tools.cancellation import (
+    ClientDisconnected,
+    DisconnectWatcher,
+    RequestGuard,
+    get_client_socket,
+    is_disconnected,
+)
+from api_tools.db_pool import ConnectionPool
+from api_tools.db_tools import DB_CREDENTIALS, PostgresEngine, shards
+from test_api import run, is_postgres_available, load_data, post_import
+
+SLEEP_SQL = 'SELECT pg_sleep(%s)'
+
+
+class Connection:
+    def __init__(self):
+        self.cancelled = 0
+        self.closed = False
+
+    def cancel(self):
+        self.cancelled += 1
+
+    def close(self):
+        self.closed = True
+
+
+def test_get_client_socket():
+    assert get_client_socket({}) is None
+    assert get_client_socket({'gunicorn.socket': 'socket'}) == 'socket'
+
+
+def test_watcher():
+    client, server = socket.socketpair()
+    watcher = DisconnectWatcher(interval=10)
+    conn = Connection()
+    guard = RequestGuard(client_socket=server)
+    with watcher.watch(conn, guard):
+        # Unread data isn't disconnection.
+        client.send(b'x')
+        assert not is_disconnected(server)
+        assert watcher.check() == 0
+        client.close()
+        server.recv(1)
+        assert is_disconnected(server)
+        assert watcher.check() == 1
+        assert guard.disconnected
+        # Query is cancelled once.
+        assert watcher.check() == 0
+    # Cancel may hit the next query, so connection isn't reused.
+    assert conn.cancelled == 1 and conn.closed
+    assert watcher.watched == {} and watcher.cancel_sent == set()
+    server.close()
+    # Requests without client socket aren't watched.
+    with watcher.watch(conn, RequestGuard()):
+        assert watcher.watched == {}
+
+
+@pytest.fixture
+def pool():
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    watcher = DisconnectWatcher(interval=0.01)
+    pool = ConnectionPool(DB_CREDENTIALS, size=1, guard=watcher.guard)
+    yield pool
+    pool.close()
+
+
+def sleep(pool, seconds):
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(SLEEP_SQL, (seconds,))
+
+
+def test_statement_timeout(pool):
+    with run.app.test_request_context():
+        # Without guard there is no timeout.
+        sleep(pool, 0.05)
+        g.request_guard = RequestGuard(statement_timeout=10)
+        with pytest.raises(psycopg2.extensions.QueryCanceledError):
+            sleep(pool, 5)
+    # Timeout is only for transaction of request,
+    # connection isn't closed.
+    sleep(pool, 0.05)
+    assert pool.opened == 1
+
+
+def test_client_disconnected(pool):
+    client, server = socket.socketpair()
+    client.close()
+    start = time.perf_counter()
+    with run.app.test_request_context():
+        g.request_guard = RequestGuard(client_socket=server)
+        with pytest.raises(ClientDisconnected):
+            sleep(pool, 5)
+    assert time.perf_counter() - start < 2
+    server.close()
+    sleep(pool, 0.05)
+
+
+def test_late_cancel():
+    """
+    Query is finished, when client disconnects.
+    """
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    client, server = socket.socketpair()
+    # Thread doesn't check before the test does it.
+    watcher = DisconnectWatcher(interval=10)
+    pool = ConnectionPool(DB_CREDENTIALS, size=1, guard=watcher.guard)
+    with run.app.test_request_context():
+        g.request_guard = RequestGuard(client_socket=server)
+        with pytest.raises(ClientDisconnected):
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(SLEEP_SQL, (0,))
+                client.close()
+                assert watcher.check() == 1
+    server.close()
+    assert conn.closed
+    with pool.connection() as next_conn:
+        with next_conn.cursor() as cur:
+            cur.execute(SLEEP_SQL, (0.05,))
+    assert next_conn is not conn and pool.opened == 2
+    pool.close()
+
+
+def test_route_timeout(monkeypatch):
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    storage = PostgresEngine()
+    monkeypatch.setattr(run, 'storage', storage)
+    monkeypatch.setitem(run.STATEMENT_TIMEOUTS_MS, 'get_birthdays', 10)
+    client = run.app.test_client()
+    import_id = post_import(client, load_data())
+    calculate_birthdays_json = storage.calculate_birthdays_json
+
+    def calculate_birthdays_slowly(import_id):
+        sleep(shards.get(import_id), 5)
+        return calculate_birthdays_json(import_id)
+
+    monkeypatch.setattr(storage, 'calculate_birthdays_json',
+                        calculate_birthdays_slowly)
+    url = '/imports/{}/citizens/birthdays'.format(import_id)
+    response = client.get(url)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] \
+        == str(run.app.config['RETRY_AFTER_SECONDS'])
+    # Other routes have no timeout.
+    response = client.get('/imports/{}/citizens'.format(import_id))
+    assert response.status_code == 200
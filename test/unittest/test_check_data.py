@@ -3,9 +3,14 @@ Tests for api_tools/check_data.py
 """
 import json
 from copy import deepcopy
+from datetime import date, datetime, timezone
 
 import pytest
 from api_tools.check_data import (
+    DATE_FORMAT,
+    str_to_date,
+    date_to_str,
+    get_today,
     check_gender,
     check_birth_date,
     check_relatives,
@@ -13,6 +18,7 @@ from api_tools.check_data import (
     check_init_citizen,
     check_update_citizen,
     check_citizens_group,
+    check_relationships,
 )
 
 DATA_PATH = 'test/test_data/import_data.json'
@@ -275,3 +281,59 @@ def test_check_citizens_group(citizens, is_correct):
     else:
         with pytest.raises(ValueError):
             check_citizens_group(citizens)
+
+
+@pytest.mark.parametrize('date_string', [
+    birth_date for birth_date, _ in BIRTH_DATE_TEST] + [
+    ' 1.02.2019',
+    '00.01.2019',
+    '29.02.2000',
+    '29.02.1900',
+    '01.02.0000',
+    '01.02.0999',
+    '01.02.2019 ',
+    '+1.02.2019',
+    '1_0.02.2019',
+    '١.02.2019',
+    '1٣.02.2019',
+])
+def test_str_to_date(date_string):
+    try:
+        expected = datetime.strptime(date_string, DATE_FORMAT).date()
+    except ValueError:
+        with pytest.raises(ValueError):
+            str_to_date(date_string)
+    else:
+        assert str_to_date(date_string) == expected
+        # Cached value.
+        assert str_to_date(date_string) == expected
+
+
+@pytest.mark.parametrize('birth_date', [
+    date(2019, 2, 1),
+    date(999, 12, 31),
+])
+def test_date_to_str(birth_date):
+    date_string = date_to_str(birth_date)
+    assert len(date_string) == 10
+    assert str_to_date(date_string) == birth_date
+
+
+def test_get_today():
+    assert get_today() == datetime.now(timezone.utc).date()
+
+
+@pytest.mark.parametrize('citizens_relatives,is_correct', [
+    ([(4, [1, 5]), (5, [4])], True),
+    ([(4, [4])], True),
+    ([(1, [])], False),
+    ([(4, [5]), (5, [])], False),
+    ([(4, [6])], False),
+])
+def test_check_appended_relationships(citizens_relatives, is_correct):
+    if is_correct:
+        check_relationships(citizens_relatives, existing_citizens={1, 2, 3})
+    else:
+        with pytest.raises(ValueError):
+            check_relationships(citizens_relatives,
+                                existing_citizens={1, 2, 3})
@@ -0,0 +1,37 @@
+"""
+Tests for api_tools/citizen.py
+"""
+import json
+
+from api_tools.citizen import Citizen, citizens_to_json
+
+CITIZEN_DATA = {
+    'citizen_id': 1,
+    'town': 'Москва',
+    'street': 'Льва "Толстого"',
+    'building': '16к7стр5',
+    'apartment': 7,
+    'name': 'Иванов Иван\\Иванович',
+    'birth_date': '26.12.1986',
+    'gender': 'male',
+    'relatives': [2, 28],
+}
+
+
+def test_citizen_record():
+    citizen = Citizen.from_dict(CITIZEN_DATA)
+    assert citizen.to_dict() == CITIZEN_DATA
+    assert citizen.relatives.typecode == 'i'
+    row = tuple(CITIZEN_DATA.values())
+    assert Citizen.from_row(row) == citizen
+
+
+def test_citizen_json():
+    citizen = Citizen.from_dict(CITIZEN_DATA)
+    # The same as Flask jsonify.
+    expected = json.dumps(CITIZEN_DATA, sort_keys=True,
+                          separators=(',', ':'))
+    assert citizen.to_json() == expected
+    citizen = citizen._replace(relatives=citizen.relatives[:0])
+    assert json.loads(citizens_to_json([citizen, citizen])) \
+        == [dict(CITIZEN_DATA, relatives=[])] * 2
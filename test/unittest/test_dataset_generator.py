@@ -0,0 +1,86 @@
+"""
+Tests for test/load_testing/dataset_generator.py
+"""
+import io
+import json
+import os
+import importlib.util
+from collections import Counter
+
+import pytest
+
+from api_tools.check_data import check_citizens_group
+
+GENERATOR_PATH = os.path.join(os.path.dirname(__file__),
+                              '..', 'load_testing', 'dataset_generator.py')
+
+
+def load_generator():
+    spec = importlib.util.spec_from_file_location('dataset_generator',
+                                                  GENERATOR_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+generator = load_generator()
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'mean_degree': 3, 'degree_distribution': 'pareto', 'window': 10},
+    {'town_skew': 1.5, 'birth_date_distribution': 'normal',
+     'names_number': 300, 'streets_number': 3},
+])
+def test_dataset_is_correct(options):
+    citizens = list(generator.DatasetGenerator(citizen_number=2000,
+                                               **options))
+    check_citizens_group(citizens)
+    assert [citizen['citizen_id'] for citizen in citizens] \
+        == list(range(2000))
+    assert citizens == list(generator.DatasetGenerator(citizen_number=2000,
+                                                       **options))
+    assert citizens != list(generator.DatasetGenerator(citizen_number=2000,
+                                                       seed=1,
+                                                       **options))
+
+
+def test_distributions():
+    citizens = list(generator.DatasetGenerator(citizen_number=20000,
+                                               mean_degree=2,
+                                               town_skew=1,
+                                               names_number=10,
+                                               window=5))
+    degrees = [len(citizen['relatives']) for citizen in citizens]
+    assert sum(degrees) / len(degrees) == pytest.approx(2, rel=0.05)
+    for citizen in citizens:
+        for relative_id in citizen['relatives']:
+            assert abs(relative_id - citizen['citizen_id']) <= 5
+    towns = Counter(citizen['town'] for citizen in citizens)
+    assert towns['town_0'] > 1.5 * towns['town_1'] > 2 * towns['town_3']
+    assert len({citizen['name'] for citizen in citizens}) == 10
+
+
+@pytest.mark.parametrize('options', [
+    {'degree_distribution': 'unknown'},
+    {'birth_date_distribution': 'unknown'},
+    {'degree_distribution': 'pareto', 'degree_alpha': 1},
+    {'degree_distribution': 'pareto', 'degree_alpha': 0.5},
+])
+def test_incorrect_options(options):
+    with pytest.raises(ValueError):
+        generator.DatasetGenerator(**options)
+
+
+@pytest.mark.parametrize('output_format', generator.FORMATS)
+def test_write_dataset(output_format):
+    citizens = list(generator.DatasetGenerator(citizen_number=100,
+                                               mean_degree=1))
+    file_object = io.StringIO()
+    assert generator.write_dataset(iter(citizens), file_object,
+                                   output_format) == 100
+    text = file_object.getvalue()
+    if output_format == 'json':
+        assert json.loads(text) == {'citizens': citizens}
+    else:
+        assert [json.loads(line) for line in text.splitlines()] == citizens
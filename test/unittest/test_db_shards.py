@@ -0,0 +1,105 @@
+"""
+Tests for api_tools/db_shards.py
+"""
+import pytest
+import psycopg2
+
+from api_tools import db_tools
+from api_tools.citizen import Citizen
+from api_tools.db_shards import parse_hosts, get_restart_id
+from api_tools.db_tools import DB_CREDENTIALS, create_shards
+from test_api import run, is_postgres_available, create_random_citizens
+
+SHARDS_NUMBER = 2
+SHARD_DB_NAME = '{}_shard_{}'
+CREATE_DATABASE_SQL = 'CREATE DATABASE {};'
+DROP_DATABASE_SQL = 'DROP DATABASE IF EXISTS {};'
+
+
+def test_parse_hosts():
+    assert parse_hosts('') == []
+    assert parse_hosts('db1, db2:5433,/tmp/pg') == [
+        {'host': 'db1'},
+        {'host': 'db2', 'port': 5433},
+        {'host': '/tmp/pg'},
+    ]
+
+
+@pytest.mark.parametrize(
+    'increment, last_value, start_value, index, count, restart_id',
+    [
+        # Fresh sequence of single DB.
+        (1, None, 0, 0, 1, None),
+        (1, 10, 0, 0, 1, None),
+        # The first start with shards.
+        (1, None, 0, 1, 2, 1),
+        (1, None, 0, 0, 2, 0),
+        (1, 10, 0, 0, 2, 12),
+        (1, 10, 0, 1, 2, 11),
+        # Already configured.
+        (2, 11, 0, 1, 2, None),
+        (3, 5, 0, 2, 3, None),
+        # Number of shards is changed.
+        (3, 5, 0, 1, 2, 7),
+    ])
+def test_get_restart_id(increment, last_value, start_value, index, count,
+                        restart_id):
+    assert get_restart_id(increment, last_value, start_value,
+                          index, count) == restart_id
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    """
+    Two databases at test server as shards.
+    """
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    names = [SHARD_DB_NAME.format(DB_CREDENTIALS['dbname'], index)
+             for index in range(SHARDS_NUMBER)]
+    conn = psycopg2.connect(**DB_CREDENTIALS)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for name in names:
+                cur.execute(DROP_DATABASE_SQL.format(name))
+                cur.execute(CREATE_DATABASE_SQL.format(name))
+    except psycopg2.ProgrammingError:
+        conn.close()
+        pytest.skip('Test databases can\'t be created.')
+    shards = create_shards([dict(DB_CREDENTIALS, dbname=name)
+                            for name in names])
+    monkeypatch.setattr(db_tools, 'shards', shards)
+    with run.app.app_context():
+        yield shards
+    shards.close()
+    with conn.cursor() as cur:
+        for name in names:
+            cur.execute(DROP_DATABASE_SQL.format(name))
+    conn.close()
+
+
+def test_shards(shards):
+    imports = {}
+    for _ in range(2 * SHARDS_NUMBER):
+        citizens = [Citizen.from_dict(citizen_data)
+                    for citizen_data in create_random_citizens(10, 10)]
+        import_id = db_tools.save_new_import(citizens)['import_id']
+        imports[import_id] = citizens
+    # Imports are created at shards in turn.
+    assert sorted(import_id % SHARDS_NUMBER for import_id in imports) \
+        == [0, 0, 1, 1]
+    assert [import_id for import_id, _ in db_tools.list_imports()] \
+        == sorted(imports)
+    for import_id, citizens in imports.items():
+        assert db_tools.load_import(import_id) == citizens
+        with shards.pools[import_id % SHARDS_NUMBER].connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT to_regclass(%s)',
+                            ('import_{}'.format(import_id),))
+                assert cur.fetchone()[0] is not None
+    import_id = min(imports)
+    db_tools.delete_import(import_id)
+    assert import_id not in dict(db_tools.list_imports())
+    with pytest.raises(ValueError):
+        db_tools.load_import(import_id)
@@ -0,0 +1,80 @@
+"""
+Tests for api_tools/log_tools.py
+"""
+import sys
+import json
+import logging
+
+import pytest
+from flask import Flask
+
+from api_tools.log_tools import (
+    AsyncQueueHandler,
+    JsonFormatter,
+    SampledDebugFilter,
+    sample_request_debug,
+    setup_logging,
+)
+
+SAMPLING_TEST = [
+    (logging.INFO, 0.0, True),
+    (logging.DEBUG, 0.0, False),
+    (logging.DEBUG, 1.0, True),
+    (logging.WARNING, 1.0, True),
+]
+
+
+def make_record(level):
+    return logging.LogRecord('test', level, __file__, 0,
+                             'Message %d', (1,), None)
+
+
+@pytest.mark.parametrize('level,sample_rate,is_passed', SAMPLING_TEST)
+def test_sampled_debug_filter(level, sample_rate, is_passed):
+    app = Flask(__name__)
+    log_filter = SampledDebugFilter(logging.INFO)
+    with app.test_request_context('/ping'):
+        sample_request_debug(sample_rate)
+        assert bool(log_filter.filter(make_record(level))) == is_passed
+
+
+def test_sampled_debug_filter_outside_request():
+    log_filter = SampledDebugFilter(logging.INFO)
+    assert not log_filter.filter(make_record(logging.DEBUG))
+
+
+def test_async_queue_handler():
+    handler = AsyncQueueHandler(None)
+    args = [1]
+    record = logging.LogRecord('test', logging.INFO, __file__, 0,
+                               'Message %s', (args,), None)
+    record.data = {'import_id': 1}
+    prepared = handler.prepare(record)
+    args.append(2)
+    assert prepared.getMessage() == 'Message [1]'
+    assert prepared.args is None and prepared.data == {'import_id': 1}
+    assert record.args == ([1, 2],)
+    try:
+        raise ValueError('Test')
+    except ValueError:
+        record = logging.LogRecord('test', logging.ERROR, __file__, 0,
+                                   'Error', (), sys.exc_info())
+    prepared = handler.prepare(record)
+    assert prepared.exc_info is None
+    assert 'ValueError: Test' in prepared.exc_text
+    assert 'ValueError: Test' in logging.Formatter().format(prepared)
+
+
+def test_json_formatter():
+    record = make_record(logging.WARNING)
+    record.data = {'statement': 'GET_AGES', 'import_rows': 10}
+    fields = json.loads(JsonFormatter().format(record))
+    assert fields['message'] == 'Message 1'
+    assert fields['level'] == 'WARNING'
+    assert fields['statement'] == 'GET_AGES'
+    assert fields['import_rows'] == 10
+
+
+def test_unknown_log_level():
+    with pytest.raises(ValueError, match='Unknown log level VERBOSE'):
+        setup_logging('VERBOSE')
@@ -0,0 +1,131 @@
+"""
+Tests for api_tools/migrations.py and api_tools/db_pool.py
+"""
+import threading
+
+import pytest
+import psycopg2
+
+from api_tools.db_pool import ConnectionPool
+from api_tools.db_tools import DB_CREDENTIALS, prepare_connection
+from api_tools.migrations import (
+    migrate,
+    upgrade_import_tables,
+    drop_relatives_indexes,
+)
+from test_api import run, is_postgres_available
+
+LEGACY_TABLE_SQL = """
+CREATE TABLE import_{import_id} (
+    citizen_id integer PRIMARY KEY,
+    town varchar(256),
+    street varchar(256),
+    building varchar(256),
+    apartment integer,
+    name varchar(256),
+    birth_date date,
+    gender gender_type,
+    relatives integer[]
+);
+INSERT INTO import_{import_id}
+VALUES (1, 'Town', 'Street', '1', 1, 'Name', '2000-03-01', 'male', '{{}}');
+"""
+GET_COLUMN_SQL = """
+SELECT birth_month FROM import_{import_id}
+"""
+GET_INDEXES_SQL = """
+SELECT count(*) FROM pg_indexes WHERE tablename = 'import_{import_id}'
+"""
+GIN_INDEX_SQL = """
+CREATE INDEX import_{import_id}_relatives_idx
+ON import_{import_id} USING GIN (relatives)
+"""
+# Far from ids of service imports.
+LEGACY_IMPORT_ID = 1000000
+
+
+@pytest.fixture
+def cursor():
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    conn = psycopg2.connect(**DB_CREDENTIALS)
+    with run.app.app_context(), conn.cursor() as cur:
+        yield cur
+    conn.rollback()
+    conn.close()
+
+
+def test_migrations_are_applied_once(cursor):
+    calls = []
+
+    def migration(cur):
+        calls.append(cur)
+
+    migrate(cursor, [(1000, migration)])
+    assert migrate(cursor, [(1000, migration)]) == []
+    assert len(calls) == 1
+
+
+def test_upgrade_import_tables(cursor):
+    cursor.execute(LEGACY_TABLE_SQL.format(import_id=LEGACY_IMPORT_ID))
+    upgrade_import_tables(cursor)
+    cursor.execute(GET_COLUMN_SQL.format(import_id=LEGACY_IMPORT_ID))
+    assert cursor.fetchall() == [(3,)]
+    cursor.execute(GET_INDEXES_SQL.format(import_id=LEGACY_IMPORT_ID))
+    # Primary key and (town, birth_date) index.
+    assert cursor.fetchone()[0] == 2
+
+
+def test_drop_relatives_indexes(cursor):
+    cursor.execute(LEGACY_TABLE_SQL.format(import_id=LEGACY_IMPORT_ID))
+    cursor.execute(GIN_INDEX_SQL.format(import_id=LEGACY_IMPORT_ID))
+    drop_relatives_indexes(cursor)
+    cursor.execute(GET_INDEXES_SQL.format(import_id=LEGACY_IMPORT_ID))
+    # Only primary key.
+    assert cursor.fetchone()[0] == 1
+
+
+def test_connection_pool(cursor):
+    setup_calls = []
+    pool = ConnectionPool(DB_CREDENTIALS,
+                          size=2,
+                          setup=lambda: setup_calls.append(1),
+                          prepare=prepare_connection)
+    assert pool.warm_up() == 2
+    with pool.connection() as first, pool.connection() as second, \
+            pool.connection() as third:
+        with third.cursor() as cur:
+            cur.execute('SHOW timezone')
+            assert cur.fetchone()[0] == 'GMT'
+            cur.execute('EXECUTE check_import(%s)', (LEGACY_IMPORT_ID,))
+            assert cur.fetchone()[0] is None
+    # Extra connection is closed, others are reused.
+    connections = [first, second, third]
+    assert [conn.closed for conn in connections].count(0) == 2
+    with pool.connection() as conn:
+        assert conn in connections and not conn.closed
+    with pytest.raises(psycopg2.ProgrammingError):
+        with pool.connection() as conn:
+            conn.cursor().execute('SELECT unknown_column')
+    with pool.connection() as conn_after_error:
+        assert not conn_after_error.closed
+    assert pool.opened == 3
+    assert setup_calls == [1]
+    pool.close()
+
+
+def test_connection_pool_limit(cursor):
+    pool = ConnectionPool(DB_CREDENTIALS, size=1, max_connections=1)
+    taken = []
+    with pool.connection() as conn:
+        thread = threading.Thread(
+            target=lambda: taken.append(pool.take()))
+        thread.start()
+        thread.join(0.2)
+        # The only connection is in use, so thread waits.
+        assert not taken
+    thread.join(5)
+    assert taken == [conn]
+    pool.release(conn)
+    assert pool.opened == 1
+    pool.close()
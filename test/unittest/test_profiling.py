@@ -0,0 +1,94 @@
+"""
+Tests for api_tools/profiling.py and profiling of service/run.py requests.
+"""
+import os
+import sys
+import pstats
+
+import pytest
+from api_tools.memory_engine import MemoryEngine
+from api_tools.profiling import ProfilesStore, should_profile, start_profiler
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                '..', '..', 'service'))
+import run  # noqa: E402
+
+
+def busy_function():
+    return sum(number * number for number in range(100000))
+
+
+def profile_busy_function(profile_format):
+    """
+    Sampler gets the GIL once per switch interval (5 ms by default),
+    which is about the time of busy_function, so it's repeated
+    until it's sampled.
+    """
+    for _ in range(100):
+        profiler = start_profiler(profile_format, interval=0.0001)
+        busy_function()
+        profiler.stop()
+        if profile_format != 'collapsed' or any(
+                'busy_function' in stack for stack in profiler.stacks):
+            return profiler
+    pytest.fail('busy_function is not sampled.')
+
+
+@pytest.mark.parametrize('header_value,sample_rate,result', [
+    (None, 0.0, False),
+    ('1', 0.0, True),
+    ('0', 0.0, False),
+    (None, 1.0, True),
+])
+def test_should_profile(header_value, sample_rate, result):
+    assert should_profile(header_value, sample_rate) == result
+
+
+def test_profiles_store(tmp_path):
+    profiles = ProfilesStore(str(tmp_path), max_files=2)
+    names = []
+    for profile_format in ['pstats', 'collapsed', 'collapsed']:
+        profiler = profile_busy_function(profile_format)
+        names.append(profiles.save(profiler, 'test/label'))
+    assert [profile['name'] for profile in profiles.list()] \
+        == names[:0:-1]
+    with open(profiles.get_path(names[-1])) as file_object:
+        assert 'busy_function' in file_object.read()
+    for name in [names[0], '../secret.txt', 'profile.py']:
+        with pytest.raises(ValueError):
+            profiles.get_path(name)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(run, 'storage', MemoryEngine())
+    monkeypatch.setattr(run, 'profiles', ProfilesStore(str(tmp_path)))
+    monkeypatch.setitem(run.app.config, 'PROFILING', 1)
+    return run.app.test_client()
+
+
+def test_profiled_request(client, tmp_path):
+    assert 'X-Profile-Name' not in client.get('/ping').headers
+    response = client.get('/ping', headers={'X-Profile': '1'})
+    name = response.headers['X-Profile-Name']
+    assert [profile['name'] for profile
+            in client.get('/admin/profiles').get_json()['data']] == [name]
+
+    response = client.get('/admin/profiles/{}'.format(name))
+    assert response.status_code == 200
+    profile_path = str(tmp_path / 'downloaded.prof')
+    with open(profile_path, 'wb') as file_object:
+        file_object.write(response.get_data())
+    function_names = [function[2] for function
+                      in pstats.Stats(profile_path).stats]
+    assert 'ping' in function_names
+
+    response = client.get('/admin/profiles/unknown.prof')
+    assert response.status_code == 400
+
+
+def test_profiling_off(client, monkeypatch):
+    monkeypatch.setitem(run.app.config, 'PROFILING', 0)
+    response = client.get('/ping', headers={'X-Profile': '1'})
+    assert 'X-Profile-Name' not in response.headers
+    assert client.get('/admin/profiles').get_json()['data'] == []
@@ -0,0 +1,120 @@
+"""
+Tests for api_tools/query_log.py
+"""
+import logging
+
+import pytest
+import psycopg2
+import psycopg2.extensions
+
+from api_tools.citizen import Citizen
+from api_tools.db_tools import DB_CREDENTIALS, save_new_import
+from api_tools import query_log
+from api_tools.query_log import (
+    SLOW_QUERY_LOGGER,
+    QueriesStats,
+    execute,
+    get_plan,
+    queries_stats,
+)
+from api_tools.sql_queries import GET_BIRTHDAYS_SQL, LOCK_ROWS_SQL
+from test_api import (
+    run,
+    is_postgres_available,
+    create_random_citizens,
+)
+
+
+def test_queries_stats():
+    stats = QueriesStats()
+    stats.add('GET_AGES', 2.0, False)
+    stats.add('GET_AGES', 4.0, True)
+    assert stats.get() == {'GET_AGES': {
+        'count': 2,
+        'total_ms': 6.0,
+        'max_ms': 4.0,
+        'slow': 1,
+    }}
+
+
+@pytest.fixture
+def cursor():
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    with run.app.app_context():
+        import_id = save_new_import([
+            Citizen.from_dict(citizen_data)
+            for citizen_data in create_random_citizens(100, 100)
+        ])['import_id']
+    with psycopg2.connect(**DB_CREDENTIALS) as conn:
+        with conn.cursor() as cur:
+            yield import_id, cur
+
+
+@pytest.mark.parametrize('sample_rate,has_plan', [(0.0, False),
+                                                  (1.0, True)])
+def test_slow_query_log(cursor, caplog, monkeypatch, sample_rate, has_plan):
+    import_id, cur = cursor
+    monkeypatch.setitem(run.app.config, 'SLOW_QUERY_THRESHOLD_MS', 1e-6)
+    monkeypatch.setitem(run.app.config, 'SLOW_QUERY_EXPLAIN_SAMPLE_RATE',
+                        sample_rate)
+    count = queries_stats.get().get('GET_BIRTHDAYS', {}).get('slow', 0)
+    with run.app.app_context(), caplog.at_level(logging.WARNING,
+                                                logger=SLOW_QUERY_LOGGER):
+        execute(cur, 'GET_BIRTHDAYS',
+                GET_BIRTHDAYS_SQL.format(import_id=import_id),
+                import_id=import_id)
+        # Result of statement is left for caller.
+        assert len(cur.fetchall()) > 0
+    data = caplog.records[-1].data
+    assert data['statement'] == 'GET_BIRTHDAYS'
+    assert data['import_rows'] == 100
+    assert (data['plan'] is not None) == has_plan
+    if has_plan:
+        assert 'Buffers' in data['plan']
+    assert queries_stats.get()['GET_BIRTHDAYS']['slow'] == count + 1
+
+
+def test_fast_query_is_not_logged(cursor, caplog):
+    _, cur = cursor
+    with run.app.app_context():
+        execute(cur, 'SELECT_ONE', 'SELECT 1')
+    assert cur.fetchone() == (1,)
+    assert not [record for record in caplog.records
+                if record.name == SLOW_QUERY_LOGGER]
+
+
+def test_locking_statement_isnt_analyzed(cursor):
+    import_id, cur = cursor
+    plan = get_plan(cur, LOCK_ROWS_SQL.format(import_id=import_id),
+                    ([1, 2],))
+    assert 'LockRows' in plan
+    assert 'actual time' not in plan
+
+
+def test_failed_explain_keeps_transaction(cursor, caplog, monkeypatch):
+    import_id, cur = cursor
+    monkeypatch.setitem(run.app.config, 'SLOW_QUERY_THRESHOLD_MS', 1e-6)
+    monkeypatch.setitem(run.app.config, 'SLOW_QUERY_EXPLAIN_SAMPLE_RATE',
+                        1.0)
+
+    def explain_with_error(explain_cur, sql, params):
+        explain_cur.execute('SELECT 1 / 0')
+
+    def explain_too_long(explain_cur, sql, params):
+        explain_cur.execute("SET LOCAL statement_timeout = '10ms'")
+        explain_cur.execute('SELECT pg_sleep(5)')
+
+    with run.app.app_context():
+        monkeypatch.setattr(query_log, 'get_plan', explain_with_error)
+        execute(cur, 'SELECT_ONE', 'SELECT 1')
+        assert cur.fetchone() == (1,)
+        # Timeout of explain is raised, it's request's timeout.
+        monkeypatch.setattr(query_log, 'get_plan', explain_too_long)
+        with pytest.raises(psycopg2.extensions.QueryCanceledError):
+            execute(cur, 'SELECT_ONE', 'SELECT 1')
+        # Transaction isn't aborted.
+        monkeypatch.setitem(run.app.config, 'SLOW_QUERY_THRESHOLD_MS', 0)
+        execute(cur, 'SELECT_ONE', 'SELECT 1')
+        assert cur.fetchone() == (1,)
+    assert caplog.records[-1].data['statement'] == 'SELECT_ONE'
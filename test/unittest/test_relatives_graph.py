@@ -0,0 +1,85 @@
+"""
+Tests for api_tools/relatives_graph.py
+"""
+import random
+
+import pytest
+from api_tools.relatives_graph import RelativesGraph, check_citizens_exist
+
+CITIZENS_RELATIVES = [
+    (1, [2, 3]),
+    (2, [1]),
+    (3, [1, 3]),
+    (4, []),
+]
+
+
+def set_relatives(relatives, citizen_id, new_relatives):
+    """
+    Plain dict of relatives lists, updated as at PATCH.
+    """
+    for relative_id in set(relatives[citizen_id]) - set(new_relatives):
+        relatives[relative_id].remove(citizen_id)
+    for relative_id in set(new_relatives) - set(relatives[citizen_id]):
+        if relative_id != citizen_id:
+            relatives[relative_id].append(citizen_id)
+    relatives[citizen_id] = list(new_relatives)
+
+
+def test_graph_queries():
+    graph = RelativesGraph(CITIZENS_RELATIVES)
+    assert len(graph) == 4
+    assert 3 in graph and 5 not in graph
+    assert graph.get_missing([1, 5, 4, 6]) == [5, 6]
+    assert graph.relatives(1) == [2, 3]
+    assert graph.relatives(3) == [1, 3]
+    owner_rows, relative_rows = graph.edges()
+    assert list(zip(owner_rows, relative_rows)) == [
+        (0, 1), (0, 2), (1, 0), (2, 0), (2, 2)]
+
+
+def test_check_citizens_exist():
+    graph = RelativesGraph(CITIZENS_RELATIVES)
+    check_citizens_exist(graph, 0, [1, 2])
+    with pytest.raises(ValueError):
+        check_citizens_exist(graph, 0, [1, 5])
+
+
+def test_set_relatives():
+    graph = RelativesGraph(CITIZENS_RELATIVES)
+    graph.set_relatives(3, [3, 4])
+    assert graph.relatives(1) == [2]
+    assert graph.relatives(3) == [3, 4]
+    assert graph.relatives(4) == [3]
+    graph.compact()
+    assert graph.changed == {}
+    assert [graph.relatives(citizen_id) for citizen_id in range(1, 5)] \
+        == [[2], [1], [3, 4], [3]]
+
+
+def test_random_updates():
+    random.seed(42)
+    citizen_ids = list(range(100))
+    relatives = {citizen_id: [] for citizen_id in citizen_ids}
+    graph = RelativesGraph(list(relatives.items()))
+    for _ in range(300):
+        citizen_id = random.choice(citizen_ids)
+        new_relatives = random.sample(citizen_ids, random.randrange(5))
+        set_relatives(relatives, citizen_id, new_relatives)
+        graph.set_relatives(citizen_id, new_relatives)
+        for other_id in random.sample(citizen_ids, 3):
+            assert graph.relatives(other_id) == relatives[other_id]
+    for citizen_id in citizen_ids:
+        assert graph.relatives(citizen_id) == relatives[citizen_id]
+
+
+def test_append():
+    graph = RelativesGraph([(1, [2]), (2, [1]), (3, [])])
+    citizens_relatives = [(4, [1, 5, 4]), (5, [4, 3])]
+    assert graph.get_back_links(citizens_relatives) == [(1, 4), (3, 5)]
+    graph.append(citizens_relatives)
+    assert len(graph) == 5
+    assert [graph.relatives(citizen_id) for citizen_id in range(1, 6)] \
+        == [[2, 4], [1], [5], [1, 5, 4], [4, 3]]
+    graph.compact()
+    assert graph.relatives(1) == [2, 4]
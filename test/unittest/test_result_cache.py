@@ -0,0 +1,150 @@
+"""
+Tests for api_tools/result_cache.py
+"""
+import multiprocessing
+import os
+
+import pytest
+
+from api_tools.db_tools import PostgresEngine
+from api_tools.result_cache import SharedResultCache, get_key
+from test_api import (
+    run,
+    is_postgres_available,
+    load_data,
+    post_import,
+    get_data,
+)
+
+MAX_BYTES = 100
+
+
+@pytest.fixture
+def cache(tmpdir):
+    with run.app.app_context():
+        yield SharedResultCache(str(tmpdir), MAX_BYTES)
+
+
+def test_get_key():
+    assert get_key('calculate_ages_stat_json', (True,)) \
+        == 'calculate_ages_stat_json_True'
+    assert get_key('load_import_json', ()) == 'load_import_json'
+
+
+def test_cache(cache):
+    assert cache.get_version(1) == 0
+    assert cache.get(1, 0, 'key') is None
+    cache.put(1, 0, 'key', b'answer')
+    assert cache.get(1, 0, 'key') == b'answer'
+    assert cache.get(1, 1, 'key') is None
+    assert cache.invalidate(1) == 1
+    assert cache.get_version(1) == 1
+    assert cache.get(1, 0, 'key') is None
+    # Answer of old version, calculated before invalidation,
+    # isn't saved.
+    cache.put(1, 0, 'key', b'old answer')
+    assert cache.get_stats()['answers'] == 0
+    assert cache.get_stats()['hits'] == 1
+
+
+def test_eviction(cache):
+    for import_id in range(4):
+        cache.put(import_id, 0, 'key', b'x' * 30)
+        # Answers are used in order of imports, except the first one.
+        if import_id > 1:
+            assert cache.get(1, 0, 'key') is not None
+    stats = cache.get_stats()
+    assert stats['bytes'] <= MAX_BYTES
+    assert cache.get(0, 0, 'key') is None
+    assert cache.get(1, 0, 'key') is not None
+    assert cache.get(3, 0, 'key') is not None
+    # Answer bigger than cache isn't saved.
+    cache.put(5, 0, 'key', b'x' * (MAX_BYTES + 1))
+    assert cache.get(5, 0, 'key') is None
+    assert not [name for name in os.listdir(cache.directory)
+                if name.startswith('.tmp')]
+
+
+def test_wrap(cache):
+    calls = []
+
+    def calculate_answer(import_id, argument):
+        calls.append((import_id, argument))
+        return b'answer'
+
+    function = cache.wrap(calculate_answer, cache.get_version(1))
+    assert function(1, True) == b'answer'
+    assert function(1, True) == b'answer'
+    assert function(1, False) == b'answer'
+    assert calls == [(1, True), (1, False)]
+
+
+def invalidate(directory, import_id):
+    with run.app.app_context():
+        SharedResultCache(directory, MAX_BYTES).invalidate(import_id)
+
+
+def test_other_process(cache):
+    cache.put(1, 0, 'key', b'answer')
+    process = multiprocessing.Process(target=invalidate,
+                                      args=(cache.directory, 1))
+    process.start()
+    process.join(10)
+    assert process.exitcode == 0
+    assert cache.get_version(1) == 1
+    assert cache.get(1, 0, 'key') is None
+
+
+def test_workers(tmpdir, monkeypatch):
+    """
+    Two workers with the same cache: answer is calculated once,
+    PATCH at one of them is seen by the other one.
+    """
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    with run.app.app_context():
+        cache = SharedResultCache(str(tmpdir), 1024 * 1024)
+    workers = [PostgresEngine(result_cache=cache) for _ in range(2)]
+    monkeypatch.setattr(run, 'storage', workers[0])
+    client = run.app.test_client()
+    import_id = post_import(client, load_data())
+    url = '/imports/{}/citizens'.format(import_id)
+    citizens = get_data(client, url)
+    monkeypatch.setattr(run, 'storage', workers[1])
+    assert get_data(client, url) == citizens
+    assert cache.get_stats()['hits'] == 1
+    response = client.patch('/imports/{}/citizens/1'.format(import_id),
+                            json={'name': 'Test'})
+    assert response.status_code == 200
+    monkeypatch.setattr(run, 'storage', workers[0])
+    names = {citizen['citizen_id']: citizen['name']
+             for citizen in get_data(client, url)}
+    assert names[1] == 'Test'
+    response = client.get('/admin/cache')
+    assert response.status_code == 200
+
+
+def test_workers_age_sketches(tmpdir, monkeypatch):
+    """
+    Age sketch of worker, which doesn't see PATCH of other worker,
+    is rebuilt.
+    """
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    with run.app.app_context():
+        cache = SharedResultCache(str(tmpdir), 1024 * 1024)
+    workers = [PostgresEngine(age_sketch_resolution=1, result_cache=cache)
+               for _ in range(2)]
+    monkeypatch.setattr(run, 'storage', workers[0])
+    client = run.app.test_client()
+    import_id = post_import(client, load_data())
+    monkeypatch.setattr(run, 'storage', workers[1])
+    response = client.patch('/imports/{}/citizens/1'.format(import_id),
+                            json={'town': 'New town',
+                                  'birth_date': '01.01.1950'})
+    assert response.status_code == 200
+    monkeypatch.setattr(run, 'storage', workers[0])
+    url = '/imports/{}/towns/stat/percentile/age'.format(import_id)
+    approximate = get_data(client, url + '?mode=approximate')
+    exact = get_data(client, url + '?mode=exact')
+    assert approximate == sorted(exact, key=lambda town: town['town'])
@@ -0,0 +1,46 @@
+"""
+Tests for api_tools/retention.py
+"""
+import os
+import sys
+
+import pytest
+from api_tools import retention
+from api_tools.citizen import Citizen
+from api_tools.memory_engine import MemoryEngine
+from api_tools.retention import ImportsReaper, select_expired
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__),
+                                '..', '..', 'service'))
+import run  # noqa: E402
+
+IMPORTS = [(0, 100.0), (1, 200.0), (2, 300.0), (3, 400.0)]
+
+
+@pytest.mark.parametrize('max_age,max_count,expired', [
+    (0, 0, []),
+    (150, 0, [0, 1]),
+    (0, 3, [0]),
+    (0, 10, []),
+    (250, 2, [0, 1]),
+    (50, 3, [0, 1, 2]),
+])
+def test_select_expired(max_age, max_count, expired):
+    assert select_expired(IMPORTS, 360.0, max_age, max_count) == expired
+
+
+def test_reaper(monkeypatch):
+    monkeypatch.setattr(retention, 'BATCH_PAUSE_SECONDS', 0)
+    storage = MemoryEngine()
+    citizen = Citizen.from_dict({
+        'citizen_id': 1, 'town': 'town', 'street': 'street',
+        'building': '1', 'apartment': 1, 'name': 'name',
+        'birth_date': '01.01.2000', 'gender': 'male', 'relatives': []})
+    for _ in range(7):
+        storage.save_import([citizen])
+    reaper = ImportsReaper(run.app, storage, max_count=2, batch_size=2)
+    assert reaper.enabled
+    assert reaper.reap() == 5
+    assert [import_id for import_id, _ in storage.list_imports()] == [5, 6]
+    assert reaper.reap() == 0
+    assert not ImportsReaper(run.app, storage).enabled
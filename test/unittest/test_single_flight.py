@@ -0,0 +1,76 @@
+"""
+Tests for api_tools/single_flight.py
+"""
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from api_tools.single_flight import SingleFlight
+
+CALLERS_NUMBER = 10
+
+
+def run_concurrently(single_flight, key, function):
+    """
+    Call function from many threads, return results or exceptions.
+    """
+    def call(_):
+        try:
+            return single_flight.do(key, function)
+        except ValueError as error:
+            return error
+
+    with ThreadPoolExecutor(max_workers=CALLERS_NUMBER) as executor:
+        futures = [executor.submit(call, number)
+                   for number in range(CALLERS_NUMBER)]
+        # Let everyone join the call.
+        while single_flight.executed + single_flight.shared < CALLERS_NUMBER:
+            time.sleep(0.001)
+        function.release.set()
+        return [future.result() for future in futures]
+
+
+class BlockingFunction:
+    def __init__(self, error=None):
+        self.release = threading.Event()
+        self.calls = 0
+        self.error = error
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.calls
+
+
+def test_shared_result():
+    single_flight = SingleFlight()
+    function = BlockingFunction()
+    results = run_concurrently(single_flight, 'key', function)
+    assert function.calls == 1
+    assert results == [1] * CALLERS_NUMBER
+    assert (single_flight.executed, single_flight.shared) \
+        == (1, CALLERS_NUMBER - 1)
+    # Nothing is cached after the call.
+    assert single_flight.calls == {}
+    assert single_flight.do('key', lambda: 2) == 2
+
+
+def test_shared_error():
+    single_flight = SingleFlight()
+    error = ValueError('There is no import 1')
+    function = BlockingFunction(error)
+    assert run_concurrently(single_flight, 'key', function) \
+        == [error] * CALLERS_NUMBER
+    assert function.calls == 1
+
+
+def test_different_keys():
+    single_flight = SingleFlight()
+    assert single_flight.do(1, lambda: 1) == 1
+    assert single_flight.do(2, lambda: 2) == 2
+    with pytest.raises(ZeroDivisionError):
+        single_flight.do(3, lambda: 1 / 0)
+    assert single_flight.executed == 3
@@ -0,0 +1,137 @@
+"""
+Tests for api_tools/snapshot.py and snapshot routes of service/run.py.
+"""
+import io
+import json
+
+import pytest
+
+from api_tools.db_tools import PostgresEngine
+from api_tools.memory_engine import MemoryEngine
+from api_tools.snapshot import (
+    HEADER_LENGTH,
+    MAGIC,
+    MAX_HEADER_LENGTH,
+    CompressingWriter,
+    DecompressingReader,
+    write_snapshot,
+    read_header,
+)
+from test_api import (
+    run,
+    is_postgres_available,
+    create_random_citizens,
+    post_import,
+    get_citizens,
+    get_data,
+)
+
+
+def make_snapshot(data):
+    compressed_data = io.BytesIO()
+    writer = CompressingWriter(compressed_data)
+    for start in range(0, len(data), 1000):
+        writer.write(data[start:start + 1000])
+    writer.close()
+    compressed_data.seek(0)
+    snapshot = io.BytesIO()
+    write_snapshot(snapshot,
+                   {'size': writer.size, 'sha256': writer.sha256.hexdigest()},
+                   compressed_data)
+    return snapshot.getvalue()
+
+
+def read_snapshot(snapshot, read_size):
+    file_object = io.BytesIO(snapshot)
+    header = read_header(file_object)
+    reader = DecompressingReader(file_object)
+    chunks = []
+    while True:
+        chunk = reader.read(read_size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    reader.check(header)
+    return b''.join(chunks)
+
+
+@pytest.mark.parametrize('read_size', [-1, 1, 8192])
+def test_snapshot_round_trip(read_size):
+    data = bytes(range(256)) * 1000
+    assert read_snapshot(make_snapshot(data), read_size) == data
+
+
+def test_corrupted_snapshot():
+    data = bytes(range(256)) * 1000
+    snapshot = make_snapshot(data)
+    for corrupted in [b'X' + snapshot[1:],
+                      snapshot[:-10],
+                      snapshot[:-10] + b'\0' * 10,
+                      snapshot[:20]]:
+        with pytest.raises(ValueError):
+            read_snapshot(corrupted, 8192)
+
+
+def make_header(header):
+    header_json = json.dumps(header).encode()
+    return io.BytesIO(MAGIC + HEADER_LENGTH.pack(len(header_json))
+                      + header_json)
+
+
+@pytest.mark.parametrize('header', [
+    [],
+    {'format': 1},
+    {'format': 1, 'size': 10},
+    {'format': 1, 'size': '10', 'sha256': ''},
+    {'format': 2, 'size': 10, 'sha256': ''},
+])
+def test_incorrect_header(header):
+    with pytest.raises(ValueError):
+        read_header(make_header(header))
+
+
+def test_too_long_header():
+    file_object = make_header({'format': 1, 'size': 10, 'sha256': '',
+                               'padding': ' ' * MAX_HEADER_LENGTH})
+    with pytest.raises(ValueError):
+        read_header(file_object)
+
+
+def test_snapshot_routes(monkeypatch):
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    monkeypatch.setattr(run, 'storage', PostgresEngine())
+    client = run.app.test_client()
+    import_id = post_import(client, create_random_citizens())
+    response = client.get('/imports/{}/snapshot'.format(import_id))
+    assert response.status_code == 200
+    snapshot = response.get_data()
+
+    response = client.post('/imports/snapshot', data=snapshot)
+    assert response.status_code == 201
+    restored_id = response.get_json()['data']['import_id']
+    assert restored_id != import_id
+    assert get_citizens(client, restored_id) \
+        == get_citizens(client, import_id)
+    birthdays_url = '/imports/{}/citizens/birthdays'
+    assert get_data(client, birthdays_url.format(restored_id)) \
+        == get_data(client, birthdays_url.format(import_id))
+    response = client.patch('/imports/{}/citizens/1'.format(restored_id),
+                            json={'relatives': []})
+    assert response.status_code == 200
+
+    for data in [snapshot[:-100], snapshot[:100], b'']:
+        response = client.post('/imports/snapshot', data=data)
+        assert response.status_code == 400
+    response = client.get('/imports/{}/snapshot'.format(import_id + 1000))
+    assert response.status_code == 400
+
+
+def test_snapshot_routes_memory_engine(monkeypatch):
+    monkeypatch.setattr(run, 'storage', MemoryEngine())
+    client = run.app.test_client()
+    import_id = post_import(client, create_random_citizens(10, 10))
+    response = client.get('/imports/{}/snapshot'.format(import_id))
+    assert response.status_code == 501
+    response = client.post('/imports/snapshot', data=b'')
+    assert response.status_code == 501
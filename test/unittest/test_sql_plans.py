@@ -0,0 +1,74 @@
+"""
+Tests, that queries from api_tools/sql_queries.py use indexes.
+"""
+import pytest
+import psycopg2
+
+from api_tools.citizen import Citizen
+from api_tools.db_tools import DB_CREDENTIALS, save_new_import
+from api_tools.sql_queries import (
+    SET_TIMEZONE_SQL,
+    GET_BIRTHDAYS_SQL,
+    GET_AGES_SQL,
+    ADD_RELATIVE_SQL,
+)
+from test_api import (
+    run,
+    is_postgres_available,
+    create_random_citizens,
+)
+
+
+@pytest.fixture(scope='module')
+def import_id():
+    if not is_postgres_available():
+        pytest.skip('PostgreSQL is not available.')
+    with run.app.app_context():
+        import_json = save_new_import([
+            Citizen.from_dict(citizen_data)
+            for citizen_data in create_random_citizens(3000, 3000)])
+    return import_json['import_id']
+
+
+@pytest.fixture
+def explain(import_id):
+    """
+    Return plan of query. Sequential scans are turned off,
+    so we check that index can be used, not that it's cheaper
+    for small test table.
+    """
+    conn = psycopg2.connect(**DB_CREDENTIALS)
+    cur = conn.cursor()
+    cur.execute(SET_TIMEZONE_SQL)
+    cur.execute('SET enable_seqscan = off;')
+
+    def get_plan(sql, params=None, analyze=False):
+        options = '(ANALYZE, COSTS OFF)' if analyze else '(COSTS OFF)'
+        cur.execute('EXPLAIN {} '.format(options)
+                    + sql.format(import_id=import_id, citizen_id=1),
+                    params)
+        return '\n'.join(row[0] for row in cur.fetchall())
+
+    yield get_plan
+    conn.rollback()
+    conn.close()
+
+
+def test_birthdays_plan(explain):
+    plan = explain(GET_BIRTHDAYS_SQL)
+    assert 'Join' not in plan
+    assert 'birth_month' in plan
+    assert 'date_part' not in plan
+
+
+def test_ages_plan(import_id, explain):
+    plan = explain(GET_AGES_SQL, analyze=True)
+    assert ('Index Only Scan using import_{}_town_birth_date_idx'
+            .format(import_id)) in plan
+    # Visibility map is filled after import.
+    assert 'Heap Fetches: 0' in plan
+
+
+def test_add_relative_plan(import_id, explain):
+    plan = explain(ADD_RELATIVE_SQL, ([2, 3],))
+    assert 'import_{}_pkey'.format(import_id) in plan
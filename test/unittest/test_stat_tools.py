@@ -0,0 +1,34 @@
+"""
+Tests for api_tools/stat_tools.py
+"""
+import random
+from collections import Counter
+
+import pytest
+from api_tools.stat_tools import (
+    percentile_cont,
+    percentile_cont_histogram,
+    round_percentile,
+)
+
+ROUNDING_TEST = [
+    (1.005, 1.01),
+    (2.675, 2.68),
+    (30.0, 30.0),
+    (45.999, 46.0),
+]
+
+
+@pytest.mark.parametrize('number', [1, 2, 3, 10, 1001])
+@pytest.mark.parametrize('fraction', [0.5, 0.75, 0.99])
+def test_percentile_cont_histogram(number, fraction):
+    random.seed(number)
+    values = sorted(random.randrange(100) for _ in range(number))
+    values_counts = sorted(Counter(values).items())
+    assert (percentile_cont_histogram(values_counts, fraction)
+            == percentile_cont(values, fraction))
+
+
+@pytest.mark.parametrize('value,rounded', ROUNDING_TEST)
+def test_round_percentile(value, rounded):
+    assert round_percentile(value) == rounded
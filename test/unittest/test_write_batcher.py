@@ -0,0 +1,86 @@
+"""
+Tests for api_tools/write_batcher.py
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from api_tools.write_batcher import WriteBatcher
+
+WRITERS_NUMBER = 20
+
+
+class Storage:
+    """
+    apply for batcher: values are saved in order, negative ones fail.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = []
+        self.values = []
+
+    def __call__(self, key, writes):
+        with self.lock:
+            self.batches.append(len(writes))
+        for write in writes:
+            value, = write.args
+            if value < 0:
+                write.error = ValueError(value)
+                continue
+            self.values.append((key, value))
+            write.result = len(self.values)
+
+
+def test_batches():
+    storage = Storage()
+    batcher = WriteBatcher(storage, max_size=5, max_delay=10)
+    with ThreadPoolExecutor(max_workers=WRITERS_NUMBER) as executor:
+        results = list(executor.map(lambda value: batcher.do('key', value),
+                                    range(WRITERS_NUMBER)))
+    # Full batches don't wait for max_delay.
+    assert storage.batches == [5] * (WRITERS_NUMBER // 5)
+    assert sorted(results) == list(range(1, WRITERS_NUMBER + 1))
+    # Every writer gets its own result.
+    for value, result in enumerate(results):
+        assert storage.values[result - 1] == ('key', value)
+    assert (batcher.batches, batcher.writes) == (4, WRITERS_NUMBER)
+    assert batcher.open_batches == {} and batcher.last_batches == {}
+
+
+def test_order():
+    """
+    Writes of one caller are applied in order of calls,
+    batches of the same key -- one by one.
+    """
+    storage = Storage()
+    batcher = WriteBatcher(storage, max_size=3, max_delay=0.001)
+
+    def write_values(first):
+        return [batcher.do('key', value)
+                for value in range(first, first + 10)]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(write_values, [0, 100, 200, 300]))
+    for first in [0, 100, 200, 300]:
+        assert [value for _, value in storage.values
+                if first <= value < first + 10] \
+            == list(range(first, first + 10))
+
+
+def test_errors():
+    storage = Storage()
+    batcher = WriteBatcher(storage, max_size=2, max_delay=1)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(batcher.do, 'key', value)
+                   for value in [-1, 1]]
+    with pytest.raises(ValueError):
+        futures[0].result()
+    assert futures[1].result() == 1
+
+    def broken_apply(key, writes):
+        raise ZeroDivisionError
+
+    batcher = WriteBatcher(broken_apply, max_size=2, max_delay=0.001)
+    with pytest.raises(ZeroDivisionError):
+        batcher.do('key', 1)
+    assert batcher.last_batches == {}